@@ -0,0 +1,206 @@
+# admission.py
+# Admission control and load shedding.
+# Every request belongs to a cost class. Each class has its own concurrency limit and a
+# bounded FIFO wait queue with a deadline, so LLM-bound requests (assessment submission,
+# resume analysis) can fill their own slots without delaying cheap reads such as
+# /assessment/questions or /users/me. A request that finds its class's queue full, or is
+# not admitted before the deadline, gets an immediate 503 with a Retry-After estimate
+# instead of timing out after the client has given up.
+
+import asyncio
+import collections
+import math
+import os
+import time
+from typing import Dict, Optional
+
+from starlette.responses import JSONResponse
+
+
+def _env_limits(name: str, concurrency: int, queue: int, wait_seconds: float) -> dict:
+    prefix = f"ADMISSION_{name.upper()}_"
+    return {
+        "concurrency": int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+        "max_queue": int(os.getenv(prefix + "QUEUE", str(queue))),
+        "max_wait": float(os.getenv(prefix + "WAIT_SECONDS", str(wait_seconds))),
+    }
+
+
+# --- Configuration ---
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+CLASS_LIMITS = {
+    # LLM-bound requests that take seconds each.
+    "expensive": _env_limits("expensive", concurrency=8, queue=16, wait_seconds=10),
+    # Operator uploads and exports; a few at a time is plenty. Job status polls stay "standard".
+    "bulk": _env_limits("bulk", concurrency=2, queue=4, wait_seconds=5),
+    # Everything else: short database reads and writes that should stay fast.
+    "standard": _env_limits("standard", concurrency=64, queue=128, wait_seconds=2),
+}
+# (method or None for any, path prefix, class). The first match wins; unmatched requests are "standard".
+ROUTE_CLASSES = [
+    ("POST", "/assessment/submit", "expensive"),
+    ("POST", "/users/me/resume", "expensive"),
+    ("POST", "/assessment/batch", "bulk"),
+    ("POST", "/admin/resumes/ingest", "bulk"),
+    ("GET", "/admin/export/", "bulk"),
+]
+# Never queued or shed, so load balancers and operators can always reach them.
+EXEMPT_PATHS = {"/", "/admin/admission/stats"}
+MAX_RETRY_AFTER_SECONDS = 60
+# Weight of the newest request in the moving average of service time.
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionClass:
+    """A concurrency limit with a bounded FIFO queue of waiters."""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: collections.deque = collections.deque()
+        self.admitted = 0
+        self.waited = 0
+        self.wait_seconds_total = 0.0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.peak_queued = 0
+        self.service_seconds = 0.0  # Moving average
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """Waits for a slot. Returns False if the request should be shed."""
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.shed_queue_full += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.peak_queued = max(self.peak_queued, len(self._waiters))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()  # The slot was handed over just as the client went away; pass it on
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+                self.shed_timeout += 1
+                return False
+            # Otherwise the slot was handed over right at the deadline; take it.
+        self.admitted += 1
+        self.waited += 1
+        self.wait_seconds_total += time.monotonic() - started
+        return True
+
+    def release(self):
+        """Hands the slot to the oldest waiter, or frees it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def record_service_time(self, seconds: float):
+        if self.service_seconds:
+            self.service_seconds += SERVICE_TIME_SMOOTHING * (seconds - self.service_seconds)
+        else:
+            self.service_seconds = seconds
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained."""
+        estimate = self.service_seconds * (self.queued + 1) / max(self.concurrency, 1)
+        return min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(estimate)))
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "active": self.active,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "avg_wait_ms": round(self.wait_seconds_total / self.waited * 1000, 1) if self.waited else 0.0,
+            "avg_service_ms": round(self.service_seconds * 1000, 1),
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+        }
+
+
+class AdmissionController:
+    """Holds the admission classes of this worker process and maps requests to them."""
+
+    def __init__(self, limits: Dict[str, dict] = CLASS_LIMITS, routes=ROUTE_CLASSES):
+        self.classes = {name: AdmissionClass(name, **config) for name, config in limits.items()}
+        self.routes = routes
+
+    def classify(self, method: str, path: str) -> Optional[AdmissionClass]:
+        if path in EXEMPT_PATHS:
+            return None
+        for route_method, prefix, name in self.routes:
+            if (route_method is None or route_method == method) and path.startswith(prefix):
+                return self.classes[name]
+        return self.classes["standard"]
+
+    def stats(self) -> dict:
+        return {name: admission_class.stats() for name, admission_class in self.classes.items()}
+
+
+controller = AdmissionController()
+
+
+class AdmissionControlMiddleware:
+    """
+    Pure ASGI middleware that admits each request through its class's limit. The slot is
+    held until the response has been sent, including streamed bodies.
+    """
+
+    def __init__(self, app, controller: AdmissionController = controller, enabled: bool = ADMISSION_CONTROL_ENABLED):
+        self.app = app
+        self.controller = controller
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        admission_class = self.controller.classify(scope["method"], scope["path"])
+        if admission_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await admission_class.acquire():
+            retry_after = admission_class.retry_after()
+            print(f"--- ADMISSION: Shed {scope['method']} {scope['path']} ({admission_class.name}, {admission_class.queued} queued) ---")
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "The server is busy. Please try again shortly."},
+                headers={"Retry-After": str(retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_class.record_service_time(time.monotonic() - started)
+            admission_class.release()
@@ -3,9 +3,11 @@
 # CORRECTED: Using a more robust method to find and load the .env file.
 
 import os
+import re
+import asyncio
 import google.generativeai as genai
 from dotenv import load_dotenv, find_dotenv # Import find_dotenv
-import json
+from typing import Optional
 
 # Use find_dotenv() to reliably locate the .env file
 load_dotenv(find_dotenv())
@@ -17,13 +19,24 @@ genai.configure(api_key=GEMINI_API_KEY)
 # Initialize the generative model
 model = genai.GenerativeModel('gemini-1.5-flash')
 
-def build_assessment_prompt(categories_summary: dict, incorrect_answers: list) -> str:
-    """Builds a detailed prompt for the AI model to get both feedback and course suggestions."""
+# Upper bound on concurrent requests to the AI model from this process, shared by
+# interactive requests and background jobs such as bulk resume ingestion.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+_llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+async def _generate(prompt: str):
+    async with _llm_slots:
+        return await model.generate_content_async(prompt)
+
+def build_assessment_prompt(categories_summary: dict, incorrect_answers: list, recommended_courses: Optional[list] = None, percentiles: Optional[dict] = None) -> str:
+    """
+    Builds a detailed prompt for the AI model to get the performance report.
+    Course suggestions come from course_recommender, so the model only references them.
+    """
     
     prompt = """
-    You are an expert career coach. Based on the following Job Readiness Index (JRI) assessment results, provide two things:
-    1. A concise, encouraging, and actionable performance report in Markdown format. The report must include these sections: 'Overall Summary', 'Key Strengths', 'Areas for Improvement', and 'Action Plan'.
-    2. A list of 3 course suggestions to address the user's weakest areas.
+    You are an expert career coach. Based on the following Job Readiness Index (JRI) assessment results,
+    write a concise, encouraging, and actionable performance report in Markdown format. The report must include these sections: 'Overall Summary', 'Key Strengths', 'Areas for Improvement', and 'Action Plan'.
 
     Here is the user's performance data:
     --- PERFORMANCE BY CATEGORY ---
@@ -40,28 +53,84 @@ def build_assessment_prompt(categories_summary: dict, incorrect_answers: list) -
         for item in incorrect_answers:
             prompt += f"- Question: {item['question']}\n  - Selected Answer: {item['selected_option']}\n"
 
-    prompt += "\nReturn your response as a single JSON object with two keys: 'performance_report' (a string containing the Markdown report) and 'course_suggestions' (a list of JSON objects, where each object has 'course_name', 'platform', and 'reason' keys)."
+    if percentiles:
+        prompt += "\n--- STANDING AMONG ALL TEST TAKERS ---\n"
+        for metric, top in percentiles.items():
+            label = "Overall" if metric == "__total__" else metric
+            prompt += f"- {label}: top {top:.0f}%\n"
+
+    if recommended_courses:
+        prompt += "\n--- RECOMMENDED COURSES (mention them in the Action Plan) ---\n"
+        for course in recommended_courses:
+            prompt += f"- {course['title']} ({course['platform']})\n"
+
+    prompt += "\nReturn only the Markdown report."
     return prompt
 
-async def generate_assessment_feedback(categories_summary: dict, incorrect_answers: list) -> dict:
-    """Generates a detailed performance report and course suggestions using the AI model."""
+async def request_assessment_report(categories_summary: dict, incorrect_answers: list, recommended_courses: Optional[list] = None, percentiles: Optional[dict] = None) -> str:
+    """Asks the AI model for the Markdown performance report. Errors are raised to the caller."""
+    prompt = build_assessment_prompt(categories_summary, incorrect_answers, recommended_courses, percentiles)
+    response = await _generate(prompt)
+    # Strip a surrounding code fence if the model added one
+    return response.text.strip().removeprefix("```markdown").removeprefix("```").removesuffix("```").strip()
+
+def sanitize_report(text) -> str:
+    """Removes control characters from a generated report before it is stored or emailed."""
+    if not isinstance(text, str):
+        return "Analysis not available."
+    return re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
+
+async def generate_assessment_feedback(categories_summary: dict, incorrect_answers: list, recommended_courses: Optional[list] = None, percentiles: Optional[dict] = None) -> dict:
+    """Generates a detailed performance report using the AI model."""
     try:
-        prompt = build_assessment_prompt(categories_summary, incorrect_answers)
-        response = await model.generate_content_async(prompt)
-        # Clean up the response to ensure it's valid JSON
-        cleaned_text = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(cleaned_text)
+        cleaned_text = await request_assessment_report(categories_summary, incorrect_answers, recommended_courses, percentiles)
+        return {"performance_report": cleaned_text}
     except Exception as e:
         print(f"Error generating AI feedback: {e}")
         # Return a default error structure
         return {
-            "performance_report": "We encountered an error generating your personalized feedback. The AI service may be temporarily unavailable.",
-            "course_suggestions": []
+            "performance_report": "We encountered an error generating your personalized feedback. The AI service may be temporarily unavailable."
         }
 
-async def analyze_resume_text(resume_text: str) -> str:
-    """Analyzes the provided resume text and returns feedback in Markdown."""
-    prompt = f"""
+def build_resume_insights_markdown(insights: dict) -> str:
+    """Renders the locally computed resume insights as a Markdown report."""
+    report = "## Skills Detected\n"
+    detected = insights.get("detected_skills") or []
+    report += (", ".join(detected) if detected else "No known skills were detected.") + "\n"
+
+    report += "\n## Best Matching Roles\n"
+    for match in insights.get("role_matches", []):
+        report += f"- **{match['role']}**: {match['match_score']:.0f}% match, {match['coverage']:.0f}% of key skills covered\n"
+
+    report += "\n## Top 5 Keywords to Add\n"
+    for keyword in insights.get("keywords_to_add", []):
+        report += f"- {keyword}\n"
+    return report
+
+async def analyze_resume_text(resume_text: str, insights: Optional[dict] = None) -> str:
+    """
+    Analyzes the provided resume text and returns feedback in Markdown.
+    If local insights from skills_engine are given, the keyword section is
+    taken from them instead of being generated by the model.
+    """
+    if insights:
+        roles = ", ".join(f"{m['role']} ({m['match_score']:.0f}% match)" for m in insights.get("role_matches", []))
+        keywords = ", ".join(insights.get("keywords_to_add", []))
+        prompt = f"""
+    You are an expert resume reviewer for tech and business roles. Analyze the following resume text.
+    Provide a concise, actionable critique in Markdown format with these sections:
+    'Overall Impression', 'Strengths', and 'Areas for Improvement'. Do not list keywords.
+
+    Best matching roles: {roles}
+    Missing keywords already identified: {keywords}
+
+    --- RESUME TEXT ---
+    {resume_text}
+    --- END RESUME TEXT ---\n
+    Generate the report now.
+    """
+    else:
+        prompt = f"""
     You are an expert resume reviewer for tech and business roles. Analyze the following resume text.
     Provide a concise, actionable critique in Markdown format. The report must include these sections:
     'Overall Impression', 'Strengths', 'Areas for Improvement', and 'Top 5 Keywords to Add'.
@@ -72,8 +141,13 @@ async def analyze_resume_text(resume_text: str) -> str:
     Generate the report now.
     """
     try:
-        response = await model.generate_content_async(prompt)
+        response = await _generate(prompt)
+        if insights:
+            return response.text.rstrip() + "\n\n" + build_resume_insights_markdown(insights)
         return response.text
     except Exception as e:
         print(f"Error analyzing resume: {e}")
+        if insights:
+            # The local insights are still useful when the AI service is down.
+            return build_resume_insights_markdown(insights)
         return "We encountered an error analyzing your resume. The AI service may be temporarily unavailable."
@@ -0,0 +1,124 @@
+# archive_uploader.py
+# Background archival of uploaded resume files to Cloudinary.
+# The request handler copies the file to a local spool directory and records a
+# ResumeUpload row; this worker uploads it later with bounded concurrency and
+# exponential-backoff retries (see leased_jobs.py), then stores the URL on the user record.
+# Because retry state lives in the database, pending uploads survive restarts.
+
+import asyncio
+import os
+import shutil
+import uuid
+from typing import BinaryIO, Optional
+
+import cloudinary_service
+import crud
+import leased_jobs
+from database import SessionLocal
+
+# --- Configuration ---
+SPOOL_DIR = os.getenv("RESUME_SPOOL_DIR", os.path.join("uploaded_resumes", "pending"))
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "3"))
+MAX_ATTEMPTS = 6
+BASE_BACKOFF_SECONDS = 30
+POLL_INTERVAL_SECONDS = 30
+# A claimed upload is handed to another worker if it has not finished within this time.
+CLAIM_LEASE_SECONDS = 10 * 60
+
+
+def save_for_upload(user_id: int, filename: str, stream: BinaryIO, mimetype: str) -> Optional[int]:
+    """
+    Copies an uploaded file to the spool directory and queues it for archival.
+    Returns the ResumeUpload id, or None if Cloudinary is not configured.
+    """
+    if not cloudinary_service.IS_CONFIGURED:
+        print("--- ARCHIVE: Cloudinary is not configured. Skipping archival upload. ---")
+        return None
+
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, uuid.uuid4().hex)
+    stream.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(stream, out, 1024 * 1024)
+    stream.seek(0)
+
+    db = SessionLocal()
+    try:
+        return crud.create_resume_upload(db, user_id=user_id, filename=filename, file_path=path, mimetype=mimetype).id
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        db.close()
+
+
+def _claim_due(limit: int):
+    db = SessionLocal()
+    try:
+        return [
+            (u.id, u.user_id, u.filename, u.file_path, u.mimetype, u.attempts)
+            for u in crud.claim_due_resume_uploads(db, limit=limit, lease_seconds=CLAIM_LEASE_SECONDS)
+        ]
+    finally:
+        db.close()
+
+
+def _record_success(upload_id: int, url: str, path: str):
+    db = SessionLocal()
+    try:
+        crud.complete_resume_upload(db, upload_id=upload_id, url=url)
+    finally:
+        db.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _record_failure(upload_id: int, error: str, attempts: int, path: str):
+    retry_at = leased_jobs.retry_at(attempts, MAX_ATTEMPTS, BASE_BACKOFF_SECONDS)
+    db = SessionLocal()
+    try:
+        crud.fail_resume_upload(db, upload_id=upload_id, error=error, retry_at=retry_at)
+    finally:
+        db.close()
+    if retry_at is None:
+        # Given up for good; the spool copy would never be read again.
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ArchiveUploader(leased_jobs.LeasedJobWorker):
+    """Polls for due uploads and runs at most `concurrency` of them at once."""
+
+    log_tag = "ARCHIVE"
+
+    def __init__(self, concurrency: int = MAX_CONCURRENT_UPLOADS):
+        super().__init__(concurrency, POLL_INTERVAL_SECONDS)
+
+    def claim(self, limit: int):
+        return _claim_due(limit)
+
+    async def stop(self):
+        # The uploads share the HTTP client, so it is closed only after they are done.
+        await super().stop()
+        await cloudinary_service.close_async_client()
+
+    async def process(self, upload_id: int, user_id: int, filename: str, path: str, mimetype: str, attempts: int):
+        try:
+            # The spool file name is unique per upload, so retries overwrite their own object.
+            public_id = cloudinary_service.resume_public_id(user_id, filename, unique=os.path.basename(path))
+            url = await cloudinary_service.upload_path_to_cloudinary_async(public_id, filename, path, mimetype)
+            await asyncio.to_thread(_record_success, upload_id, url, path)
+        except Exception as e:
+            print(f"--- ARCHIVE ERROR: Upload {upload_id} attempt {attempts} failed: {e} ---")
+            try:
+                await asyncio.to_thread(_record_failure, upload_id, str(e), attempts, path)
+            except Exception as db_error:
+                # The claim lease expires on its own, so the upload will be retried anyway.
+                print(f"--- ARCHIVE ERROR: Could not record failure for upload {upload_id}: {db_error} ---")
+
+
+uploader = ArchiveUploader()
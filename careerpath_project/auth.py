@@ -3,16 +3,16 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 import secrets
+import hashlib
 
 from fastapi import Depends, HTTPException, status, APIRouter
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from dotenv import load_dotenv, find_dotenv
 
 # These are needed for the router and dependencies
-import crud, models, schemas, email_service, user_logger
+import crud, schemas, email_service, user_logger
 from database import SessionLocal
 
 load_dotenv(find_dotenv())
@@ -23,7 +23,6 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 
 MAGIC_LINK_EXPIRE_MINUTES = 15
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # --- Helper Functions (Token Logic) ---
@@ -47,13 +46,17 @@ def verify_access_token(token: str, credentials_exception):
     except JWTError:
         raise credentials_exception
 
+# Magic link and invitation tokens are stored as a SHA-256 digest instead of a bcrypt hash.
+# The token is 256 random bits, so a slow hash adds no protection, and a digest is looked up
+# directly at login instead of being compared against every live token one by one.
+def digest_magic_link_token(plain_token: str) -> str:
+    return hashlib.sha256(plain_token.encode("utf-8")).hexdigest()
+
 def create_magic_link_token() -> (str, str):
     plain_token = secrets.token_urlsafe(32)
-    token_hash = pwd_context.hash(plain_token)
-    return plain_token, token_hash
+    return plain_token, digest_magic_link_token(plain_token)
 
-def verify_magic_link_token(plain_token: str, hashed_token: str) -> bool:
-    return pwd_context.verify(plain_token, hashed_token)
+create_invite_token = create_magic_link_token
 
 # --- FastAPI Router ---
 router = APIRouter()
@@ -92,12 +95,7 @@ async def request_magic_link(request: schemas.MagicLinkRequest, db: Session = De
 
 @router.post("/magic-link/login", response_model=schemas.Token)
 async def login_with_magic_link(request: schemas.MagicLinkLogin, db: Session = Depends(get_db)):
-    all_tokens = db.query(models.MagicToken).filter(models.MagicToken.is_used == False).all()
-    db_token_record = None
-    for token_record in all_tokens:
-        if verify_magic_link_token(request.token, token_record.token_hash):
-            db_token_record = crud.use_magic_token(db, token_hash=token_record.token_hash)
-            break
+    db_token_record = crud.use_magic_token(db, token_hash=digest_magic_link_token(request.token))
     if not db_token_record:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
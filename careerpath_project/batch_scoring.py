@@ -0,0 +1,244 @@
+# batch_scoring.py
+# Bulk scoring of answer sheets for institutional exam sessions.
+# A whole class is scored in one vectorized NumPy pass over an options x points matrix,
+# assessments and answers are bulk-inserted per chunk, and the AI reports are left to
+# the rate-limited feedback_queue worker.
+#
+# Input is CSV (one answer per row: email, question_id, selected_option_id and an optional
+# sheet_id to tell several sheets of one student apart) or NDJSON (one sheet per line:
+# {"email": ..., "answers": [{"question_id": ..., "selected_option_id": ...}]}).
+#
+# Run it directly: python batch_scoring.py sheets.csv [--format ndjson] [--no-email]
+
+import argparse
+import csv
+import io
+import json
+import os
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+import course_recommender
+import crud
+import invitations
+import models
+
+# --- Configuration ---
+# Sheets written per transaction.
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "1000"))
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(50 * 1024 * 1024)))
+# Per-line errors returned to the caller; the rest are only counted.
+MAX_REPORTED_ERRORS = 100
+FEEDBACK_PENDING_TEXT = "Your personalized report is being generated and will appear here shortly."
+
+CSV_COLUMNS = ("email", "question_id", "selected_option_id")
+
+
+class ScoringMatrix:
+    """Sorted option and question lookup arrays, so a whole batch is scored with array operations."""
+
+    def __init__(self, options: List[Tuple[int, int, float]], questions: List[Tuple[int, str]]):
+        options = sorted(options)
+        self.option_ids = np.array([o[0] for o in options], dtype=np.int64)
+        self.option_points = np.array([o[2] for o in options], dtype=np.float64)
+
+        questions = sorted(questions)
+        self.categories = sorted({category for _, category in questions})
+        category_index = {category: i for i, category in enumerate(self.categories)}
+        self.question_ids = np.array([q[0] for q in questions], dtype=np.int64)
+        self.question_category = np.array([category_index[q[1]] for q in questions], dtype=np.int64)
+
+        # Max points per question: the best option's points.
+        self.question_max = np.zeros(len(questions), dtype=np.float64)
+        if len(options) and len(questions):
+            option_question = np.array([o[1] if o[1] is not None else -1 for o in options], dtype=np.int64)
+            positions, found = _lookup(self.question_ids, option_question)
+            np.maximum.at(self.question_max, positions[found], self.option_points[found])
+
+    @classmethod
+    def from_db(cls, db: Session) -> "ScoringMatrix":
+        options = db.query(models.Option.id, models.Option.question_id, models.Option.points).all()
+        questions = db.query(models.Question.id, models.Question.category).all()
+        return cls([tuple(o) for o in options], [(q.id, q.category or "") for q in questions])
+
+    def score(self, answers: List[List[Tuple[int, int]]]):
+        """
+        Scores many sheets at once. Returns (scores, summaries, valid_answers): the total score per
+        sheet, its categories_summary as submit_assessment builds it, and the answers that refer to
+        known questions and options. Unknown ids are skipped, as in submit_assessment.
+        """
+        sheet_count, category_count = len(answers), len(self.categories)
+        lengths = np.fromiter((len(a) for a in answers), dtype=np.int64, count=sheet_count)
+        flat = np.array([pair for sheet in answers for pair in sheet], dtype=np.int64).reshape(-1, 2)
+        sheet_index = np.repeat(np.arange(sheet_count), lengths)
+
+        question_pos, question_found = _lookup(self.question_ids, flat[:, 0])
+        option_pos, option_found = _lookup(self.option_ids, flat[:, 1])
+        valid = question_found & option_found
+
+        cells = sheet_index[valid] * category_count + self.question_category[question_pos[valid]]
+        size = sheet_count * category_count
+        scored = np.bincount(cells, weights=self.option_points[option_pos[valid]], minlength=size).reshape(sheet_count, category_count)
+        totals = np.bincount(cells, weights=self.question_max[question_pos[valid]], minlength=size).reshape(sheet_count, category_count)
+        answered = np.bincount(cells, minlength=size).reshape(sheet_count, category_count) > 0
+
+        scores = scored.sum(axis=1)
+        summaries = []
+        for row in range(sheet_count):
+            summaries.append({
+                self.categories[c]: {'score': float(scored[row, c]), 'total': float(totals[row, c])}
+                for c in np.flatnonzero(answered[row])
+            })
+        valid_by_sheet = np.split(flat[valid], np.cumsum(np.bincount(sheet_index[valid], minlength=sheet_count))[:-1])
+        valid_answers = [[(int(q), int(o)) for q, o in pairs] for pairs in valid_by_sheet]
+        return scores.tolist(), summaries, valid_answers
+
+
+def _lookup(sorted_ids: np.ndarray, values: np.ndarray):
+    """Returns (positions, found) of values in a sorted id array."""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_ids, values), len(sorted_ids) - 1)
+    return positions, sorted_ids[positions] == values
+
+
+# --- Parsing ---
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or (content_type or "").endswith("ndjson"):
+        return "ndjson"
+    return "csv"
+
+
+def parse_sheets(stream: BinaryIO, file_format: str, errors: List[dict]) -> List[Tuple[str, List[Tuple[int, int]]]]:
+    """Reads (email, [(question_id, option_id)]) sheets from a CSV or NDJSON byte stream."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        return _parse_ndjson(text, errors) if file_format == "ndjson" else _parse_csv(text, errors)
+    finally:
+        text.detach()
+
+
+def _sheet_email(raw) -> str:
+    """Validates a sheet's email the same way invitations and resume ingestion do."""
+    raw = str(raw or "").strip()
+    if not raw:
+        raise ValueError("email is empty")
+    valid, _ = invitations.normalize_emails([raw])
+    if not valid:
+        raise ValueError(f"'{raw}' is not a valid email address")
+    return valid[0].lower()
+
+
+def _parse_csv(text: Iterable[str], errors: List[dict]):
+    reader = csv.DictReader(text)
+    missing = [c for c in CSV_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing required columns: {', '.join(missing)}")
+
+    sheets: Dict[Tuple[str, str], List[Tuple[int, int]]] = {}
+    for line, row in enumerate(reader, start=2):
+        try:
+            email = _sheet_email(row["email"])
+            answer = (int(row["question_id"]), int(row["selected_option_id"]))
+        except (TypeError, ValueError, AttributeError) as e:
+            errors.append({"line": line, "error": f"Invalid row: {e}"})
+            continue
+        sheets.setdefault((email, (row.get("sheet_id") or "").strip()), []).append(answer)
+    return [(email, answers) for (email, _), answers in sheets.items()]
+
+
+def _parse_ndjson(text: Iterable[str], errors: List[dict]):
+    sheets = []
+    for line, raw in enumerate(text, start=1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+            email = _sheet_email(record["email"])
+            answers = [(int(a["question_id"]), int(a["selected_option_id"])) for a in record["answers"]]
+        except (TypeError, ValueError, KeyError) as e:
+            errors.append({"line": line, "error": f"Invalid record: {e}"})
+            continue
+        sheets.append((email, answers))
+    return sheets
+
+
+# --- Scoring and storage ---
+
+def score_batch(db: Session, stream: BinaryIO, file_format: str, send_email: bool = True) -> dict:
+    """
+    Scores every sheet in the stream, stores the assessments chunk by chunk and queues their
+    AI feedback. Returns a summary with per-line errors.
+    """
+    errors: List[dict] = []
+    sheets = parse_sheets(stream, file_format, errors)
+    matrix = ScoringMatrix.from_db(db)
+
+    scored_count, assessment_ids = 0, []
+    for start in range(0, len(sheets), BATCH_CHUNK_SIZE):
+        chunk = sheets[start:start + BATCH_CHUNK_SIZE]
+        scores, summaries, valid_answers = matrix.score([answers for _, answers in chunk])
+
+        rows = []
+        for (email, _), score, summary, answers in zip(chunk, scores, summaries, valid_answers):
+            if not answers:
+                errors.append({"email": email, "error": "No answers refer to known questions and options."})
+                continue
+            rows.append({
+                "email": email, "score": score, "answers": answers, "categories_summary": summary,
+                "course_suggestions": json.dumps(course_recommender.recommend_courses(summary)),
+            })
+        if not rows:
+            continue
+
+        user_ids = crud.get_or_create_users(db, sorted({r["email"] for r in rows}))
+        for r in rows:
+            r["user_id"] = user_ids[r["email"]]
+        ids = crud.create_assessments_bulk(db, rows, analysis=FEEDBACK_PENDING_TEXT)
+        crud.create_feedback_jobs(db, ids, send_email=send_email)
+        db.commit()
+
+        scored_count += len(ids)
+        assessment_ids.extend(ids)
+        print(f"--- BATCH: Stored {scored_count} of {len(sheets)} sheets ---")
+
+    return {
+        "sheets": len(sheets),
+        "scored": scored_count,
+        "error_count": len(errors),
+        "errors": errors[:MAX_REPORTED_ERRORS],
+        "assessment_ids": assessment_ids,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a batch of JRI answer sheets.")
+    parser.add_argument("path", help="CSV or NDJSON file with the answer sheets")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Defaults to the file extension")
+    parser.add_argument("--no-email", action="store_true", help="Do not email the reports to students")
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+    import migrations
+    models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
+
+    db = SessionLocal()
+    try:
+        with open(args.path, "rb") as stream:
+            result = score_batch(db, stream, args.format or detect_format(args.path), send_email=not args.no_email)
+    finally:
+        db.close()
+
+    print(f"Scored {result['scored']} of {result['sheets']} sheets, {result['error_count']} errors.")
+    for error in result["errors"]:
+        print(f"  {error}")
+    print("AI feedback is generated by the API server's feedback worker.")
+
+
+if __name__ == "__main__":
+    main()
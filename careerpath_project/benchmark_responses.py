@@ -0,0 +1,93 @@
+# benchmark_responses.py
+# Measures the bytes and CPU time saved per endpoint by orjson serialization and
+# gzip/Brotli compression. Payloads are synthetic but shaped like real responses.
+# Run it directly: python benchmark_responses.py
+
+import json
+import time
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+import http_responses
+
+ITERATIONS = 200
+
+
+def _timed(func, iterations: int = ITERATIONS) -> float:
+    """Returns the mean wall time of func() in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def _report_markdown(i: int) -> str:
+    return (
+        f"## Overall Summary\nAttempt {i}: solid progress across most categories.\n\n"
+        "## Key Strengths\n- Communication\n- Academic record\n- Task monitoring\n\n"
+        "## Areas for Improvement\n- Technical/Domain Expertise: practise Tally and advanced Excel.\n"
+        "- Mock Interviews: schedule at least two per month.\n\n"
+        "## Action Plan\n1. Complete one certification.\n2. Apply for an internship.\n3. Present at a college event.\n"
+    ) * 3
+
+
+def build_payloads() -> dict:
+    """Builds representative payloads for the large-response endpoints."""
+    now = datetime.utcnow()
+    assessments = [
+        {
+            "id": i, "owner_id": 1, "score": 150.0 + i, "created_at": now,
+            "analysis": _report_markdown(i),
+            "course_suggestions": json.dumps([{"title": "Tally Prime with GST", "platform": "NIIT", "description": "Hands-on GST returns."}] * 3),
+        }
+        for i in range(30)
+    ]
+    questions = [
+        {
+            "id": i, "text": f"How equipped are you to work on an Accounting Software or ERP? ({i})",
+            "category": "Technical/Domain Expertise",
+            "options": [{"id": i * 4 + j, "text": f"Option {j}", "points": float(j * 5)} for j in range(4)],
+        }
+        for i in range(100)
+    ]
+    user = {
+        "id": 1, "email": "student@example.com", "is_active": True, "created_at": now,
+        "resume_text": "Experienced in Tally Prime, GST filing, advanced Excel and Power BI. " * 150,
+        "resume_analysis": _report_markdown(0),
+        "assessments": assessments[:10],
+    }
+    return {
+        "/users/me": user,
+        "/assessment/history": assessments,
+        "/assessment/questions": questions,
+    }
+
+
+def main():
+    payloads = build_payloads()
+    response = http_responses.FastJSONResponse(content=None)
+    encodings = ["gzip"] + (["br"] if http_responses.brotli is not None else [])
+
+    header = f"{'endpoint':<24}{'json ms':>9}{'orjson ms':>11}{'raw bytes':>11}"
+    for encoding in encodings:
+        header += f"{encoding + ' bytes':>12}{encoding + ' ms':>9}"
+    print(header)
+    print("-" * len(header))
+
+    for endpoint, payload in payloads.items():
+        content = jsonable_encoder(payload)
+        stdlib_ms = _timed(lambda: json.dumps(content).encode("utf-8"))
+        fast_ms = _timed(lambda: response.render(content))
+        body = response.render(content)
+
+        row = f"{endpoint:<24}{stdlib_ms:>9.3f}{fast_ms:>11.3f}{len(body):>11}"
+        for encoding in encodings:
+            compressed = http_responses.compress_bytes(body, encoding)
+            compress_ms = _timed(lambda: http_responses.compress_bytes(body, encoding), iterations=50)
+            row += f"{len(compressed):>12}{compress_ms:>9.3f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
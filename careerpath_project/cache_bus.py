@@ -0,0 +1,260 @@
+# cache_bus.py
+# Cross-process cache invalidation.
+# Each cached dataset is a topic with a version number that only grows. Whoever changes the
+# data calls publish(topic): the shared version is bumped and an invalidation message is
+# broadcast to every worker process. A cache remembers the version it was loaded at and
+# reloads once version(topic) has moved past it, so caches stay valid indefinitely instead
+# of expiring on a short TTL.
+#
+# Backends:
+#   postgres - versions live in the cache_versions table; messages go out with NOTIFY in the
+#              same transaction and arrive through LISTEN on a dedicated connection.
+#   local    - for several processes on one host (tests, local gunicorn): versions live in a
+#              JSON file and messages are Unix datagrams to every worker's socket in one directory.
+#   none     - single process; publish() only updates this process.
+# After a listener reconnects, it re-reads every version, so missed messages only delay
+# an invalidation rather than lose it.
+
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import threading
+import uuid
+from typing import Dict, Optional
+
+# --- Configuration ---
+# "auto" uses postgres when the database is PostgreSQL, otherwise none.
+CACHE_BUS_BACKEND = os.getenv("CACHE_BUS_BACKEND", "auto").lower()
+CACHE_BUS_SOCKET_DIR = os.getenv("CACHE_BUS_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "jri-cache-bus"))
+CHANNEL = "cache_invalidation"
+RECONNECT_SECONDS = 5.0
+RECEIVE_TIMEOUT_SECONDS = 1.0
+
+WORKER_ID = uuid.uuid4().hex
+
+_lock = threading.Lock()
+_versions: Dict[str, int] = {}
+
+
+def version(topic: str) -> int:
+    """The newest version of `topic` this process has heard of (0 if it was never published)."""
+    return _versions.get(topic, 0)
+
+
+def _apply(topic: str, new_version: int) -> bool:
+    with _lock:
+        if new_version <= _versions.get(topic, 0):
+            return False
+        _versions[topic] = new_version
+    return True
+
+
+def _apply_message(raw: bytes):
+    try:
+        message = json.loads(raw)
+        topic, new_version = str(message["topic"]), int(message["version"])
+    except (ValueError, KeyError, TypeError):
+        print(f"--- CACHE BUS ERROR: Ignoring malformed message {raw[:100]!r} ---")
+        return
+    if message.get("origin") != WORKER_ID and _apply(topic, new_version):
+        print(f"--- CACHE BUS: {topic} is now at version {new_version} ---")
+
+
+def _encode(topic: str, new_version: int) -> str:
+    return json.dumps({"topic": topic, "version": new_version, "origin": WORKER_ID})
+
+
+class NullBackend:
+    """Single process: versions are only counted in memory."""
+
+    def publish(self, topic: str) -> int:
+        return version(topic) + 1
+
+    def current_versions(self) -> Dict[str, int]:
+        return {}
+
+    def listen(self, stop: threading.Event, on_ready):
+        on_ready()
+        stop.wait()
+
+
+class PostgresBackend:
+    """Versions in the cache_versions table, messages through LISTEN/NOTIFY."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def publish(self, topic: str) -> int:
+        """Bumps the version and sends NOTIFY in one transaction, so listeners never see a version before it is stored."""
+        from sqlalchemy import func, select
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+        import models
+        table = models.CacheVersion.__table__
+        with self.engine.begin() as conn:
+            new_version = conn.execute(
+                pg_insert(table).values(topic=topic, version=1)
+                .on_conflict_do_update(index_elements=[table.c.topic], set_={"version": table.c.version + 1})
+                .returning(table.c.version)
+            ).scalar_one()
+            conn.execute(select(func.pg_notify(CHANNEL, _encode(topic, new_version))))
+        return new_version
+
+    def current_versions(self) -> Dict[str, int]:
+        from sqlalchemy import select
+
+        import models
+        with self.engine.connect() as conn:
+            return dict(conn.execute(select(models.CacheVersion.topic, models.CacheVersion.version)).all())
+
+    def listen(self, stop: threading.Event, on_ready):
+        import select as select_module
+
+        # A connection of its own, taken out of the pool, so it can stay in LISTEN mode.
+        raw = self.engine.raw_connection()
+        raw.detach()
+        connection = raw.driver_connection
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            on_ready()
+            while not stop.is_set():
+                if select_module.select([connection], [], [], RECEIVE_TIMEOUT_SECONDS)[0]:
+                    connection.poll()
+                    while connection.notifies:
+                        _apply_message(connection.notifies.pop(0).payload.encode("utf-8"))
+        finally:
+            connection.close()
+
+
+class LocalBackend:
+    """Versions in a JSON file and messages as Unix datagrams, for processes on one host."""
+
+    def __init__(self, directory: str = CACHE_BUS_SOCKET_DIR):
+        self.directory = directory
+        self.versions_path = os.path.join(directory, "versions.json")
+        self.socket_path = os.path.join(directory, f"{os.getpid()}-{WORKER_ID[:8]}.sock")
+        os.makedirs(directory, exist_ok=True)
+
+    def _read_versions(self) -> Dict[str, int]:
+        try:
+            with open(self.versions_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def publish(self, topic: str) -> int:
+        with open(self.versions_path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            versions = self._read_versions()
+            new_version = versions[topic] = versions.get(topic, 0) + 1
+            temporary = f"{self.versions_path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(versions, f)
+            os.replace(temporary, self.versions_path)
+
+        payload = _encode(topic, new_version).encode("utf-8")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith(".sock") or path == self.socket_path:
+                    continue
+                try:
+                    sender.sendto(payload, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # The worker that owned this socket has exited.
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                except OSError as e:
+                    print(f"--- CACHE BUS ERROR: Could not notify {name}: {e} ---")
+        return new_version
+
+    def current_versions(self) -> Dict[str, int]:
+        return self._read_versions()
+
+    def listen(self, stop: threading.Event, on_ready):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as receiver:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            receiver.bind(self.socket_path)
+            receiver.settimeout(RECEIVE_TIMEOUT_SECONDS)
+            on_ready()
+            try:
+                while not stop.is_set():
+                    try:
+                        _apply_message(receiver.recv(65536))
+                    except socket.timeout:
+                        continue
+            finally:
+                os.unlink(self.socket_path)
+
+
+def _create_backend(name: str):
+    from database import engine
+    if name == "auto":
+        name = "postgres" if engine.dialect.name == "postgresql" else "none"
+    if name == "postgres":
+        return PostgresBackend(engine)
+    if name == "local":
+        return LocalBackend()
+    return NullBackend()
+
+
+class CacheBus:
+    """Publishes invalidations and keeps this process's versions current with a listener thread."""
+
+    def __init__(self, backend_name: str = CACHE_BUS_BACKEND):
+        self.backend_name = backend_name
+        self._backend = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = _create_backend(self.backend_name)
+        return self._backend
+
+    def publish(self, topic: str) -> int:
+        """Invalidates `topic` in this process immediately and in every other worker through the backend."""
+        new_version = self.backend.publish(topic)
+        _apply(topic, new_version)
+        return new_version
+
+    def catch_up(self):
+        """Adopts every stored version, covering messages sent while we were not listening."""
+        for topic, new_version in self.backend.current_versions().items():
+            _apply(topic, int(new_version))
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="cache-bus", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=RECEIVE_TIMEOUT_SECONDS + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # Catch up only once listening, so nothing sent in between is missed.
+                self.backend.listen(self._stop, on_ready=self.catch_up)
+            except Exception as e:
+                print(f"--- CACHE BUS ERROR: Listener failed, reconnecting in {RECONNECT_SECONDS:g}s: {e} ---")
+                self._stop.wait(RECONNECT_SECONDS)
+
+
+bus = CacheBus()
+
+
+def publish(topic: str) -> int:
+    return bus.publish(topic)
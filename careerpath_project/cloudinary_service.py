@@ -2,8 +2,19 @@
 # Handles file uploads to Cloudinary.
 
 import os
+import time
+import uuid
+import asyncio
 import cloudinary
 import cloudinary.uploader
+import cloudinary.utils
+import httpx
+from typing import BinaryIO, Optional, Union
+
+# Files above this size are sent with Cloudinary's chunked upload protocol.
+# Cloudinary requires every chunk except the last to be at least 5 MB.
+CHUNK_SIZE = 6 * 1024 * 1024
+UPLOAD_TIMEOUT_SECONDS = 60
 
 def configure_cloudinary():
     """
@@ -33,20 +44,33 @@ def configure_cloudinary():
 # Configure Cloudinary when the module is first imported
 IS_CONFIGURED = configure_cloudinary()
 
-def upload_file_to_cloudinary(filename: str, file_contents: bytes, mimetype: str):
+def resume_public_id(user_id: Optional[int], filename: str, unique: Optional[str] = None) -> str:
+    """
+    Cloudinary public_id for an uploaded resume: the owner's id plus a unique part, keeping the
+    file extension. Never the client's filename alone, which different users share ("resume.pdf").
+    """
+    owner = f"user_{user_id}/" if user_id is not None else ""
+    return f"{owner}{unique or uuid.uuid4().hex}{os.path.splitext(filename)[1].lower()}"
+
+def upload_file_to_cloudinary(filename: str, file_contents: Union[bytes, BinaryIO], mimetype: str, public_id: Optional[str] = None):
     """
     Uploads a file to a specific Cloudinary folder.
     For PDFs and DOCX, we must specify the resource_type as 'raw'.
+    file_contents may be raw bytes or an open file object, which the SDK streams from.
+    public_id defaults to a random name; see resume_public_id().
     """
     if not IS_CONFIGURED:
         raise Exception("Cloudinary service is not configured.")
 
+    if hasattr(file_contents, "seek"):
+        file_contents.seek(0)
+
     try:
         # For non-image files like PDF, DOCX, etc., use resource_type='raw'
         # We can also specify a folder to keep things organized.
         upload_result = cloudinary.uploader.upload(
             file_contents,
-            public_id=filename,
+            public_id=public_id or resume_public_id(None, filename),
             folder="resumes",  # This will create a 'resumes' folder in your Cloudinary account
             resource_type="raw"
         )
@@ -60,3 +84,73 @@ def upload_file_to_cloudinary(filename: str, file_contents: bytes, mimetype: str
         print(f"--- CLOUDINARY ERROR: An error occurred during upload: {e} ---")
         raise Exception(f"An error occurred during Cloudinary upload: {e}")
 
+# --- Async Upload Client ---
+# One pooled HTTP client per process, shared by every background upload.
+_async_client: Optional[httpx.AsyncClient] = None
+
+def get_async_client() -> httpx.AsyncClient:
+    """Returns the shared async HTTP client, creating it on first use."""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=UPLOAD_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
+        )
+    return _async_client
+
+async def close_async_client():
+    """Closes the shared async HTTP client, e.g. on application shutdown."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+def _signed_upload_params(public_id: str) -> dict:
+    """Builds signed parameters for an authenticated Cloudinary upload request."""
+    config = cloudinary.config()
+    params = {"public_id": public_id, "folder": "resumes", "timestamp": int(time.time())}
+    params["signature"] = cloudinary.utils.api_sign_request(params, config.api_secret)
+    params["api_key"] = config.api_key
+    return params
+
+def _read_chunk(path: str, offset: int, size: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+async def upload_path_to_cloudinary_async(public_id: str, filename: str, path: str, mimetype: str) -> str:
+    """
+    Uploads a file from disk to the 'resumes' folder as `public_id` without blocking the event loop.
+    Files larger than CHUNK_SIZE are sent in chunks, so at most one chunk is held in memory.
+    Returns the secure URL. Raises on any HTTP or Cloudinary error so the caller can retry.
+    """
+    if not IS_CONFIGURED:
+        raise Exception("Cloudinary service is not configured.")
+
+    client = get_async_client()
+    url = cloudinary.utils.cloudinary_api_url("upload", resource_type="raw")
+    params = _signed_upload_params(public_id)
+    size = os.path.getsize(path)
+    unique_upload_id = uuid.uuid4().hex
+
+    offset = 0
+    result = {}
+    while True:
+        chunk = await asyncio.to_thread(_read_chunk, path, offset, CHUNK_SIZE)
+        end = offset + len(chunk)
+        headers = {}
+        if size > CHUNK_SIZE:
+            headers = {"X-Unique-Upload-Id": unique_upload_id, "Content-Range": f"bytes {offset}-{end - 1}/{size}"}
+
+        response = await client.post(url, data=params, files={"file": (filename, chunk, mimetype)}, headers=headers)
+        response.raise_for_status()
+        result = response.json()
+        offset = end
+        if offset >= size or not chunk:
+            break
+
+    file_url = result.get("secure_url")
+    if not file_url:
+        raise Exception(f"Cloudinary did not return a URL: {result}")
+    print(f"--- CLOUDINARY SUCCESS: File '{filename}' uploaded. URL: {file_url} ---")
+    return file_url
@@ -0,0 +1,197 @@
+# cohort_stats.py
+# Cohort percentile ranking from precomputed score histograms.
+# Each submission appends one delta row per metric (insert-only, so concurrent submits never
+# contend on a hot bucket row), a background task compacts the deltas into the histogram
+# table, and a percentile lookup only sums BUCKET_COUNT counters per metric.
+
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, select, union_all
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+# --- Configuration ---
+BUCKET_COUNT = 100  # 1% wide buckets over 0-100%
+TOTAL_METRIC = "__total__"
+COMPACTION_INTERVAL_SECONDS = int(os.getenv("HISTOGRAM_COMPACTION_INTERVAL_SECONDS", "60"))
+# Include the user's cohort standing in AI prompts (set to "false" to keep prompts shorter).
+PERCENTILES_IN_PROMPT = os.getenv("COHORT_PERCENTILES_IN_PROMPT", "true").lower() == "true"
+# Histograms are re-read from the primary at most this often per process.
+SNAPSHOT_TTL_SECONDS = 10
+
+_snapshot_lock = threading.Lock()
+_snapshot: Optional[Dict[str, list]] = None
+_snapshot_at = 0.0
+
+
+def percentage(score: float, total: float) -> float:
+    return (score / total * 100) if total > 0 else 0.0
+
+
+def bucket_for(value: float) -> int:
+    """Maps a percentage to its bucket; 100% falls into the top bucket."""
+    return min(max(int(value * BUCKET_COUNT / 100), 0), BUCKET_COUNT - 1)
+
+
+def attempt_percentages(categories_summary: dict) -> Dict[str, float]:
+    """Returns the percentage scored per category plus the overall percentage under TOTAL_METRIC."""
+    values = {category: percentage(data.get('score', 0), data.get('total', 0)) for category, data in categories_summary.items()}
+    values[TOTAL_METRIC] = percentage(
+        sum(d.get('score', 0) for d in categories_summary.values()),
+        sum(d.get('total', 0) for d in categories_summary.values())
+    )
+    return values
+
+
+def record_attempt(db: Session, categories_summary: dict):
+    """Appends this attempt to the cohort histograms. Does not commit; runs in the caller's transaction."""
+    if not categories_summary:
+        return
+    db.add_all([
+        models.ScoreHistogramDelta(metric=metric, bucket=bucket_for(value), count=1)
+        for metric, value in attempt_percentages(categories_summary).items()
+    ])
+
+
+def record_attempts(db: Session, summaries: List[dict]):
+    """Appends many attempts at once, as one delta row per touched (metric, bucket). Does not commit."""
+    counts: Dict[tuple, int] = {}
+    for categories_summary in summaries:
+        if not categories_summary:
+            continue
+        for metric, value in attempt_percentages(categories_summary).items():
+            key = (metric, bucket_for(value))
+            counts[key] = counts.get(key, 0) + 1
+    if counts:
+        db.execute(insert(models.ScoreHistogramDelta), [
+            {"metric": metric, "bucket": bucket, "count": count} for (metric, bucket), count in counts.items()
+        ])
+
+
+def _upsert_counts(db: Session, counts: Dict[tuple, int]):
+    """Adds counts onto histogram rows, inserting rows for buckets seen for the first time."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    for (metric, bucket), count in counts.items():
+        if insert is not None:
+            statement = insert(models.ScoreHistogram).values(metric=metric, bucket=bucket, count=count)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=["metric", "bucket"],
+                set_={"count": models.ScoreHistogram.count + statement.excluded.count}
+            ))
+            continue
+        row = db.get(models.ScoreHistogram, (metric, bucket), with_for_update=True)
+        if row is None:
+            db.add(models.ScoreHistogram(metric=metric, bucket=bucket, count=count))
+        else:
+            row.count += count
+
+
+def compact(db: Session) -> int:
+    """
+    Folds pending deltas into score_histograms and returns how many delta rows were compacted.
+    DELETE ... RETURNING claims the rows, so two workers compacting at once never count a delta twice.
+    """
+    max_id = db.query(func.max(models.ScoreHistogramDelta.id)).scalar()
+    if max_id is None:
+        return 0
+    claimed = db.execute(
+        delete(models.ScoreHistogramDelta)
+        .where(models.ScoreHistogramDelta.id <= max_id)
+        .returning(models.ScoreHistogramDelta.metric, models.ScoreHistogramDelta.bucket, models.ScoreHistogramDelta.count)
+    ).all()
+    counts: Dict[tuple, int] = {}
+    for metric, bucket, count in claimed:
+        counts[(metric, bucket)] = counts.get((metric, bucket), 0) + count
+    _upsert_counts(db, counts)
+    db.commit()
+    return len(claimed)
+
+
+def _load_histograms() -> Dict[str, list]:
+    db = SessionLocal()
+    try:
+        return _sum_histograms(db)
+    finally:
+        db.close()
+
+
+def _sum_histograms(db: Session) -> Dict[str, list]:
+    # Compacted counts plus not-yet-compacted deltas, so results stay exact between compactions.
+    # One statement reads both tables from the same snapshot; two separate reads could see a
+    # compaction commit in between and count its deltas twice.
+    rows = union_all(
+        select(models.ScoreHistogram.metric, models.ScoreHistogram.bucket, models.ScoreHistogram.count),
+        select(models.ScoreHistogramDelta.metric, models.ScoreHistogramDelta.bucket, models.ScoreHistogramDelta.count),
+    ).subquery()
+    histograms: Dict[str, list] = {}
+    for metric, bucket, count in db.execute(
+        select(rows.c.metric, rows.c.bucket, func.sum(rows.c.count)).group_by(rows.c.metric, rows.c.bucket)
+    ):
+        histograms.setdefault(metric, [0] * BUCKET_COUNT)[bucket] += int(count)
+    return histograms
+
+
+def get_histograms() -> Dict[str, list]:
+    """Returns a recent snapshot of all histograms (metric -> bucket counts)."""
+    global _snapshot, _snapshot_at
+    if _snapshot is not None and time.monotonic() - _snapshot_at < SNAPSHOT_TTL_SECONDS:
+        return _snapshot
+    with _snapshot_lock:
+        if _snapshot is None or time.monotonic() - _snapshot_at >= SNAPSHOT_TTL_SECONDS:
+            _snapshot = _load_histograms()
+            _snapshot_at = time.monotonic()
+    return _snapshot
+
+
+def top_percent(counts: list, value: float) -> Optional[float]:
+    """
+    Returns the share of the cohort scoring at or above `value`, as "top X%".
+    Attempts in the same bucket count as half above and half below. O(BUCKET_COUNT).
+    """
+    population = sum(counts)
+    if population == 0:
+        return None
+    bucket = bucket_for(value)
+    above = sum(counts[bucket + 1:])
+    return round(max((above + counts[bucket] / 2) / population * 100, 0.1), 1)
+
+
+def percentiles(categories_summary: dict) -> Dict[str, float]:
+    """Returns {metric: top X%} for every category in the attempt, plus TOTAL_METRIC."""
+    histograms = get_histograms()
+    result = {}
+    for metric, value in attempt_percentages(categories_summary).items():
+        standing = top_percent(histograms.get(metric, []), value)
+        if standing is not None:
+            result[metric] = standing
+    return result
+
+
+async def run_compaction_loop(session_factory):
+    """Background task: compacts histogram deltas every COMPACTION_INTERVAL_SECONDS."""
+    def _compact_once():
+        db = session_factory()
+        try:
+            return compact(db)
+        finally:
+            db.close()
+
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(_compact_once)
+        except Exception as e:
+            print(f"--- COHORT STATS ERROR: Histogram compaction failed: {e} ---")
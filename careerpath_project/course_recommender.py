@@ -0,0 +1,107 @@
+# course_recommender.py
+# Picks course recommendations from the local course catalog instead of asking the AI model.
+# Courses are indexed by JRI category, and rankings are cached per score profile so
+# users with the same (bucketed) category percentages share one computed result.
+# The index is reloaded from the primary when another process publishes a catalog change
+# on the cache bus, so a lagging replica cannot pin an old catalog under the new version.
+
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import cache_bus
+import crud
+from database import SessionLocal
+
+# Category percentages are rounded down to this bucket size to form the cache key.
+SCORE_BUCKET_SIZE = 10
+DEFAULT_COURSE_LIMIT = 3
+CACHE_TOPIC = "courses"
+
+# In-memory catalog index: category -> list of course dicts in catalog order.
+_catalog_index: Optional[Dict[str, List[dict]]] = None
+_catalog_version = 0
+
+
+def load_catalog() -> Dict[str, List[dict]]:
+    """Loads the course catalog from the primary database into the in-memory category index."""
+    global _catalog_index, _catalog_version
+    loaded_version = cache_bus.version(CACHE_TOPIC)
+    db = SessionLocal()
+    try:
+        courses = crud.get_courses(db)
+    finally:
+        db.close()
+    index: Dict[str, List[dict]] = {}
+    for course in courses:
+        index.setdefault(course.category, []).append({
+            "title": course.title,
+            "platform": course.platform or "",
+            "description": course.description or "",
+            "url": course.url or "",
+            "category": course.category,
+            "skill_tags": frozenset(t.strip().lower() for t in (course.skill_tags or "").split(";") if t.strip()),
+        })
+    _catalog_index, _catalog_version = index, loaded_version
+    _rank_profile.cache_clear()
+    return index
+
+
+def invalidate_catalog():
+    """Drops the in-memory index and cached rankings, e.g. after the catalog changes."""
+    global _catalog_index
+    _catalog_index = None
+    _rank_profile.cache_clear()
+
+
+def score_profile(categories_summary: dict) -> Tuple[Tuple[str, int, float], ...]:
+    """
+    Reduces a categories_summary to a hashable profile of (category, percentage bucket, max points).
+    This is the cache key for rankings.
+    """
+    profile = []
+    for category, data in categories_summary.items():
+        total = data.get('total', 0)
+        percentage = (data.get('score', 0) / total * 100) if total > 0 else 100
+        profile.append((category, int(min(percentage, 100) // SCORE_BUCKET_SIZE * SCORE_BUCKET_SIZE), float(total)))
+    return tuple(sorted(profile))
+
+
+@lru_cache(maxsize=1024)
+def _rank_profile(profile: Tuple[Tuple[str, int, float], ...], limit: int) -> Tuple[dict, ...]:
+    """Ranks catalog courses for a score profile, weakest and highest-weighted categories first."""
+    weak_categories = [
+        (bucket, category) for category, bucket, total in sorted(profile, key=lambda p: (p[1], -p[2], p[0]))
+        if bucket < 100 and _catalog_index.get(category)
+    ]
+
+    picked: List[dict] = []
+    covered_tags = set()
+    # Round-robin over the weakest categories so one weak area doesn't take every slot,
+    # and skip courses whose skill tags are already fully covered by earlier picks.
+    for round_number in range(max((len(_catalog_index[c]) for _, c in weak_categories), default=0)):
+        for bucket, category in weak_categories:
+            if len(picked) >= limit:
+                return tuple(picked)
+            courses = _catalog_index[category]
+            if round_number >= len(courses):
+                continue
+            course = courses[round_number]
+            if course["skill_tags"] and course["skill_tags"] <= covered_tags:
+                continue
+            covered_tags |= course["skill_tags"]
+            picked.append({
+                "title": course["title"],
+                "platform": course["platform"],
+                "description": course["description"],
+                "url": course["url"],
+                "category": category,
+                "reason": f"Recommended to strengthen your {category} score (currently under {bucket + SCORE_BUCKET_SIZE}%).",
+            })
+    return tuple(picked)
+
+
+def recommend_courses(categories_summary: dict, limit: int = DEFAULT_COURSE_LIMIT) -> List[dict]:
+    """Returns course recommendations for the weakest categories in categories_summary."""
+    if _catalog_index is None or _catalog_version != cache_bus.version(CACHE_TOPIC):
+        load_catalog()
+    return [dict(course) for course in _rank_profile(score_profile(categories_summary), limit)]
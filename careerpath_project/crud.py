@@ -2,11 +2,14 @@
 # Corrected to work with the updated main.py and magic link authentication.
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func, insert, update
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
+import json
+import time
 from datetime import datetime, timedelta
 
-import models, schemas, auth
+import models, schemas, auth, cohort_stats
 
 # --- User Functions ---
 
@@ -39,12 +42,387 @@ def update_user_resume_data(db: Session, user_id: int, text: str, analysis: str)
         db.refresh(db_user)
     return db_user
 
+# --- Resume Upload Functions ---
+
+def create_resume_upload(db: Session, user_id: int, filename: str, file_path: str, mimetype: str) -> models.ResumeUpload:
+    """Records a resume file waiting to be archived to Cloudinary."""
+    db_upload = models.ResumeUpload(
+        user_id=user_id, filename=filename, file_path=file_path, mimetype=mimetype,
+        status="pending", attempts=0, next_attempt_at=datetime.utcnow()
+    )
+    db.add(db_upload)
+    db.commit()
+    db.refresh(db_upload)
+    return db_upload
+
+def claim_due_jobs(db: Session, model, running_status: str, limit: int, lease_seconds: int, *criteria) -> list:
+    """
+    Claims up to `limit` due rows of a job table (status, attempts and next_attempt_at columns),
+    including ones whose previous claim has expired (e.g. the worker crashed mid-job). A claim
+    sets `running_status` and pushes next_attempt_at forward by the lease, and the conditional
+    UPDATE makes sure only one worker wins each row. `criteria` further filter the candidates.
+    """
+    now = datetime.utcnow()
+    claimable = ["pending", running_status]
+    candidates = db.query(model.id).filter(
+        model.status.in_(claimable),
+        model.next_attempt_at <= now,
+        *criteria
+    ).order_by(model.next_attempt_at, model.id).limit(limit).all()
+
+    claimed_ids = []
+    for (job_id,) in candidates:
+        updated = db.query(model).filter(
+            model.id == job_id,
+            model.status.in_(claimable),
+            model.next_attempt_at <= now
+        ).update({
+            model.status: running_status,
+            model.attempts: model.attempts + 1,
+            model.next_attempt_at: now + timedelta(seconds=lease_seconds),
+        }, synchronize_session=False)
+        if updated:
+            claimed_ids.append(job_id)
+    db.commit()
+
+    if not claimed_ids:
+        return []
+    return db.query(model).filter(model.id.in_(claimed_ids)).all()
+
+def claim_due_resume_uploads(db: Session, limit: int, lease_seconds: int) -> List[models.ResumeUpload]:
+    return claim_due_jobs(db, models.ResumeUpload, "uploading", limit, lease_seconds)
+
+def complete_resume_upload(db: Session, upload_id: int, url: str):
+    """Marks an upload as done and stores the archived URL on the owning user."""
+    db_upload = db.query(models.ResumeUpload).filter(models.ResumeUpload.id == upload_id).first()
+    if db_upload:
+        db_upload.status = "done"
+        db_upload.url = url
+        db_upload.last_error = None
+        db.query(models.User).filter(models.User.id == db_upload.user_id).update({models.User.resume_url: url})
+        db.commit()
+    return db_upload
+
+def fail_resume_upload(db: Session, upload_id: int, error: str, retry_at: Optional[datetime]):
+    """Records a failed attempt. The upload is retried at retry_at, or given up on if it is None."""
+    db_upload = db.query(models.ResumeUpload).filter(models.ResumeUpload.id == upload_id).first()
+    if db_upload:
+        db_upload.last_error = error
+        if retry_at is None:
+            db_upload.status = "failed"
+        else:
+            db_upload.status = "pending"
+            db_upload.next_attempt_at = retry_at
+        db.commit()
+    return db_upload
+
+# --- Resume Ingestion Functions ---
+
+def create_resume_ingest_job(db: Session, source_path: str, owns_source: bool, created_by: Optional[str]) -> models.ResumeIngestJob:
+    job = models.ResumeIngestJob(source_path=source_path, owns_source=owns_source, created_by=created_by, status="queued", total=0)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_resume_ingest_job(db: Session, job_id: int) -> Optional[models.ResumeIngestJob]:
+    return db.query(models.ResumeIngestJob).filter(models.ResumeIngestJob.id == job_id).first()
+
+def _ingest_lease_expired(now: datetime):
+    return models.ResumeIngestJob.lease_expires_at.is_(None) | (models.ResumeIngestJob.lease_expires_at <= now)
+
+def get_unfinished_resume_ingest_jobs(db: Session) -> List[int]:
+    """Ids of queued or running jobs that no worker holds a live lease on."""
+    return [job_id for (job_id,) in db.query(models.ResumeIngestJob.id).filter(
+        models.ResumeIngestJob.status.in_(["queued", "running"]),
+        _ingest_lease_expired(datetime.utcnow())
+    ).order_by(models.ResumeIngestJob.id)]
+
+def claim_resume_ingest_job(db: Session, job_id: int, claimed_by: str, lease_seconds: int) -> Optional[models.ResumeIngestJob]:
+    """
+    Claims a queued job, or a running one whose lease has expired (its worker died), and marks
+    it running. The conditional UPDATE makes sure only one worker wins. Returns None if it lost.
+    """
+    now = datetime.utcnow()
+    claimed = db.query(models.ResumeIngestJob).filter(
+        models.ResumeIngestJob.id == job_id,
+        models.ResumeIngestJob.status.in_(["queued", "running"]),
+        _ingest_lease_expired(now)
+    ).update({
+        models.ResumeIngestJob.status: "running",
+        models.ResumeIngestJob.claimed_by: claimed_by,
+        models.ResumeIngestJob.lease_expires_at: now + timedelta(seconds=lease_seconds),
+    }, synchronize_session=False)
+    db.commit()
+    return get_resume_ingest_job(db, job_id) if claimed == 1 else None
+
+def renew_resume_ingest_lease(db: Session, job_id: int, claimed_by: str, lease_seconds: int) -> bool:
+    """Extends the lease of a job still claimed by `claimed_by`. Returns False if it was taken over."""
+    renewed = db.query(models.ResumeIngestJob).filter(
+        models.ResumeIngestJob.id == job_id,
+        models.ResumeIngestJob.status == "running",
+        models.ResumeIngestJob.claimed_by == claimed_by
+    ).update({
+        models.ResumeIngestJob.lease_expires_at: datetime.utcnow() + timedelta(seconds=lease_seconds)
+    }, synchronize_session=False)
+    db.commit()
+    return renewed == 1
+
+def update_resume_ingest_job(db: Session, job_id: int, status: str, total: Optional[int] = None,
+                             error: Optional[str] = None, claimed_by: Optional[str] = None):
+    """Updates a job's status; with `claimed_by`, only while that worker still holds the job."""
+    values = {models.ResumeIngestJob.status: status}
+    if total is not None:
+        values[models.ResumeIngestJob.total] = total
+    if error is not None:
+        values[models.ResumeIngestJob.last_error] = error
+    if status in ("done", "failed"):
+        values[models.ResumeIngestJob.finished_at] = datetime.utcnow()
+        values[models.ResumeIngestJob.lease_expires_at] = None
+    query = db.query(models.ResumeIngestJob).filter(models.ResumeIngestJob.id == job_id)
+    if claimed_by is not None:
+        query = query.filter(models.ResumeIngestJob.claimed_by == claimed_by)
+    query.update(values, synchronize_session=False)
+    db.commit()
+
+def get_resume_ingest_checkpoint(db: Session, job_id: int) -> dict:
+    """Returns {entry_name: (content_hash, email)} for every entry the job has already finished."""
+    return {
+        entry_name: (content_hash, email)
+        for entry_name, content_hash, email in db.query(
+            models.ResumeIngestItem.entry_name, models.ResumeIngestItem.content_hash, models.ResumeIngestItem.email
+        ).filter(models.ResumeIngestItem.job_id == job_id)
+    }
+
+def record_resume_ingest_item(db: Session, job_id: int, entry_name: str, status: str, email: Optional[str] = None,
+                              content_hash: Optional[str] = None, error: Optional[str] = None,
+                              resume_text: Optional[str] = None, analysis: Optional[str] = None,
+                              original_entry: Optional[str] = None):
+    """
+    Checkpoints one archive entry. For analysed entries the user's resume data is
+    updated in the same transaction, so an entry is never half-done after a crash.
+    A duplicate of an analysed entry that belongs to another user gets a copy of its results.
+    """
+    if status == "duplicate" and email and original_entry:
+        original = db.query(models.ResumeIngestItem).filter(
+            models.ResumeIngestItem.job_id == job_id,
+            models.ResumeIngestItem.entry_name == original_entry,
+            models.ResumeIngestItem.status == "analyzed"
+        ).first()
+        source = get_user_by_email(db, email=original.email) if original and original.email != email else None
+        if source is not None:
+            resume_text, analysis = source.resume_text, source.resume_analysis
+            error = f"Same file as {original_entry}; its analysis was reused."
+    if resume_text is not None:
+        db.query(models.User).filter(models.User.email == email).update({
+            models.User.resume_text: resume_text,
+            models.User.resume_analysis: analysis,
+        }, synchronize_session=False)
+    db.add(models.ResumeIngestItem(job_id=job_id, entry_name=entry_name, email=email,
+                                   content_hash=content_hash, status=status, error=error))
+    db.commit()
+
+def get_resume_ingest_counts(db: Session, job_id: int) -> dict:
+    """Returns the number of finished entries per status."""
+    return dict(db.query(models.ResumeIngestItem.status, func.count()).filter(
+        models.ResumeIngestItem.job_id == job_id
+    ).group_by(models.ResumeIngestItem.status))
+
+# --- Idempotency Functions ---
+
+def create_idempotency_record(
+    db: Session, scope: str, key: str, fingerprint: str, ttl_seconds: int, claimed_by: str, lease_seconds: int
+) -> Optional[models.IdempotencyRecord]:
+    """
+    Claims an idempotency key by inserting an in-progress record leased to `claimed_by`.
+    Returns None if a record for this scope and key already exists.
+    """
+    now = datetime.utcnow()
+    db_record = models.IdempotencyRecord(
+        scope=scope, key=key, fingerprint=fingerprint, status="in_progress",
+        expires_at=now + timedelta(seconds=ttl_seconds),
+        claimed_by=claimed_by, lease_expires_at=now + timedelta(seconds=lease_seconds)
+    )
+    db.add(db_record)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    db.refresh(db_record)
+    return db_record
+
+def get_idempotency_record(db: Session, scope: str, key: str) -> Optional[models.IdempotencyRecord]:
+    """Retrieves the record stored for an idempotency key, if any."""
+    return db.query(models.IdempotencyRecord).filter(
+        models.IdempotencyRecord.scope == scope,
+        models.IdempotencyRecord.key == key
+    ).first()
+
+def take_over_idempotency_record(
+    db: Session, scope: str, key: str, fingerprint: str, claimed_by: str, lease_seconds: int
+) -> bool:
+    """
+    Claims an in-progress record whose lease has run out, i.e. whose request died without
+    completing or releasing it. The conditional UPDATE makes sure only one request wins.
+    """
+    now = datetime.utcnow()
+    claimed = db.query(models.IdempotencyRecord).filter(
+        models.IdempotencyRecord.scope == scope,
+        models.IdempotencyRecord.key == key,
+        models.IdempotencyRecord.status == "in_progress",
+        (models.IdempotencyRecord.lease_expires_at.is_(None)) | (models.IdempotencyRecord.lease_expires_at <= now)
+    ).update({
+        models.IdempotencyRecord.fingerprint: fingerprint,
+        models.IdempotencyRecord.claimed_by: claimed_by,
+        models.IdempotencyRecord.lease_expires_at: now + timedelta(seconds=lease_seconds),
+    }, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+def renew_idempotency_lease(db: Session, scope: str, key: str, claimed_by: str, lease_seconds: int) -> bool:
+    """Extends the lease of a record still claimed by `claimed_by`. Returns False if it was taken over."""
+    renewed = db.query(models.IdempotencyRecord).filter(
+        models.IdempotencyRecord.scope == scope,
+        models.IdempotencyRecord.key == key,
+        models.IdempotencyRecord.status == "in_progress",
+        models.IdempotencyRecord.claimed_by == claimed_by
+    ).update({
+        models.IdempotencyRecord.lease_expires_at: datetime.utcnow() + timedelta(seconds=lease_seconds)
+    }, synchronize_session=False)
+    db.commit()
+    return renewed == 1
+
+def complete_idempotency_record(db: Session, scope: str, key: str, response_body: str, claimed_by: str):
+    """Stores the final response for an idempotency key, unless another request has taken it over."""
+    db.query(models.IdempotencyRecord).filter(
+        models.IdempotencyRecord.scope == scope,
+        models.IdempotencyRecord.key == key,
+        models.IdempotencyRecord.claimed_by == claimed_by
+    ).update({models.IdempotencyRecord.status: "completed", models.IdempotencyRecord.response_body: response_body})
+    db.commit()
+
+def delete_idempotency_record(db: Session, scope: str, key: str, claimed_by: Optional[str] = None):
+    """Releases an idempotency key, e.g. after the original request failed. With `claimed_by`, only that request's claim."""
+    query = db.query(models.IdempotencyRecord).filter(
+        models.IdempotencyRecord.scope == scope,
+        models.IdempotencyRecord.key == key
+    )
+    if claimed_by is not None:
+        query = query.filter(models.IdempotencyRecord.claimed_by == claimed_by)
+    query.delete(synchronize_session=False)
+    db.commit()
+
+def delete_expired_idempotency_records(db: Session, limit: int = 500) -> int:
+    """Deletes up to `limit` expired idempotency records and returns how many were removed."""
+    expired_ids = db.query(models.IdempotencyRecord.id).filter(
+        models.IdempotencyRecord.expires_at <= datetime.utcnow()
+    ).limit(limit).subquery()
+    deleted = db.query(models.IdempotencyRecord).filter(
+        models.IdempotencyRecord.id.in_(expired_ids.select())
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+# --- Rate Limit Functions ---
+
+def increment_rate_limit_counter(db: Session, key: str, window_start: int) -> int:
+    """Counts one request for `key` in the window and returns the window's new count."""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        count = db.execute(
+            dialect_insert(models.RateLimitCounter).values(key=key, window_start=window_start, count=1)
+            .on_conflict_do_update(index_elements=["key", "window_start"], set_={"count": models.RateLimitCounter.count + 1})
+            .returning(models.RateLimitCounter.count)
+        ).scalar_one()
+    else:
+        counter = db.query(models.RateLimitCounter).filter_by(key=key, window_start=window_start).with_for_update().first()
+        if counter is None:
+            counter = models.RateLimitCounter(key=key, window_start=window_start, count=0)
+            db.add(counter)
+        counter.count += 1
+        count = counter.count
+    db.commit()
+    return count
+
+def get_rate_limit_count(db: Session, key: str, window_start: int) -> int:
+    count = db.query(models.RateLimitCounter.count).filter_by(key=key, window_start=window_start).scalar()
+    return count or 0
+
+def delete_old_rate_limit_counters(db: Session, before: int) -> int:
+    """Deletes the counters of windows that started before `before`."""
+    deleted = db.query(models.RateLimitCounter).filter(
+        models.RateLimitCounter.window_start < before
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+# --- Read Pin Functions ---
+
+def pin_reads(db: Session, pin_key: str, pinned_until: float):
+    """Routes `pin_key`'s reads to the primary until `pinned_until` (Unix time)."""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        db.execute(
+            dialect_insert(models.ReadPin).values(pin_key=pin_key, pinned_until=pinned_until)
+            .on_conflict_do_update(index_elements=["pin_key"], set_={"pinned_until": pinned_until})
+        )
+    else:
+        db.merge(models.ReadPin(pin_key=pin_key, pinned_until=pinned_until))
+    db.commit()
+
+def get_read_pin(db: Session, pin_key: str) -> float:
+    """Returns the Unix time until which `pin_key` is pinned to the primary (0 if never)."""
+    return db.query(models.ReadPin.pinned_until).filter(models.ReadPin.pin_key == pin_key).scalar() or 0.0
+
+def delete_expired_read_pins(db: Session, before: float) -> int:
+    deleted = db.query(models.ReadPin).filter(models.ReadPin.pinned_until < before).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def reserve_rate_slot(db: Session, name: str, interval: float) -> float:
+    """
+    Reserves the next send slot of the `name` channel and returns its Unix start time; the next
+    caller, in any worker, gets a slot `interval` seconds later. The UPDATE locks the row, so
+    concurrent reservations are serialized.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        db.execute(
+            dialect_insert(models.RateSlot).values(name=name, next_at=0.0)
+            .on_conflict_do_nothing(index_elements=["name"])
+        )
+    elif db.get(models.RateSlot, name) is None:
+        db.merge(models.RateSlot(name=name, next_at=0.0))
+        db.flush()
+    now = time.time()
+    db.query(models.RateSlot).filter(models.RateSlot.name == name).update(
+        {models.RateSlot.next_at: case((models.RateSlot.next_at > now, models.RateSlot.next_at), else_=now) + interval},
+        synchronize_session=False,
+    )
+    next_at = db.query(models.RateSlot.next_at).filter(models.RateSlot.name == name).scalar()
+    db.commit()
+    return next_at - interval
+
 # --- Magic Token Functions (Corrected) ---
 
 def create_magic_token(db: Session, email: str, token_hash: str) -> models.MagicToken:
     """Stores a new magic link token hash in the database."""
     # Set an expiration time for the token for security
     expires_at = datetime.utcnow() + timedelta(minutes=auth.MAGIC_LINK_EXPIRE_MINUTES)
+    invalidate_magic_tokens(db, [email])  # Only the newest link works
     db_token = models.MagicToken(email=email, token_hash=token_hash, expires_at=expires_at)
     db.add(db_token)
     db.commit()
@@ -66,20 +444,144 @@ def get_magic_token_by_hash(db: Session, token_hash: str) -> Optional[models.Mag
 
 def use_magic_token(db: Session, token_hash: str) -> Optional[models.MagicToken]:
     """
-    FIXED: Simplified to just mark the token as used.
-    Finds a magic token by its hash and marks it as used.
-    This function assumes the token has already been validated by get_magic_token_by_hash.
+    Marks a live (unused, unexpired) token as used and returns it, or None if there is no such
+    token. The conditional UPDATE makes sure two concurrent logins with one link cannot both succeed.
     """
-    # Find the token by hash. No need to re-validate here.
-    db_token = db.query(models.MagicToken).filter(models.MagicToken.token_hash == token_hash).first()
-    
-    if db_token:
-        db_token.is_used = True
-        db.commit()
-        db.refresh(db_token)
-        return db_token
-    return None
+    used = db.query(models.MagicToken).filter(
+        models.MagicToken.token_hash == token_hash,
+        models.MagicToken.is_used == False,
+        models.MagicToken.expires_at > datetime.utcnow()
+    ).update({models.MagicToken.is_used: True}, synchronize_session=False)
+    db.commit()
+    if used != 1:
+        return None
+    return db.query(models.MagicToken).filter(models.MagicToken.token_hash == token_hash).first()
+
+
+def invalidate_magic_tokens(db: Session, emails: List[str]) -> int:
+    """Marks the outstanding tokens of these users as used, so only a newly issued link works. Does not commit."""
+    if not emails:
+        return 0
+    return db.execute(
+        update(models.MagicToken).where(
+            models.MagicToken.email.in_(emails),
+            models.MagicToken.is_used == False,
+            models.MagicToken.expires_at > datetime.utcnow()
+        ).values(is_used=True).execution_options(synchronize_session=False)
+    ).rowcount
+
+def delete_dead_magic_tokens(db: Session, limit: int = 500) -> int:
+    """
+    Deletes up to `limit` expired or used tokens and returns how many were removed.
+    Expired rows are found through the expires_at index; used ones fill the rest of the batch.
+    """
+    now = datetime.utcnow()
+    dead_ids = [row.id for row in db.query(models.MagicToken.id).filter(
+        models.MagicToken.expires_at <= now
+    ).limit(limit)]
+    if len(dead_ids) < limit:
+        dead_ids += [row.id for row in db.query(models.MagicToken.id).filter(
+            models.MagicToken.is_used == True,
+            models.MagicToken.expires_at > now
+        ).limit(limit - len(dead_ids))]
+    if not dead_ids:
+        return 0
+    deleted = db.query(models.MagicToken).filter(
+        models.MagicToken.id.in_(dead_ids)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
 
+def get_magic_token_counts(db: Session) -> dict:
+    """Returns the number of live and total rows in magic_tokens."""
+    live = db.query(func.count(models.MagicToken.id)).filter(
+        models.MagicToken.is_used == False,
+        models.MagicToken.expires_at > datetime.utcnow()
+    ).scalar()
+    total = db.query(func.count(models.MagicToken.id)).scalar()
+    return {"live": live, "total": total}
+
+def create_magic_tokens_bulk(db: Session, tokens: List[tuple], expires_at: datetime):
+    """Inserts (email, token_hash) pairs with one executemany. Does not commit."""
+    if tokens:
+        db.execute(insert(models.MagicToken), [
+            {"email": email, "token_hash": token_hash, "expires_at": expires_at, "is_used": False}
+            for email, token_hash in tokens
+        ])
+
+# --- Invitation Functions ---
+
+def upsert_users(db: Session, emails: List[str]):
+    """Creates every user in `emails` that does not exist yet, in one statement where the database allows it. Does not commit."""
+    if not emails:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        get_or_create_users(db, emails)
+        return
+    db.execute(
+        dialect_insert(models.User).on_conflict_do_nothing(index_elements=["email"]),
+        [{"email": email, "is_active": True} for email in emails]
+    )
+
+def create_invite_job(db: Session, created_by: Optional[str], total: int, invalid: int) -> models.InviteJob:
+    """Adds an invite job to the current transaction."""
+    job = models.InviteJob(created_by=created_by, status="queued", total=total, invalid=invalid, sent=0, failed=0)
+    db.add(job)
+    db.flush()
+    return job
+
+def create_invite_recipients(db: Session, job_id: int, emails: List[str]):
+    """Queues one invitation email per address with one executemany. Does not commit."""
+    if emails:
+        now = datetime.utcnow()
+        db.execute(insert(models.InviteRecipient), [
+            {"job_id": job_id, "email": email, "status": "pending", "attempts": 0, "next_attempt_at": now}
+            for email in emails
+        ])
+
+def claim_due_invite_recipients(db: Session, limit: int, lease_seconds: int, job_id: Optional[int] = None) -> List[models.InviteRecipient]:
+    criteria = [models.InviteRecipient.job_id == job_id] if job_id is not None else []
+    return claim_due_jobs(db, models.InviteRecipient, "sending", limit, lease_seconds, *criteria)
+
+def record_invite_batch(db: Session, recipient_ids: List[int], sent: bool, error: Optional[str] = None, retry_at: Optional[datetime] = None):
+    """
+    Records the outcome of sending to these recipients: sent, pending again until retry_at, or
+    failed for good. Updates their jobs' counters, and finishes each job with nothing left to send.
+    """
+    status = "sent" if sent else ("pending" if retry_at is not None else "failed")
+    values = {models.InviteRecipient.status: status, models.InviteRecipient.last_error: error}
+    if status == "pending":
+        values[models.InviteRecipient.next_attempt_at] = retry_at
+    db.query(models.InviteRecipient).filter(models.InviteRecipient.id.in_(recipient_ids)).update(values, synchronize_session=False)
+
+    per_job = dict(db.query(models.InviteRecipient.job_id, func.count()).filter(
+        models.InviteRecipient.id.in_(recipient_ids)
+    ).group_by(models.InviteRecipient.job_id).all())
+    for job_id, count in per_job.items():
+        counters = {models.InviteJob.sent: models.InviteJob.sent + (count if status == "sent" else 0),
+                    models.InviteJob.failed: models.InviteJob.failed + (count if status == "failed" else 0)}
+        if error is not None:
+            counters[models.InviteJob.last_error] = error
+        db.query(models.InviteJob).filter(models.InviteJob.id == job_id).update(counters, synchronize_session=False)
+        job = db.query(models.InviteJob).filter(models.InviteJob.id == job_id).populate_existing().with_for_update().first()
+        remaining = db.query(func.count(models.InviteRecipient.id)).filter(
+            models.InviteRecipient.job_id == job_id,
+            models.InviteRecipient.status.in_(["pending", "sending"])
+        ).scalar()
+        if remaining:
+            job.status = "sending"
+        else:
+            job.status = "failed" if job.sent == 0 and job.failed > 0 else "done"
+            job.finished_at = datetime.utcnow()
+    db.commit()
+
+def get_invite_job(db: Session, job_id: int) -> Optional[models.InviteJob]:
+    return db.query(models.InviteJob).filter(models.InviteJob.id == job_id).first()
 
 # --- Question and Option Functions ---
 
@@ -120,19 +622,401 @@ def get_max_points_for_question(db: Session, question_id: int):
     result = db.query(func.max(models.Option.points)).filter(models.Option.question_id == question_id).scalar()
     return result or 0
 
+# --- Course Functions ---
+
+def get_courses(db: Session):
+    """Retrieves the full course catalog."""
+    return db.query(models.Course).order_by(models.Course.id).all()
+
+def get_course_by_title(db: Session, title: str):
+    """Retrieves a single course by its title."""
+    return db.query(models.Course).filter(models.Course.title == title).first()
+
+def create_course(db: Session, course: schemas.CourseCreate):
+    """Creates a new course in the catalog."""
+    db_course = models.Course(**course.model_dump())
+    db.add(db_course)
+    db.commit()
+    db.refresh(db_course)
+    return db_course
+
 # --- Assessment Functions ---
 
-def create_assessment(db: Session, user_id: Optional[int], score: float, answers: List[schemas.AnswerSubmit], analysis: Optional[str] = None, suggestions: Optional[str] = None):
-    """Creates a new assessment record for a user."""
+def create_assessment(db: Session, user_id: Optional[int], score: float, answers: List[schemas.AnswerSubmit], analysis: Optional[str] = None, suggestions: Optional[str] = None, categories_summary: Optional[dict] = None, attempt_id: Optional[str] = None):
+    """
+    Creates a new assessment record for a user.
+    The assessment, its answers and the user's progress statistics are committed together.
+    With an attempt_id, the attempt is marked as submitted in the same transaction; returns
+    None if it was submitted already.
+    """
     db_assessment = models.Assessment(score=score, owner_id=user_id, analysis=analysis, course_suggestions=suggestions)
     db.add(db_assessment)
-    db.commit()
-    db.refresh(db_assessment)
+    db.flush()
+
+    if attempt_id is not None:
+        claimed = db.execute(
+            update(models.AssessmentAttempt).where(
+                models.AssessmentAttempt.id == attempt_id,
+                models.AssessmentAttempt.assessment_id.is_(None)
+            ).values(assessment_id=db_assessment.id).execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            db.rollback()
+            return None
     
     # Store each answer provided by the user for this assessment
     for answer in answers:
         db_answer = models.Answer(assessment_id=db_assessment.id, question_id=answer.question_id, selected_option_id=answer.selected_option_id)
         db.add(db_answer)
+
+    if user_id is not None:
+        update_user_progress(
+            db, user_id=user_id, score=score, categories_summary=categories_summary or {},
+            exclude_assessment_ids=[db_assessment.id]
+        )
+    cohort_stats.record_attempt(db, categories_summary or {})
     db.commit()
+    db.refresh(db_assessment)
     
     return db_assessment
+
+def create_assessment_attempt(db: Session, attempt_id: str, user_id: int, question_ids: List[int], expires_at: datetime) -> models.AssessmentAttempt:
+    """Records the questions served for a randomized attempt."""
+    attempt = models.AssessmentAttempt(id=attempt_id, user_id=user_id, question_ids=json.dumps(question_ids), expires_at=expires_at)
+    db.add(attempt)
+    db.commit()
+    return attempt
+
+def get_assessment_attempt(db: Session, attempt_id: str, user_id: int) -> Optional[models.AssessmentAttempt]:
+    return db.query(models.AssessmentAttempt).filter(
+        models.AssessmentAttempt.id == attempt_id,
+        models.AssessmentAttempt.user_id == user_id
+    ).first()
+
+def claim_assessment_attempt(db: Session, attempt_id: str, user_id: int, claimed_by: str, lease_seconds: int) -> bool:
+    """
+    Claims an unsubmitted attempt for one submission while it is scored. The conditional UPDATE
+    makes sure only one concurrent submission wins; a claim whose lease ran out can be taken over.
+    """
+    now = datetime.utcnow()
+    claimed = db.query(models.AssessmentAttempt).filter(
+        models.AssessmentAttempt.id == attempt_id,
+        models.AssessmentAttempt.user_id == user_id,
+        models.AssessmentAttempt.assessment_id.is_(None),
+        models.AssessmentAttempt.claim_expires_at.is_(None) | (models.AssessmentAttempt.claim_expires_at <= now)
+    ).update({
+        models.AssessmentAttempt.claimed_by: claimed_by,
+        models.AssessmentAttempt.claim_expires_at: now + timedelta(seconds=lease_seconds),
+    }, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+def release_assessment_attempt(db: Session, attempt_id: str, claimed_by: str):
+    """Gives up a claim after a failed submission, so the attempt can be submitted again."""
+    db.rollback()
+    db.query(models.AssessmentAttempt).filter(
+        models.AssessmentAttempt.id == attempt_id,
+        models.AssessmentAttempt.claimed_by == claimed_by,
+        models.AssessmentAttempt.assessment_id.is_(None)
+    ).update({
+        models.AssessmentAttempt.claimed_by: None,
+        models.AssessmentAttempt.claim_expires_at: None,
+    }, synchronize_session=False)
+    db.commit()
+
+def get_answer_pairs(db: Session, assessment: models.Assessment) -> list:
+    """
+    Returns the (question_id, selected_option_id) pairs of an assessment. On PostgreSQL its
+    answers were written in the same transaction, so they share its created_at; filtering on
+    it lets a partitioned answers table skip every other month.
+    """
+    query = db.query(models.Answer.question_id, models.Answer.selected_option_id).filter(
+        models.Answer.assessment_id == assessment.id
+    )
+    if assessment.created_at is not None and db.get_bind().dialect.name == "postgresql":
+        query = query.filter(models.Answer.created_at == assessment.created_at)
+    return query.all()
+
+def get_or_create_users(db: Session, emails: List[str]) -> dict:
+    """Returns {email: user_id} for all emails, creating missing users with one query and one flush."""
+    existing = dict(db.query(models.User.email, models.User.id).filter(models.User.email.in_(emails))) if emails else {}
+    new_users = [models.User(email=email) for email in emails if email not in existing]
+    if new_users:
+        db.add_all(new_users)
+        db.flush()
+        existing.update((user.email, user.id) for user in new_users)
+    return existing
+
+def create_assessments_bulk(db: Session, rows: List[dict], analysis: Optional[str] = None) -> List[int]:
+    """
+    Inserts many scored assessments with set-based statements and returns their ids in order.
+    Each row has user_id, score, course_suggestions, answers [(question_id, option_id)] and
+    categories_summary. Progress statistics and cohort histograms are updated in the same
+    transaction. Does not commit.
+    """
+    if not rows:
+        return []
+    assessment_ids = list(db.scalars(
+        insert(models.Assessment).returning(models.Assessment.id, sort_by_parameter_order=True),
+        [{"owner_id": r["user_id"], "score": r["score"], "analysis": analysis, "course_suggestions": r["course_suggestions"]} for r in rows]
+    ))
+    answer_rows = [
+        {"assessment_id": assessment_id, "question_id": question_id, "selected_option_id": option_id}
+        for assessment_id, r in zip(assessment_ids, rows)
+        for question_id, option_id in r["answers"]
+    ]
+    if answer_rows:
+        db.execute(insert(models.Answer), answer_rows)
+
+    user_ids = {r["user_id"] for r in rows}
+    progress_by_user = {
+        p.user_id: p for p in
+        db.query(models.UserProgress).filter(models.UserProgress.user_id.in_(user_ids)).with_for_update()
+    }
+    for r in rows:
+        progress = progress_by_user.get(r["user_id"])
+        if progress is None:
+            progress = progress_by_user[r["user_id"]] = _lock_user_progress(db, r["user_id"], exclude_assessment_ids=assessment_ids)
+        _fold_progress(progress, r["score"], r["categories_summary"])
+    cohort_stats.record_attempts(db, [r["categories_summary"] for r in rows])
+    return assessment_ids
+
+# --- Feedback Job Functions ---
+
+def create_feedback_jobs(db: Session, assessment_ids: List[int], send_email: bool = True):
+    """Queues deferred AI feedback for the given assessments. Does not commit."""
+    now = datetime.utcnow()
+    if assessment_ids:
+        db.execute(insert(models.FeedbackJob), [
+            {"assessment_id": assessment_id, "send_email": send_email, "status": "pending", "attempts": 0, "next_attempt_at": now}
+            for assessment_id in assessment_ids
+        ])
+
+def claim_due_feedback_jobs(db: Session, limit: int, lease_seconds: int) -> List[models.FeedbackJob]:
+    return claim_due_jobs(db, models.FeedbackJob, "running", limit, lease_seconds)
+
+def complete_feedback_job(db: Session, job_id: int, assessment_id: int, analysis: str):
+    """Stores the generated report on the assessment and marks the job done."""
+    db.query(models.Assessment).filter(models.Assessment.id == assessment_id).update({models.Assessment.analysis: analysis})
+    db.query(models.FeedbackJob).filter(models.FeedbackJob.id == job_id).update({
+        models.FeedbackJob.status: "done", models.FeedbackJob.last_error: None
+    })
+    db.commit()
+
+def fail_feedback_job(db: Session, job_id: int, error: str, retry_at: Optional[datetime]):
+    """Records a failed attempt. The job is retried at retry_at, or given up on if it is None."""
+    values = {models.FeedbackJob.last_error: error}
+    if retry_at is None:
+        values[models.FeedbackJob.status] = "failed"
+    else:
+        values[models.FeedbackJob.status] = "pending"
+        values[models.FeedbackJob.next_attempt_at] = retry_at
+    db.query(models.FeedbackJob).filter(models.FeedbackJob.id == job_id).update(values)
+    db.commit()
+
+def get_feedback_job_counts(db: Session) -> dict:
+    """Returns the number of feedback jobs per status."""
+    return dict(db.query(models.FeedbackJob.status, func.count()).group_by(models.FeedbackJob.status))
+
+# --- Re-analysis Functions ---
+
+def get_reanalysis_checkpoint(db: Session, run_name: str) -> Optional[models.ReanalysisCheckpoint]:
+    return db.query(models.ReanalysisCheckpoint).filter(models.ReanalysisCheckpoint.run_name == run_name).first()
+
+def get_reanalysis_failures(db: Session, run_name: str) -> List[int]:
+    """Returns the ids of the assessments the run has not regenerated yet because of an error."""
+    return [assessment_id for (assessment_id,) in db.query(models.ReanalysisFailure.assessment_id).filter(
+        models.ReanalysisFailure.run_name == run_name
+    ).order_by(models.ReanalysisFailure.assessment_id)]
+
+def save_reanalysis_results(db: Session, run_name: str, analyses: dict, failures: dict,
+                            last_assessment_id: Optional[int] = None):
+    """
+    Writes a batch of regenerated reports ({assessment_id: analysis}), records the ones that
+    failed ({assessment_id: error}) for a retry, and advances the run's checkpoint to
+    last_assessment_id (None for a batch of retries) in the same transaction, so a resumed
+    run never redoes a batch nor loses its failures.
+    """
+    if analyses:
+        db.execute(update(models.Assessment), [
+            {"id": assessment_id, "analysis": analysis} for assessment_id, analysis in analyses.items()
+        ])
+    attempted = list(analyses) + list(failures)
+    if attempted:
+        db.query(models.ReanalysisFailure).filter(
+            models.ReanalysisFailure.run_name == run_name,
+            models.ReanalysisFailure.assessment_id.in_(attempted)
+        ).delete(synchronize_session=False)
+    db.add_all([
+        models.ReanalysisFailure(run_name=run_name, assessment_id=assessment_id, error=error)
+        for assessment_id, error in failures.items()
+    ])
+    checkpoint = get_reanalysis_checkpoint(db, run_name)
+    if checkpoint is None:
+        checkpoint = models.ReanalysisCheckpoint(run_name=run_name, last_assessment_id=0, processed=0, failed=0)
+        db.add(checkpoint)
+    if last_assessment_id is not None:
+        checkpoint.last_assessment_id = last_assessment_id
+    checkpoint.processed = (checkpoint.processed or 0) + len(analyses)
+    db.flush()
+    checkpoint.failed = db.query(func.count()).select_from(models.ReanalysisFailure).filter(
+        models.ReanalysisFailure.run_name == run_name
+    ).scalar()
+    db.commit()
+
+# --- Progress Functions ---
+
+# Weight of the newest attempt in each category's rolling (exponentially weighted) average.
+PROGRESS_ROLLING_ALPHA = 0.3
+
+def _category_percentage(data: dict) -> float:
+    total = data.get('total', 0)
+    return (data.get('score', 0) / total * 100) if total > 0 else 0.0
+
+def update_user_progress(db: Session, user_id: int, score: float, categories_summary: dict,
+                         exclude_assessment_ids: List[int] = ()) -> models.UserProgress:
+    """
+    Folds one new attempt into the user's running statistics in O(categories).
+    exclude_assessment_ids are the new, already flushed assessments, which must not be
+    counted again if the progress row has to be built from the stored ones first.
+    Does not commit; the caller commits it together with the assessment.
+    """
+    progress = _lock_user_progress(db, user_id, exclude_assessment_ids)
+    return _fold_progress(progress, score, categories_summary)
+
+def _lock_user_progress(db: Session, user_id: int, exclude_assessment_ids: List[int] = ()) -> models.UserProgress:
+    """
+    Returns the user's progress row, locked for update. A missing row is created and filled
+    from the user's stored assessments (except exclude_assessment_ids), so attempts made
+    before progress tracking existed are never lost. If another transaction creates the row
+    at the same time, that one wins and this one waits for it and uses it.
+    """
+    query = db.query(models.UserProgress).filter(models.UserProgress.user_id == user_id).with_for_update()
+    progress = query.first()
+    if progress is not None:
+        return progress
+    created = _insert_empty_progress(db, user_id)
+    progress = query.populate_existing().first()
+    if created:
+        _fold_stored_attempts(db, progress, exclude_assessment_ids)
+    return progress
+
+def _insert_empty_progress(db: Session, user_id: int) -> bool:
+    """Inserts an empty progress row unless one exists. Returns whether this call created it."""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return db.execute(
+            dialect_insert(models.UserProgress).values(user_id=user_id, attempt_count=0, category_stats="{}")
+            .on_conflict_do_nothing(index_elements=["user_id"])
+            .returning(models.UserProgress.user_id)
+        ).scalar() is not None
+    try:
+        with db.begin_nested():
+            db.add(models.UserProgress(user_id=user_id, attempt_count=0, category_stats="{}"))
+        return True
+    except IntegrityError:
+        return False
+
+def _fold_stored_attempts(db: Session, progress: models.UserProgress, exclude_assessment_ids: List[int] = ()):
+    """Folds the user's stored assessments into `progress`, oldest first."""
+    query = db.query(models.Assessment.id, models.Assessment.score, models.Assessment.created_at).filter(
+        models.Assessment.owner_id == progress.user_id
+    )
+    if exclude_assessment_ids:
+        query = query.filter(models.Assessment.id.notin_(exclude_assessment_ids))
+    assessments = query.order_by(models.Assessment.id).all()
+    if not assessments:
+        return
+    answers = db.query(
+        models.Answer.assessment_id, models.Answer.question_id, models.Answer.selected_option_id
+    ).filter(models.Answer.assessment_id.in_([assessment_id for assessment_id, _, _ in assessments]))
+    created = [created_at for _, _, created_at in assessments if created_at is not None]
+    if created and db.get_bind().dialect.name == "postgresql":
+        # Answers share their assessment's created_at (see get_answer_pairs).
+        answers = answers.filter(models.Answer.created_at.between(min(created), max(created)))
+    pairs_by_assessment = {}
+    for assessment_id, question_id, option_id in answers:
+        pairs_by_assessment.setdefault(assessment_id, []).append((question_id, option_id))
+    for assessment_id, score, _ in assessments:
+        _, categories_summary, _ = summarize_answers(db, pairs_by_assessment.get(assessment_id, []))
+        _fold_progress(progress, score, categories_summary)
+
+def _fold_progress(progress: models.UserProgress, score: float, categories_summary: dict) -> models.UserProgress:
+    count = progress.attempt_count or 0
+    progress.mean_score = score if count == 0 else progress.mean_score + (score - progress.mean_score) / (count + 1)
+    progress.best_score = score if progress.best_score is None else max(progress.best_score, score)
+    progress.last_score = score
+    progress.attempt_count = count + 1
+
+    stats = json.loads(progress.category_stats or "{}")
+    for category, data in categories_summary.items():
+        percentage = _category_percentage(data)
+        entry = stats.get(category)
+        if entry is None:
+            stats[category] = {"attempts": 1, "mean_percentage": percentage, "rolling_percentage": percentage, "last_percentage": percentage}
+            continue
+        entry["attempts"] += 1
+        entry["mean_percentage"] += (percentage - entry["mean_percentage"]) / entry["attempts"]
+        entry["rolling_percentage"] += PROGRESS_ROLLING_ALPHA * (percentage - entry["rolling_percentage"])
+        entry["last_percentage"] = percentage
+    progress.category_stats = json.dumps(stats)
+    return progress
+
+def get_user_progress(db: Session, user_id: int) -> Optional[models.UserProgress]:
+    """Retrieves a user's progress statistics by primary key."""
+    return db.query(models.UserProgress).filter(models.UserProgress.user_id == user_id).first()
+
+def load_answer_lookups(db: Session) -> tuple:
+    """
+    Loads every option, question and per-question max points once, for callers that
+    summarize many assessments (pass the result to summarize_answers as `lookups`).
+    """
+    options = {o.id: o for o in db.query(models.Option)}
+    questions = {q.id: q for q in db.query(models.Question)}
+    max_points = dict(db.query(models.Option.question_id, func.max(models.Option.points)).group_by(models.Option.question_id))
+    return options, questions, max_points
+
+def summarize_answers(db: Session, answer_pairs: List[tuple], lookups: Optional[tuple] = None):
+    """
+    Scores stored (question_id, selected_option_id) pairs with two queries instead of one per answer.
+    Returns (total_score, categories_summary, incorrect_answers) like submit_assessment builds them.
+    """
+    question_ids = {q for q, _ in answer_pairs}
+    option_ids = {o for _, o in answer_pairs}
+    if lookups is not None:
+        options, questions, max_points = lookups
+    else:
+        options = {o.id: o for o in db.query(models.Option).filter(models.Option.id.in_(option_ids))} if option_ids else {}
+        questions = {q.id: q for q in db.query(models.Question).filter(models.Question.id.in_(question_ids))} if question_ids else {}
+        max_points = dict(
+            db.query(models.Option.question_id, func.max(models.Option.points))
+            .filter(models.Option.question_id.in_(question_ids)).group_by(models.Option.question_id)
+        ) if question_ids else {}
+
+    total_score, categories_summary, incorrect_answers = 0, {}, []
+    for question_id, option_id in answer_pairs:
+        option, question = options.get(option_id), questions.get(question_id)
+        if not option or not question:
+            continue
+        total_score += option.points
+        summary = categories_summary.setdefault(question.category, {'score': 0, 'total': 0})
+        summary['score'] += option.points
+        summary['total'] += max_points.get(question.id) or 0
+        if option.points == 0:
+            incorrect_answers.append({"question": question.text, "selected_option": option.text})
+    return total_score, categories_summary, incorrect_answers
+
+def rebuild_user_progress(db: Session, user_id: int) -> Optional[models.UserProgress]:
+    """
+    Builds a user's missing progress row from their stored assessments and answers.
+    Used once for users whose attempts predate the progress table; an existing row is returned as is.
+    """
+    if db.query(models.Assessment.id).filter(models.Assessment.owner_id == user_id).first() is None:
+        return None
+    progress = _lock_user_progress(db, user_id)
+    db.commit()
+    return progress
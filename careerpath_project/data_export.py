@@ -0,0 +1,182 @@
+# data_export.py
+# Streaming exports of users, assessments and answers as CSV or NDJSON.
+# Rows are read in pages and encoded as they arrive, so memory use stays the same no
+# matter how large the tables are. On PostgreSQL the rows come from one server-side
+# cursor (yield_per); other databases are paged by id, because SQLite keeps a lock for
+# as long as a read is open and would block the API's writes for the whole export.
+# Output can be gzipped on the fly.
+#
+# Run it directly: python data_export.py answers [--format ndjson] [--since 2025-01-01] [--gzip] [-o answers.ndjson.gz]
+
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date, datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import http_responses
+import models
+
+# --- Configuration ---
+EXPORT_PAGE_SIZE = 1000
+# Encoded output is handed on in chunks of about this size.
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+
+def _users_query():
+    return select(
+        models.User.id, models.User.email, models.User.is_active, models.User.created_at, models.User.resume_url
+    ), models.User.id, (models.User.created_at,)
+
+
+def _assessments_query():
+    return select(
+        models.Assessment.id, models.Assessment.owner_id, models.User.email.label("owner_email"),
+        models.Assessment.score, models.Assessment.created_at,
+    ).outerjoin(models.User, models.Assessment.owner_id == models.User.id), models.Assessment.id, (models.Assessment.created_at,)
+
+
+def _answers_query():
+    return select(
+        models.Answer.id, models.Answer.assessment_id, models.Assessment.owner_id, models.Assessment.created_at,
+        models.Answer.question_id, models.Question.category, models.Question.text.label("question_text"),
+        models.Answer.selected_option_id, models.Option.text.label("option_text"), models.Option.points,
+    ).join(models.Assessment, models.Answer.assessment_id == models.Assessment.id).outerjoin(
+        models.Question, models.Answer.question_id == models.Question.id
+    ).outerjoin(
+        models.Option, models.Answer.selected_option_id == models.Option.id
+    ), models.Answer.id, (models.Answer.created_at, models.Assessment.created_at)
+
+
+# table name -> function returning (select, id column for ordering and paging, date columns for filtering).
+# The first date column decides which rows are in range. On PostgreSQL the others hold the same
+# value (written in the same transaction) and are bounded too, so each partitioned table only
+# scans the months in range.
+TABLES = {
+    "users": _users_query,
+    "assessments": _assessments_query,
+    "answers": _answers_query,
+}
+
+
+def iter_rows(db: Session, table: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              page_size: int = EXPORT_PAGE_SIZE):
+    """Yields the rows of one export in id order, created on or after `since` and before `until`."""
+    query, id_column, date_columns = TABLES[table]()
+    is_postgresql = db.get_bind().dialect.name == "postgresql"
+    for date_column in date_columns if is_postgresql else date_columns[:1]:
+        if since is not None:
+            query = query.where(date_column >= since)
+        if until is not None:
+            query = query.where(date_column < until)
+    query = query.order_by(id_column)
+
+    if is_postgresql:
+        for page in db.execute(query.execution_options(yield_per=page_size)).partitions():
+            yield from page
+        return
+
+    last_id = None
+    while True:
+        page_query = query if last_id is None else query.where(id_column > last_id)
+        rows = db.execute(page_query.limit(page_size)).all()
+        db.rollback()  # Release the read lock between pages
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_rows(rows, columns, file_format: str) -> Iterator[str]:
+    """Encodes rows as CSV lines (after a header line) or as one JSON object per line."""
+    if file_format == "ndjson":
+        for row in rows:
+            yield json.dumps({c: _value(v) for c, v in zip(columns, row)}, ensure_ascii=False) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_value(v) for v in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_chunks(db: Session, table: str, file_format: str = "csv", since: Optional[datetime] = None,
+                  until: Optional[datetime] = None, compress: bool = False) -> Iterator[bytes]:
+    """Yields the encoded export in chunks of about EXPORT_CHUNK_BYTES, gzipped when `compress` is set."""
+    if table not in TABLES:
+        raise ValueError(f"Unknown export '{table}'.")
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format '{file_format}'.")
+
+    columns = list(TABLES[table]()[0].selected_columns.keys())
+    compressor = zlib.compressobj(http_responses.GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16) if compress else None
+    pending, pending_size = [], 0
+    for line in encode_rows(iter_rows(db, table, since, until), columns, file_format):
+        data = line.encode("utf-8")
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= EXPORT_CHUNK_BYTES:
+            chunk = b"".join(pending)
+            pending, pending_size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+
+    chunk = b"".join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def filename(table: str, file_format: str, compress: bool) -> str:
+    return f"{table}-{datetime.utcnow():%Y%m%d}.{FORMATS[file_format][1]}{'.gz' if compress else ''}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export users, assessments or answers as CSV or NDJSON.")
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Only rows created on or after this date")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="Only rows created before this date")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output with gzip")
+    parser.add_argument("-o", "--output", help="Output file (default: standard output)")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(db, args.table, args.format, args.since, args.until, compress=args.gzip):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -40,3 +40,11 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base is a factory for creating declarative model classes.
 Base = declarative_base()
+
+# --- Read Replicas (optional) ---
+# A comma-separated list of replica URLs. When unset, every read goes to the primary.
+REPLICA_DATABASE_URLS = [url.strip() for url in os.getenv("REPLICA_DATABASE_URLS", "").split(",") if url.strip()]
+
+# pool_pre_ping lets a replica that was restarted or failed over be detected before use.
+replica_engines = [create_engine(url, pool_pre_ping=True) for url in REPLICA_DATABASE_URLS]
+ReplicaSessionLocals = [sessionmaker(autocommit=False, autoflush=False, bind=e) for e in replica_engines]
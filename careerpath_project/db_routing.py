@@ -0,0 +1,164 @@
+# db_routing.py
+# Routes read-only requests to read replicas, with lag-aware fallback to the primary.
+# Replica lag is sampled at most every LAG_CHECK_INTERVAL_SECONDS per replica, and a
+# replica that lags more than MAX_REPLICA_LAG_SECONDS (or cannot be reached) is skipped.
+# After a user writes, their reads are pinned to the primary for a short window so they
+# always see their own writes (read-your-writes). Pins are stored on the primary, so they
+# hold whichever worker serves the next read. A worker remembers both the pins and the
+# "not pinned" answers it has seen (the latter for PIN_NEGATIVE_CACHE_SECONDS), so a user
+# costs at most one primary lookup per that interval instead of one per read.
+
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import crud
+from database import SessionLocal, ReplicaSessionLocals, replica_engines
+
+# --- Configuration ---
+MAX_REPLICA_LAG_SECONDS = float(os.getenv("MAX_REPLICA_LAG_SECONDS", "5"))
+LAG_CHECK_INTERVAL_SECONDS = 5.0
+# A pinned user reads from the primary until every usable replica must have caught up.
+READ_YOUR_WRITES_WINDOW_SECONDS = MAX_REPLICA_LAG_SECONDS + LAG_CHECK_INTERVAL_SECONDS
+# One in this many pins also deletes expired ones.
+PIN_CLEANUP_SAMPLE_RATE = 100
+# How long a "not pinned" lookup is trusted. A write made in another worker within this
+# window after a read here can be missed by this worker for at most this long.
+PIN_NEGATIVE_CACHE_SECONDS = float(os.getenv("PIN_NEGATIVE_CACHE_SECONDS", "1"))
+MAX_CACHED_PINS = 10000
+
+# Postgres: zero when the replica has replayed everything it received, else the age of the last replayed transaction.
+POSTGRES_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+_lock = threading.Lock()
+_lag_samples: List[tuple] = [(0.0, float("inf"))] * len(replica_engines)  # (checked_at, lag_seconds)
+_measuring: List[bool] = [False] * len(replica_engines)
+_round_robin = itertools.cycle(range(len(replica_engines))) if replica_engines else None
+# pin key (the user's email) -> Unix time until which reads go to the primary. Only a cache of
+# pins this process has seen; the read_pins table is the source of truth.
+_pinned_until: Dict[str, float] = {}
+# pin key -> Unix time until which a "not pinned" answer from read_pins is trusted.
+_unpinned_until: Dict[str, float] = {}
+
+
+def _measure_lag(index: int) -> float:
+    engine = replica_engines[index]
+    try:
+        with engine.connect() as conn:
+            if engine.dialect.name == "postgresql":
+                return float(conn.execute(POSTGRES_LAG_QUERY).scalar() or 0)
+            # Other backends (e.g. SQLite files in local testing) have no replication lag to report.
+            conn.execute(text("SELECT 1"))
+            return 0.0
+    except Exception as e:
+        print(f"--- DB ROUTING: Replica {index} is unavailable: {e} ---")
+        return float("inf")
+
+
+def replica_lag(index: int) -> float:
+    """
+    Returns the cached lag for a replica, re-measuring it when the sample is stale. Only one
+    thread measures a replica at a time, outside the lock; the others keep using the previous
+    sample meanwhile, or treat the replica as unavailable if that sample is long out of date.
+    """
+    checked_at, lag = _lag_samples[index]
+    now = time.monotonic()
+    if now - checked_at < LAG_CHECK_INTERVAL_SECONDS:
+        return lag
+    with _lock:
+        if _measuring[index]:
+            return lag if now - checked_at < 2 * LAG_CHECK_INTERVAL_SECONDS else float("inf")
+        _measuring[index] = True
+    try:
+        lag = _measure_lag(index)
+        _lag_samples[index] = (time.monotonic(), lag)
+    finally:
+        _measuring[index] = False
+    return lag
+
+
+def _prune(cache: Dict[str, float], now: float):
+    if len(cache) > MAX_CACHED_PINS:
+        for key in [k for k, until in cache.items() if until <= now]:
+            del cache[key]
+
+
+def _remember_pin(pin_key: str, until: float, now: float):
+    with _lock:
+        _pinned_until[pin_key] = until
+        _unpinned_until.pop(pin_key, None)
+        _prune(_pinned_until, now)
+
+
+def _remember_unpinned(pin_key: str, now: float):
+    with _lock:
+        _unpinned_until[pin_key] = now + PIN_NEGATIVE_CACHE_SECONDS
+        _prune(_unpinned_until, now)
+
+
+def mark_write(pin_key: Optional[str]):
+    """Pins a user's reads to the primary, in every worker, after they wrote something."""
+    if not pin_key or not replica_engines:
+        return
+    now = time.time()
+    until = now + READ_YOUR_WRITES_WINDOW_SECONDS
+    _remember_pin(pin_key, until, now)
+    db = SessionLocal()
+    try:
+        if random.randrange(PIN_CLEANUP_SAMPLE_RATE) == 0:
+            crud.delete_expired_read_pins(db, before=now)
+        crud.pin_reads(db, pin_key, until)
+    except Exception as e:
+        # The write itself succeeded; other workers may briefly serve this user stale reads.
+        print(f"--- DB ROUTING ERROR: Could not store read pin: {e} ---")
+    finally:
+        db.close()
+
+
+def is_pinned(pin_key: Optional[str]) -> bool:
+    if not pin_key:
+        return False
+    now = time.time()
+    if _pinned_until.get(pin_key, 0.0) > now:
+        return True
+    if _unpinned_until.get(pin_key, 0.0) > now:
+        return False
+    db = SessionLocal()
+    try:
+        until = crud.get_read_pin(db, pin_key)
+    except Exception as e:
+        print(f"--- DB ROUTING ERROR: Could not look up read pin, using the primary: {e} ---")
+        return True
+    finally:
+        db.close()
+    if until > now:
+        _remember_pin(pin_key, until, now)
+        return True
+    _remember_unpinned(pin_key, now)
+    return False
+
+
+def read_session(pin_key: Optional[str] = None) -> Session:
+    """
+    Returns a session for read-only work: a healthy replica if one is available,
+    otherwise (or for pinned users) the primary.
+    """
+    if not replica_engines or is_pinned(pin_key):
+        return SessionLocal()
+    for _ in range(len(replica_engines)):
+        index = next(_round_robin)
+        if replica_lag(index) <= MAX_REPLICA_LAG_SECONDS:
+            return ReplicaSessionLocals[index]()
+    return SessionLocal()
+
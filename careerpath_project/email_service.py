@@ -93,3 +93,47 @@ def send_assessment_report(email: str, report_markdown: str, score: float):
     except ApiException as e:
         print(f"--- EMAIL ERROR: Failed to send report to {email}. Error: {e} ---")
         return False
+
+# Brevo accepts up to this many message versions (recipients) in one API call.
+MAX_BATCH_RECIPIENTS = 1000
+
+def send_invitations_batch(invitations: list, expire_days: int) -> bool:
+    """
+    Sends invitation magic links to many users with one Brevo API call.
+    `invitations` is a list of (email, token) pairs, at most MAX_BATCH_RECIPIENTS long.
+    """
+    if not BREVO_API_KEY or not SENDER_EMAIL:
+        print("--- EMAIL ERROR: BREVO_API_KEY or SENDER_EMAIL not set. ---")
+        return False
+
+    html_content = f"""
+    <html><body><div style="font-family: sans-serif; text-align: center; padding: 20px;">
+        <h2>You're invited to JRI Career World!</h2>
+        <p>Your college has set up an account for you. Click the button below to log in.</p>
+        <p>This link will expire in {expire_days} days and can only be used once.</p>
+        <a href="{{{{ params.magic_link }}}}" style="background-color: #5a8bd1; color: white; padding: 15px 25px; text-decoration: none; border-radius: 5px; font-size: 16px; display: inline-block;">Log In</a>
+        <p style="margin-top: 20px; font-size: 12px; color: #888;">If you were not expecting this email, you can safely ignore it.</p>
+    </div></body></html>
+    """
+
+    message_versions = [
+        sib_api_v3_sdk.SendSmtpEmailMessageVersions(
+            to=[{"email": email}],
+            params={"magic_link": f"{FRONTEND_URL}/?token={token}"}
+        )
+        for email, token in invitations
+    ]
+    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
+        sender={"name": "JRI Career World", "email": SENDER_EMAIL},
+        subject="Your invitation to JRI Career World",
+        html_content=html_content,
+        message_versions=message_versions
+    )
+
+    try:
+        api_response = api_instance.send_transac_email(send_smtp_email)
+        print(f"--- EMAIL: Invitations sent to {len(invitations)} users. Response: {api_response} ---")
+        return True
+    except ApiException as e:
+        print(f"--- EMAIL ERROR: Failed to send {len(invitations)} invitations. Error: {e} ---")
+        return False
@@ -0,0 +1,115 @@
+# feedback_queue.py
+# Deferred AI feedback for assessments scored in bulk by batch_scoring.
+# Jobs are FeedbackJob rows, so they survive restarts; this worker claims due jobs,
+# calls the AI model at no more than FEEDBACK_REQUESTS_PER_MINUTE across all workers, stores the report on
+# the assessment and emails it. Failed jobs are retried with exponential backoff.
+# The polling loop, task tracking and shutdown are shared with archive_uploader (leased_jobs.py).
+
+import asyncio
+import json
+import os
+from typing import Optional
+
+import ai_analysis
+import cohort_stats
+import crud
+import email_service
+import leased_jobs
+import models
+from database import SessionLocal
+
+# --- Configuration ---
+# Shared by all worker processes (slots are reserved in the rate_slots table).
+FEEDBACK_REQUESTS_PER_MINUTE = float(os.getenv("FEEDBACK_REQUESTS_PER_MINUTE", "30"))
+MAX_CONCURRENT_FEEDBACK = int(os.getenv("MAX_CONCURRENT_FEEDBACK", "2"))
+MAX_ATTEMPTS = 5
+BASE_BACKOFF_SECONDS = 60
+POLL_INTERVAL_SECONDS = 30
+CLAIM_LEASE_SECONDS = 10 * 60
+
+
+def _claim_due(limit: int):
+    db = SessionLocal()
+    try:
+        return [
+            (j.id, j.assessment_id, j.send_email, j.attempts)
+            for j in crud.claim_due_feedback_jobs(db, limit=limit, lease_seconds=CLAIM_LEASE_SECONDS)
+        ]
+    finally:
+        db.close()
+
+
+def _load_context(assessment_id: int) -> Optional[dict]:
+    """Rebuilds what submit_assessment passes to the AI model from the stored answers."""
+    db = SessionLocal()
+    try:
+        assessment = db.query(models.Assessment).filter(models.Assessment.id == assessment_id).first()
+        if assessment is None:
+            return None
+        answer_pairs = crud.get_answer_pairs(db, assessment)
+        _, categories_summary, incorrect_answers = crud.summarize_answers(db, answer_pairs)
+        return {
+            "email": assessment.owner.email if assessment.owner else None,
+            "score": assessment.score,
+            "categories_summary": categories_summary,
+            "incorrect_answers": incorrect_answers,
+            "recommended_courses": json.loads(assessment.course_suggestions or "[]"),
+            "percentiles": cohort_stats.percentiles(categories_summary) if cohort_stats.PERCENTILES_IN_PROMPT else None,
+        }
+    finally:
+        db.close()
+
+
+def _record_success(job_id: int, assessment_id: int, report: str):
+    db = SessionLocal()
+    try:
+        crud.complete_feedback_job(db, job_id=job_id, assessment_id=assessment_id, analysis=report)
+    finally:
+        db.close()
+
+
+def _record_failure(job_id: int, error: str, attempts: int):
+    retry_at = leased_jobs.retry_at(attempts, MAX_ATTEMPTS, BASE_BACKOFF_SECONDS)
+    db = SessionLocal()
+    try:
+        crud.fail_feedback_job(db, job_id=job_id, error=error, retry_at=retry_at)
+    finally:
+        db.close()
+
+
+class FeedbackQueue(leased_jobs.LeasedJobWorker):
+    """Polls for due feedback jobs; runs at most `concurrency` at once and spaces out AI calls."""
+
+    log_tag = "FEEDBACK"
+
+    def __init__(self, concurrency: int = MAX_CONCURRENT_FEEDBACK, requests_per_minute: float = FEEDBACK_REQUESTS_PER_MINUTE):
+        super().__init__(concurrency, POLL_INTERVAL_SECONDS)
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+
+    def claim(self, limit: int):
+        return _claim_due(limit)
+
+    async def process(self, job_id: int, assessment_id: int, send_email: bool, attempts: int):
+        try:
+            context = await asyncio.to_thread(_load_context, assessment_id)
+            if context is None:
+                raise ValueError(f"Assessment {assessment_id} no longer exists.")
+            await leased_jobs.wait_for_rate_slot("feedback", self.interval)
+            report = await ai_analysis.request_assessment_report(
+                context["categories_summary"], context["incorrect_answers"],
+                context["recommended_courses"], context["percentiles"]
+            )
+            report = ai_analysis.sanitize_report(report)
+            await asyncio.to_thread(_record_success, job_id, assessment_id, report)
+            if send_email and context["email"]:
+                await asyncio.to_thread(email_service.send_assessment_report, context["email"], report, context["score"])
+        except Exception as e:
+            print(f"--- FEEDBACK ERROR: Job {job_id} attempt {attempts} failed: {e} ---")
+            try:
+                await asyncio.to_thread(_record_failure, job_id, str(e), attempts)
+            except Exception as db_error:
+                # The claim lease expires on its own, so the job will be retried anyway.
+                print(f"--- FEEDBACK ERROR: Could not record failure for job {job_id}: {db_error} ---")
+
+
+queue = FeedbackQueue()
@@ -1,9 +1,18 @@
 # gdrive_service.py
 # FIXED: Improved credential refresh logic and error handling.
+# Credentials are cached per process and the Drive client with its HTTP connection per thread.
+# The access token is refreshed proactively shortly before it expires, under a lock,
+# so an upload normally costs a single Drive API call.
 
 import os
 import io
 import json
+import threading
+from datetime import datetime, timedelta
+from typing import BinaryIO, Optional, Union
+
+import google_auth_httplib2
+import httplib2
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
@@ -18,68 +27,152 @@ REFRESH_TOKEN = os.getenv("GOOGLE_REFRESH_TOKEN")
 FOLDER_ID = os.getenv("GOOGLE_DRIVE_FOLDER_ID")
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
-def get_credentials():
-    """
-    Creates and returns Google API credentials using the client secrets file
-    and the stored refresh token.
-    """
-    if not all([CLIENT_SECRET_FILE, REFRESH_TOKEN]):
-        raise ValueError("Google OAuth credentials (client secret file or refresh token) are not set.")
+# Refresh the access token this long before it actually expires.
+REFRESH_MARGIN = timedelta(minutes=5)
+# Files larger than this are sent with a chunked resumable upload; smaller ones in one request.
+RESUMABLE_THRESHOLD_BYTES = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Must be a multiple of 256 KB
 
-    creds = None
-    
+# --- Process-wide cache ---
+_lock = threading.Lock()
+_credentials: Optional[Credentials] = None
+_auth_request: Optional[Request] = None
+# httplib2 connections are not thread-safe, so each thread keeps its own Drive client.
+_thread_local = threading.local()
+
+
+def _load_client_config() -> dict:
+    """Reads the OAuth client configuration from the client secrets file."""
     try:
-        # Load the client secrets from the file downloaded from Google Cloud Console.
         with open(CLIENT_SECRET_FILE, 'r') as f:
-            client_config = json.load(f).get("web") or json.load(f).get("installed")
-
-        # Create a credentials object by combining the client secrets with the refresh token.
-        creds = Credentials(
-            token=None,  # No initial access token needed, it will be fetched.
-            refresh_token=REFRESH_TOKEN,
-            token_uri=client_config["token_uri"],
-            client_id=client_config["client_id"],
-            client_secret=client_config["client_secret"],
-            scopes=SCOPES
-        )
-        
-        # --- NEW: Directly refresh the credentials to get a valid access token. ---
-        # This is a more direct and robust way to handle the initial token fetch.
-        creds.refresh(Request())
-
+            config = json.load(f)
+        client_config = config.get("web") or config.get("installed")
+        # Fail here on a malformed file rather than in the middle of a token refresh.
+        for key in ("token_uri", "client_id", "client_secret"):
+            if not client_config.get(key):
+                raise KeyError(key)
+        return client_config
     except FileNotFoundError:
         raise ValueError(f"Client secret file not found at: {CLIENT_SECRET_FILE}")
     except (KeyError, TypeError, json.JSONDecodeError):
         raise ValueError("Invalid client_secret.json file format.")
-    except Exception as e:
-        # This will catch specific errors from the creds.refresh() call.
-        print(f"Failed to refresh token. The refresh token is likely invalid or revoked. Error: {e}")
-        raise ValueError("Could not refresh credentials. The refresh token might be invalid.")
-            
-    return creds
-
-def upload_file_to_drive(filename: str, file_content: bytes, content_type: str):
-    """Uploads a file to the specified Google Drive folder."""
+
+
+def _needs_refresh(creds: Credentials) -> bool:
+    if not creds.token or creds.expiry is None:
+        return True
+    # google-auth stores expiry as a naive UTC datetime.
+    return creds.expiry - REFRESH_MARGIN <= datetime.utcnow()
+
+
+def get_credentials() -> Credentials:
+    """
+    Returns cached Google API credentials, refreshing the access token only when it is
+    missing or about to expire. The client secrets file is read once per process.
+    """
+    global _credentials, _auth_request
+
+    if not all([CLIENT_SECRET_FILE, REFRESH_TOKEN]):
+        raise ValueError("Google OAuth credentials (client secret file or refresh token) are not set.")
+
+    creds = _credentials
+    if creds is not None and not _needs_refresh(creds):
+        return creds
+
+    with _lock:
+        # Another thread may have refreshed while we were waiting for the lock.
+        if _credentials is not None and not _needs_refresh(_credentials):
+            return _credentials
+
+        if _credentials is None:
+            client_config = _load_client_config()
+            _credentials = Credentials(
+                token=None,  # No initial access token needed, it will be fetched.
+                refresh_token=REFRESH_TOKEN,
+                token_uri=client_config["token_uri"],
+                client_id=client_config["client_id"],
+                client_secret=client_config["client_secret"],
+                scopes=SCOPES
+            )
+        if _auth_request is None:
+            # Reused for every refresh so the token endpoint connection is kept alive.
+            _auth_request = Request()
+
+        try:
+            _credentials.refresh(_auth_request)
+        except Exception as e:
+            # This will catch specific errors from the creds.refresh() call.
+            print(f"Failed to refresh token. The refresh token is likely invalid or revoked. Error: {e}")
+            raise ValueError("Could not refresh credentials. The refresh token might be invalid.")
+
+        return _credentials
+
+
+def get_drive_service():
+    """Returns this thread's cached Drive v3 client, building it on first use."""
+    creds = get_credentials()
+    service = getattr(_thread_local, "service", None)
+    if service is None:
+        # The authorized HTTP object keeps a persistent connection to the Drive API and
+        # reads the token from the shared credentials object, so refreshes apply automatically.
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+        service = build('drive', 'v3', http=http, cache_discovery=False)
+        _thread_local.service = service
+    return service
+
+
+def reset_cache():
+    """Drops the cached credentials and clients, e.g. after the refresh token was rotated."""
+    global _credentials, _auth_request, _thread_local
+    with _lock:
+        _credentials = None
+        _auth_request = None
+        _thread_local = threading.local()
+
+
+def upload_file_to_drive(filename: str, file_content: Union[bytes, BinaryIO], content_type: str):
+    """
+    Uploads a file to the specified Google Drive folder.
+    Small files go up in a single request; files above RESUMABLE_THRESHOLD_BYTES use
+    a chunked resumable upload.
+    """
     if not FOLDER_ID:
         raise ValueError("GOOGLE_DRIVE_FOLDER_ID is not set.")
 
     try:
-        creds = get_credentials()
-        service = build('drive', 'v3', credentials=creds)
+        service = get_drive_service()
 
         file_metadata = {
             'name': filename,
             'parents': [FOLDER_ID]
         }
-        
-        media = io.BytesIO(file_content)
-        media_body = MediaIoBaseUpload(media, mimetype=content_type, resumable=True)
-        
-        file = service.files().create(
+
+        media = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+        media.seek(0, os.SEEK_END)
+        size = media.tell()
+        media.seek(0)
+
+        resumable = size > RESUMABLE_THRESHOLD_BYTES
+        media_body = MediaIoBaseUpload(
+            media,
+            mimetype=content_type,
+            chunksize=UPLOAD_CHUNK_SIZE,
+            resumable=resumable
+        )
+
+        request = service.files().create(
             body=file_metadata,
             media_body=media_body,
             fields='id'
-        ).execute()
+        )
+
+        if resumable:
+            # Send the file chunk by chunk; a failed chunk is retried without restarting the upload.
+            file = None
+            while file is None:
+                _, file = request.next_chunk(num_retries=3)
+        else:
+            file = request.execute(num_retries=3)
 
         print(f"--- GDRIVE: Successfully uploaded '{filename}' with File ID: {file.get('id')} ---")
         return file.get('id')
@@ -87,4 +180,4 @@ def upload_file_to_drive(filename: str, file_content: bytes, content_type: str):
     except Exception as e:
         print(f"--- GDRIVE ERROR: An error occurred: {e} ---")
         # Re-raise the exception so the main app knows something went wrong.
-        raise e
\ No newline at end of file
+        raise e
@@ -0,0 +1,247 @@
+# idempotency.py
+# Idempotency-Key support for expensive POST endpoints.
+# The first request with a given key runs normally and its response is stored; retries with
+# the same key and payload get the stored response back instead of re-running scoring, the
+# AI call and the email. A retry that arrives while the original is still running waits for it.
+# The original holds a lease on its record and renews it while it runs; if its worker dies,
+# the lease runs out and the next retry takes the key over instead of waiting for the TTL.
+# Only a failed operation gives its key back: once the operation has returned, its response
+# is stored even if the client disconnects, so a retry never repeats the side effects.
+
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+
+import crud
+from database import SessionLocal
+
+# --- Configuration ---
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+# How long a duplicate waits for an in-flight original before giving up with 409.
+IN_FLIGHT_WAIT_SECONDS = 120
+POLL_INTERVAL_SECONDS = 0.5
+# An in-progress record whose lease is not renewed for this long is considered abandoned.
+IN_PROGRESS_LEASE_SECONDS = 60
+LEASE_RENEW_SECONDS = IN_PROGRESS_LEASE_SECONDS / 3
+MAX_KEY_LENGTH = 255
+# Storing a finished response is retried this many times before the claim is left to expire.
+COMPLETE_ATTEMPTS = 3
+COMPLETE_RETRY_SECONDS = 1
+# Roughly one request in this many also sweeps expired records.
+EVICTION_SAMPLE_RATE = 50
+
+# Requests running in this process, so local duplicates await the same future instead of polling.
+_in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+# Responses being stored after their request was cancelled; referenced so they are not garbage collected.
+_completing: Set[asyncio.Task] = set()
+
+
+def fingerprint(*parts: Any) -> str:
+    """Returns a stable SHA-256 fingerprint of the request payload parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, (bytes, bytearray)):
+            part = json.dumps(part, sort_keys=True, default=str).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def fingerprint_stream(stream, *parts: Any, chunk_size: int = 1024 * 1024) -> str:
+    """Fingerprints a seekable file stream in chunks together with extra payload parts."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return fingerprint(digest.digest(), *parts)
+
+
+def _claim(scope: str, key: str, request_fingerprint: str, claim_id: str):
+    """Tries to claim the key. Returns (claimed, existing_status, existing_fingerprint, existing_body)."""
+    db = SessionLocal()
+    try:
+        if random.randrange(EVICTION_SAMPLE_RATE) == 0:
+            crud.delete_expired_idempotency_records(db)
+        if crud.create_idempotency_record(
+            db, scope, key, request_fingerprint, IDEMPOTENCY_TTL_SECONDS, claim_id, IN_PROGRESS_LEASE_SECONDS
+        ):
+            return True, None, None, None
+        record = crud.get_idempotency_record(db, scope, key)
+        if record is None:
+            return False, None, None, None  # Released in the meantime; caller retries the claim
+        if _as_naive_utc(record.expires_at) <= datetime.utcnow():
+            crud.delete_idempotency_record(db, scope, key)
+            return False, None, None, None
+        if record.status == "in_progress" and (
+            record.lease_expires_at is None or _as_naive_utc(record.lease_expires_at) <= datetime.utcnow()
+        ):
+            # The original died without completing or releasing the key, so nothing was remembered.
+            if crud.take_over_idempotency_record(db, scope, key, request_fingerprint, claim_id, IN_PROGRESS_LEASE_SECONDS):
+                print(f"--- IDEMPOTENCY: Took over abandoned key {scope}/{key} ---")
+                return True, None, None, None
+            return False, None, None, None  # Someone else took it over first; look again
+        return False, record.status, record.fingerprint, record.response_body
+    finally:
+        db.close()
+
+
+def _as_naive_utc(value: datetime) -> datetime:
+    """Normalises a DB timestamp to naive UTC, matching datetime.utcnow() used elsewhere."""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _complete(scope: str, key: str, body: str, claim_id: str):
+    db = SessionLocal()
+    try:
+        crud.complete_idempotency_record(db, scope, key, body, claim_id)
+    finally:
+        db.close()
+
+
+def _release(scope: str, key: str, claim_id: str):
+    db = SessionLocal()
+    try:
+        crud.delete_idempotency_record(db, scope, key, claimed_by=claim_id)
+    finally:
+        db.close()
+
+
+def _renew(scope: str, key: str, claim_id: str) -> bool:
+    db = SessionLocal()
+    try:
+        return crud.renew_idempotency_lease(db, scope, key, claim_id, IN_PROGRESS_LEASE_SECONDS)
+    finally:
+        db.close()
+
+
+async def _keep_lease(scope: str, key: str, claim_id: str):
+    """Renews the lease on a claimed key until cancelled."""
+    while True:
+        await asyncio.sleep(LEASE_RENEW_SECONDS)
+        try:
+            if not await asyncio.to_thread(_renew, scope, key, claim_id):
+                print(f"--- IDEMPOTENCY ERROR: Lost the lease on {scope}/{key} ---")
+                return
+        except Exception as e:
+            print(f"--- IDEMPOTENCY ERROR: Could not renew the lease on {scope}/{key}: {e} ---")
+
+
+async def _store_response(scope: str, key: str, body: str, claim_id: str, lease_task: asyncio.Task):
+    """Completes the record, retrying on errors, and keeps renewing the lease until it is stored."""
+    try:
+        for attempt in range(1, COMPLETE_ATTEMPTS + 1):
+            try:
+                await asyncio.to_thread(_complete, scope, key, body, claim_id)
+                return
+            except Exception as e:
+                print(f"--- IDEMPOTENCY ERROR: Could not store the response for {scope}/{key} (attempt {attempt}): {e} ---")
+                if attempt < COMPLETE_ATTEMPTS:
+                    await asyncio.sleep(COMPLETE_RETRY_SECONDS * attempt)
+    finally:
+        lease_task.cancel()
+
+
+def _mismatch():
+    return HTTPException(
+        status_code=422,
+        detail="This Idempotency-Key was already used with a different request payload."
+    )
+
+
+async def run_idempotent(
+    scope: str,
+    key: Optional[str],
+    request_fingerprint: str,
+    operation: Callable[[], Awaitable[Any]],
+    serialize: Callable[[Any], dict],
+) -> Tuple[dict, bool]:
+    """
+    Runs `operation` at most once per (scope, key) and returns (response_body, replayed).
+    Without a key the operation simply runs. The response is always the serialized dict,
+    so the original and replayed responses are identical.
+    """
+    if not key:
+        return serialize(await operation()), False
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long.")
+
+    local_key = (scope, key)
+    claim_id = uuid.uuid4().hex
+    deadline = time.monotonic() + IN_FLIGHT_WAIT_SECONDS
+
+    while True:
+        future = _in_flight.get(local_key)
+        if future is not None:
+            # The original is running in this process: share its outcome.
+            body, original_fingerprint = await asyncio.shield(future)
+            if original_fingerprint != request_fingerprint:
+                raise _mismatch()
+            return body, True
+
+        claimed, existing_status, existing_fingerprint, existing_body = await asyncio.to_thread(
+            _claim, scope, key, request_fingerprint, claim_id
+        )
+        if claimed:
+            break
+        if existing_status is not None and existing_fingerprint != request_fingerprint:
+            raise _mismatch()
+        if existing_status == "completed":
+            return json.loads(existing_body), True
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still being processed. Please retry shortly."
+            )
+        # In progress in another worker (or just released): wait and look again.
+        if existing_status is not None:
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[local_key] = future
+    lease_task = asyncio.create_task(_keep_lease(scope, key, claim_id))
+    try:
+        try:
+            result = await operation()
+        except BaseException as e:
+            # Failed requests are not remembered, so the client can retry with the same key.
+            lease_task.cancel()
+            await asyncio.shield(asyncio.to_thread(_release, scope, key, claim_id))
+            _fail(future, e)
+            raise
+
+        # The operation's side effects have happened: from here on the key is never released.
+        try:
+            body = serialize(result)
+        except BaseException as e:
+            # Nothing to store; leave the claim to expire rather than let a retry run it again.
+            lease_task.cancel()
+            _fail(future, e)
+            raise
+        future.set_result((body, request_fingerprint))
+        completing = asyncio.create_task(_store_response(scope, key, json.dumps(body, default=str), claim_id, lease_task))
+        _completing.add(completing)
+        completing.add_done_callback(_completing.discard)
+        # A client disconnect cancels only the wait, not the write.
+        await asyncio.shield(completing)
+        return body, False
+    finally:
+        _in_flight.pop(local_key, None)
+
+
+def _fail(future: asyncio.Future, error: BaseException):
+    if isinstance(error, Exception):
+        future.set_exception(error)
+        # Mark the exception as retrieved in case nobody else is waiting on it.
+        future.exception()
+    else:
+        future.cancel()
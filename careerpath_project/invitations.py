@@ -0,0 +1,225 @@
+# invitations.py
+# Bulk invitation import for onboarding a whole cohort.
+# All users and one InviteRecipient row per address are written in one transaction with
+# set-based inserts. The background sender (leased_jobs.py) claims pending recipients in
+# batches, issues their tokens just before sending, and sends them through Brevo at a
+# rate shared by all workers, so sends survive restarts. Progress is recorded on an InviteJob row.
+#
+# Run it directly: python invitations.py emails.csv [--no-email]
+
+import argparse
+import asyncio
+import csv
+import io
+import os
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from sqlalchemy.orm import Session
+
+import auth
+import crud
+import email_service
+import leased_jobs
+import user_logger
+from database import SessionLocal
+
+# --- Configuration ---
+INVITE_EXPIRE_DAYS = int(os.getenv("INVITE_EXPIRE_DAYS", "7"))
+MAX_INVITES_PER_IMPORT = int(os.getenv("MAX_INVITES_PER_IMPORT", "20000"))
+INVITE_EMAIL_BATCH_SIZE = min(int(os.getenv("INVITE_EMAIL_BATCH_SIZE", "100")), email_service.MAX_BATCH_RECIPIENTS)
+# Shared by all worker processes (slots are reserved in the rate_slots table).
+INVITE_EMAIL_BATCHES_PER_MINUTE = float(os.getenv("INVITE_EMAIL_BATCHES_PER_MINUTE", "20"))
+MAX_SEND_ATTEMPTS = 3
+BASE_BACKOFF_SECONDS = 60
+POLL_INTERVAL_SECONDS = 30
+CLAIM_LEASE_SECONDS = 5 * 60
+
+_email_adapter = TypeAdapter(EmailStr)
+
+
+def read_emails(stream: BinaryIO) -> List[str]:
+    """Reads addresses from a CSV with an 'email' column, or from a plain list with one per line."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        rows = list(csv.reader(text))
+    finally:
+        text.detach()
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    if "email" in header:
+        column = header.index("email")
+        return [row[column] for row in rows[1:] if len(row) > column]
+    return [row[0] for row in rows if row]
+
+
+def normalize_emails(emails: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """Validates addresses the same way MagicLinkRequest does. Returns (unique valid emails, invalid entries)."""
+    valid, invalid, seen = [], [], set()
+    for raw in emails:
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            email = _email_adapter.validate_python(raw)
+        except ValidationError:
+            invalid.append(raw)
+            continue
+        if email not in seen:
+            seen.add(email)
+            valid.append(email)
+    return valid, invalid
+
+
+def issue_invitations(db: Session, emails: Iterable[str], created_by: Optional[str] = None, send_email: bool = True):
+    """
+    Creates missing users and, when send_email is set, one pending InviteRecipient per
+    address, all in a single transaction. Returns (job, invalid). Tokens are issued by the
+    sender just before each batch goes out, so an email never carries a stale token.
+    """
+    valid, invalid = normalize_emails(emails)
+    if len(valid) > MAX_INVITES_PER_IMPORT:
+        raise ValueError(f"At most {MAX_INVITES_PER_IMPORT} emails can be invited at once.")
+
+    try:
+        crud.upsert_users(db, valid)
+        job = crud.create_invite_job(db, created_by=created_by, total=len(valid), invalid=len(invalid))
+        if send_email and valid:
+            crud.create_invite_recipients(db, job.id, valid)
+        else:
+            job.status = "done"
+            job.finished_at = datetime.utcnow()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    user_logger.log_user_emails(valid)
+    return job, invalid
+
+
+def _claim_batch(limit: int, job_id: Optional[int] = None) -> List[Tuple[int, str, int]]:
+    db = SessionLocal()
+    try:
+        return [
+            (r.id, r.email, r.attempts)
+            for r in crud.claim_due_invite_recipients(db, limit=limit, lease_seconds=CLAIM_LEASE_SECONDS, job_id=job_id)
+        ]
+    finally:
+        db.close()
+
+
+def _issue_tokens(emails: List[str]) -> List[Tuple[str, str]]:
+    """Replaces each address's outstanding tokens with a fresh invitation token. Returns (email, plain_token) pairs."""
+    invitations, digests = [], []
+    for email in emails:
+        plain_token, token_hash = auth.create_invite_token()
+        invitations.append((email, plain_token))
+        digests.append((email, token_hash))
+    db = SessionLocal()
+    try:
+        crud.invalidate_magic_tokens(db, emails)
+        crud.create_magic_tokens_bulk(db, digests, expires_at=datetime.utcnow() + timedelta(days=INVITE_EXPIRE_DAYS))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return invitations
+
+
+def _record_batch(recipient_ids: List[int], sent: bool, error: Optional[str] = None, retry_at: Optional[datetime] = None):
+    db = SessionLocal()
+    try:
+        crud.record_invite_batch(db, recipient_ids, sent=sent, error=error, retry_at=retry_at)
+    finally:
+        db.close()
+
+
+class InviteSender(leased_jobs.LeasedJobWorker):
+    """
+    Claims pending recipients one batch at a time and sends at most `batches_per_minute`
+    batches a minute across all workers. Recipients left over by a restart are claimed again once their lease expires.
+    """
+
+    log_tag = "INVITE"
+
+    def __init__(self, batch_size: int = INVITE_EMAIL_BATCH_SIZE, batches_per_minute: float = INVITE_EMAIL_BATCHES_PER_MINUTE):
+        super().__init__(1, POLL_INTERVAL_SECONDS)
+        self.batch_size = batch_size
+        self.interval = 60.0 / batches_per_minute if batches_per_minute > 0 else 0.0
+
+    def claim(self, limit: int):
+        batch = _claim_batch(self.batch_size)
+        return [(batch,)] if batch else []
+
+    async def process(self, batch: List[Tuple[int, str, int]]):
+        await self.send_batch(batch)
+
+    async def send_batch(self, batch: List[Tuple[int, str, int]]):
+        """Issues tokens for one claimed batch, sends it and records the outcome per recipient."""
+        await leased_jobs.wait_for_rate_slot("invite-email", self.interval)
+
+        ids = [recipient_id for recipient_id, _, _ in batch]
+        attempts = max(attempts for _, _, attempts in batch)
+        try:
+            invitations = await asyncio.to_thread(_issue_tokens, [email for _, email, _ in batch])
+            ok = await asyncio.to_thread(email_service.send_invitations_batch, invitations, INVITE_EXPIRE_DAYS)
+            error = None if ok else "The email service rejected a batch."
+        except Exception as e:
+            ok, error = False, str(e)
+        if not ok:
+            print(f"--- INVITE ERROR: Batch of {len(batch)} failed on attempt {attempts}: {error} ---")
+        try:
+            retry_at = None if ok else leased_jobs.retry_at(attempts, MAX_SEND_ATTEMPTS, BASE_BACKOFF_SECONDS)
+            await asyncio.to_thread(_record_batch, ids, ok, error, retry_at)
+        except Exception as db_error:
+            # The claim lease expires on its own, so these recipients will be sent again.
+            print(f"--- INVITE ERROR: Could not record batch outcome: {db_error} ---")
+
+    async def send_job(self, job_id: int):
+        """Sends one job's due recipients batch by batch, without the polling loop (used by the CLI)."""
+        while True:
+            batch = await asyncio.to_thread(_claim_batch, self.batch_size, job_id)
+            if not batch:
+                return
+            await self.send_batch(batch)
+
+
+sender = InviteSender()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Invite a cohort of users by email.")
+    parser.add_argument("path", help="CSV with an 'email' column, or a file with one address per line")
+    parser.add_argument("--no-email", action="store_true", help="Create users without sending emails")
+    args = parser.parse_args()
+
+    import models
+    import migrations
+    from database import engine
+    models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
+
+    with open(args.path, "rb") as stream:
+        emails = read_emails(stream)
+    db = SessionLocal()
+    try:
+        job, invalid = issue_invitations(db, emails, created_by="cli", send_email=not args.no_email)
+        job_id, total = job.id, job.total
+    finally:
+        db.close()
+
+    print(f"Created invite job {job_id}: {total} invitations, {len(invalid)} invalid addresses.")
+    for address in invalid:
+        print(f"  invalid: {address}")
+    if args.no_email:
+        return
+    asyncio.run(sender.send_job(job_id))
+    print("Done.")
+
+
+if __name__ == "__main__":
+    main()
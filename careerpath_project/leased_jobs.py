@@ -0,0 +1,123 @@
+# leased_jobs.py
+# Shared worker loop for job tables whose rows are claimed with a lease
+# (see crud.claim_due_jobs): resume archival uploads and deferred AI feedback.
+# A worker polls for due jobs, runs at most `concurrency` of them at once as tracked
+# tasks, and on shutdown gives running jobs SHUTDOWN_GRACE_SECONDS to finish. Jobs that
+# are cancelled are picked up again by whichever worker claims them after the lease expires.
+# wait_for_rate_slot() spaces out outbound calls at a rate shared by every worker process.
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+import crud
+from database import SessionLocal
+
+# --- Configuration ---
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("JOB_SHUTDOWN_GRACE_SECONDS", "20"))
+
+
+def retry_at(attempts: int, max_attempts: int, base_backoff_seconds: float) -> Optional[datetime]:
+    """When to retry after the `attempts`-th failure (exponential backoff), or None to give up."""
+    if attempts >= max_attempts:
+        return None
+    return datetime.utcnow() + timedelta(seconds=base_backoff_seconds * 2 ** (attempts - 1))
+
+
+def _reserve_rate_slot(name: str, interval: float) -> float:
+    db = SessionLocal()
+    try:
+        return crud.reserve_rate_slot(db, name=name, interval=interval)
+    finally:
+        db.close()
+
+
+async def wait_for_rate_slot(name: str, interval: float):
+    """
+    Waits for the next `name` slot. Slots are reserved in the database, so all workers together
+    make at most one call per `interval` seconds, however many processes are running.
+    """
+    if interval <= 0:
+        return
+    start = await asyncio.to_thread(_reserve_rate_slot, name, interval)
+    delay = start - time.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+class LeasedJobWorker:
+    """
+    Base class for the background workers. Subclasses implement claim() (blocking, run in a
+    thread; returns argument tuples) and process(*job).
+    """
+
+    log_tag = "JOBS"
+
+    def __init__(self, concurrency: int, poll_interval: float, shutdown_grace: float = SHUTDOWN_GRACE_SECONDS):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.shutdown_grace = shutdown_grace
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._jobs: Set[asyncio.Task] = set()
+
+    def claim(self, limit: int) -> List[tuple]:
+        raise NotImplementedError
+
+    async def process(self, *job):
+        raise NotImplementedError
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops polling, then waits up to shutdown_grace for running jobs and cancels the rest."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._jobs:
+            _, unfinished = await asyncio.wait(self._jobs, timeout=self.shutdown_grace)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+            if unfinished:
+                print(f"--- {self.log_tag}: Cancelled {len(unfinished)} running job(s) at shutdown; they will be retried ---")
+
+    def notify(self):
+        """Wakes the worker so freshly queued jobs start immediately."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @property
+    def running(self) -> int:
+        return len(self._jobs)
+
+    async def _run(self):
+        while True:
+            try:
+                free_slots = self.concurrency - len(self._jobs)
+                if free_slots > 0:
+                    for job in await asyncio.to_thread(self.claim, free_slots):
+                        task = asyncio.create_task(self.process(*job))
+                        self._jobs.add(task)
+                        task.add_done_callback(self._job_done)
+            except Exception as e:
+                print(f"--- {self.log_tag} ERROR: Could not poll for pending jobs: {e} ---")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _job_done(self, task: asyncio.Task):
+        self._jobs.discard(task)
+        self.notify()
@@ -3,7 +3,7 @@
 
 import pandas as pd
 from sqlalchemy.orm import Session
-import crud, schemas
+import cache_bus, course_recommender, crud, question_bank, schemas
 
 # The CSV file must be in the same directory as your python files on Render.
 CSV_PATH = "diddy.csv"
@@ -77,3 +77,56 @@ def populate_database(db: Session):
     print("-" * 20)
     print(f"Successfully added {questions_added} new questions to the database.")
     print("Database population check complete.")
+    if questions_added:
+        cache_bus.publish(question_bank.CACHE_TOPIC)  # Other workers reload their question bank
+
+# The course catalog used by course_recommender, indexed by the same JRI categories.
+COURSES_CSV_PATH = "courses.csv"
+
+def populate_courses(db: Session):
+    """
+    Populates the course catalog from the courses.csv file.
+    This function is called by main.py on startup if the courses table is empty.
+    """
+    print("Attempting to populate course catalog from CSV...")
+
+    try:
+        df = pd.read_csv(COURSES_CSV_PATH)
+        df.fillna('', inplace=True)
+        print(f"Found {len(df)} courses in {COURSES_CSV_PATH}")
+    except FileNotFoundError:
+        print(f"ERROR: The file '{COURSES_CSV_PATH}' was not found. Course recommendations will be empty.")
+        return
+    except Exception as e:
+        print(f"An error occurred reading the courses CSV file: {e}")
+        return
+
+    courses_added = 0
+
+    for index, row in df.iterrows():
+        try:
+            title = str(row["title"])
+            if crud.get_course_by_title(db, title=title):
+                continue
+
+            course_schema = schemas.CourseCreate(
+                title=title,
+                platform=str(row["platform"]) or None,
+                category=str(row["category"]),
+                skill_tags=str(row["skillTags"]) or None,
+                url=str(row["url"]) or None,
+                description=str(row["description"]) or None
+            )
+            crud.create_course(db=db, course=course_schema)
+            courses_added += 1
+
+        except KeyError as e:
+            print(f"ERROR: A required column is missing from the courses CSV file: {e}. Skipping row {index + 2}.")
+            continue
+        except Exception as e:
+            print(f"An unexpected error occurred at course row {index + 2}: {e}. Skipping row.")
+            continue
+
+    print(f"Successfully added {courses_added} new courses to the catalog.")
+    if courses_added:
+        cache_bus.publish(course_recommender.CACHE_TOPIC)  # Other workers reload their catalog index
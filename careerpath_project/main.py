@@ -1,22 +1,26 @@
 # main.py
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile
+from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Header, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List, Literal, Optional
 import os
-import io
 import json
-import re
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta, timezone
+import uuid
 
 # Import all local modules
 import crud, models, schemas, auth, ai_analysis, email_service, user_logger
-import cloudinary_service # <-- IMPORT THE NEW CLOUDINARY SERVICE
+import archive_uploader, batch_scoring, data_export, feedback_queue, invitations, resume_ingest, token_reaper
+import skills_engine, course_recommender, resume_files, http_responses, cache_bus, question_bank
 from database import SessionLocal, engine
-import load_database
+import load_database, migrations, idempotency, db_routing, cohort_stats, admission, rate_limits, partitioning
+from contextlib import asynccontextmanager
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
 
 # --- AUTOMATIC DATABASE POPULATION ---
 def initialize_database():
@@ -31,16 +35,65 @@ def initialize_database():
             print("-----------------------------")
         else:
             print(f"Database already contains {question_count} questions. Skipping population.")
+        if db.query(models.Course).count() == 0:
+            load_database.populate_courses(db)
     finally:
         db.close()
 
 initialize_database()
 # ------------------------------------
 
+# --- Background Workers ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cache_bus.bus.start()
+    archive_uploader.uploader.start()
+    feedback_queue.queue.start()
+    invitations.sender.start()
+    resume_ingest.runner.start()
+    token_reaper.reaper.start()
+    compaction_task = asyncio.create_task(cohort_stats.run_compaction_loop(SessionLocal))
+    partition_task = asyncio.create_task(partitioning.run_maintenance_loop(engine))
+    yield
+    partition_task.cancel()
+    compaction_task.cancel()
+    await token_reaper.reaper.stop()
+    await feedback_queue.queue.stop()
+    await invitations.sender.stop()
+    await resume_ingest.runner.stop()
+    await archive_uploader.uploader.stop()
+    await asyncio.to_thread(cache_bus.bus.stop)
+
 
 app = FastAPI(
     title="JRI Career World API",
-    description="API service for JRI Career World, optimized for Vercel/Render deployment."
+    description="API service for JRI Career World, optimized for Vercel/Render deployment.",
+    default_response_class=http_responses.FastJSONResponse,
+    lifespan=lifespan
+)
+
+# --- Admission Control ---
+# Added before CORS so that CORS wraps it and 503 responses carry the CORS headers
+# the frontend needs to read Retry-After.
+app.add_middleware(admission.AdmissionControlMiddleware)
+
+# --- Upload Size Limit ---
+# Stops oversized resume uploads while they are still streaming in. Added before CORS so
+# that CORS wraps it and the frontend can read the 413 response.
+app.add_middleware(
+    resume_files.UploadSizeLimitMiddleware,
+    max_body_size=resume_files.MAX_RESUME_BYTES + resume_files.MULTIPART_OVERHEAD_BYTES,
+    paths=["/users/me/resume"],
+)
+app.add_middleware(
+    resume_files.UploadSizeLimitMiddleware,
+    max_body_size=batch_scoring.MAX_BATCH_BYTES + resume_files.MULTIPART_OVERHEAD_BYTES,
+    paths=["/assessment/batch"],
+)
+app.add_middleware(
+    resume_files.UploadSizeLimitMiddleware,
+    max_body_size=resume_ingest.MAX_INGEST_BYTES + resume_files.MULTIPART_OVERHEAD_BYTES,
+    paths=["/admin/resumes/ingest"],
 )
 
 # --- CORS Middleware Configuration ---
@@ -57,6 +110,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Response Compression ---
+# Added last so it wraps every other middleware and compresses their responses too.
+app.add_middleware(http_responses.CompressionMiddleware)
+
 # --- Dependencies ---
 def get_db():
     db = SessionLocal()
@@ -65,6 +122,27 @@ def get_db():
     finally:
         db.close()
 
+def _email_from_request(request: Request) -> Optional[str]:
+    """Returns the email in a valid bearer token, or None. Used only to route reads."""
+    authorization = request.headers.get("Authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return auth.verify_access_token(authorization[7:], ValueError())
+    except Exception:
+        return None
+
+def get_read_db(request: Request):
+    """
+    Session for read-only endpoints. Uses a read replica when one is configured and
+    caught up, except right after this user wrote something (read-your-writes).
+    """
+    db = db_routing.read_session(pin_key=_email_from_request(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
 async def get_current_user(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -79,65 +157,82 @@ async def get_current_user(token: str = Depends(auth.oauth2_scheme), db: Session
         raise credentials_exception
     return user
 
+async def get_current_user_for_read(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_read_db)):
+    """Same as get_current_user, but looks the user up through the read session."""
+    return await get_current_user(token=token, db=db)
+
+# Comma-separated emails of staff allowed to run bulk operations (answer sheets, invitations, resumes).
+BATCH_OPERATOR_EMAILS = {e.strip().lower() for e in os.getenv("BATCH_OPERATOR_EMAILS", "").split(",") if e.strip()}
+
+async def get_batch_operator(current_user: schemas.User = Depends(get_current_user)):
+    if current_user.email.lower() not in BATCH_OPERATOR_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to submit batch assessments.")
+    return current_user
+
 # --- API ENDPOINTS ---
 
 @app.post("/users/me/resume", response_model=schemas.User, tags=["Users"])
 async def upload_and_analyze_resume(
+    response: Response,
     current_user: schemas.User = Depends(get_current_user),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")
 ):
     """
     UPDATED: This endpoint now uploads resumes to Cloudinary instead of Google Drive.
+    The upload runs in the background via archive_uploader.
+    Retries sent with the same Idempotency-Key return the original response.
     """
-    contents = await file.read()
+    request_fingerprint = idempotency.fingerprint_stream(file.file, file.filename) if idempotency_key else ""
+    body, replayed = await idempotency.run_idempotent(
+        scope=f"user:{current_user.id}:resume",
+        key=idempotency_key,
+        request_fingerprint=request_fingerprint,
+        operation=lambda: _analyze_resume(current_user, file, db),
+        serialize=lambda user: schemas.User.model_validate(user).model_dump(mode="json")
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    db_routing.mark_write(current_user.email)
+    return body
+
+async def _analyze_resume(current_user: schemas.User, file: UploadFile, db: Session):
+    # The upload is already spooled to a temp file by the multipart parser, and its
+    # size was capped by UploadSizeLimitMiddleware. Read it in place, never as one bytes blob.
     filename = file.filename
-    text = ""
-    
-    if filename.endswith(".pdf"):
-        try:
-            import PyPDF2
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(contents))
-            for page in pdf_reader.pages:
-                text += page.extract_text() or ""
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Could not read PDF file: {e}")
-    elif filename.endswith(".docx"):
-        try:
-            import docx
-            doc = docx.Document(io.BytesIO(contents))
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Could not read DOCX file: {e}")
-    else:
+    stream = file.file
+
+    if resume_files.file_size(stream) > resume_files.MAX_RESUME_BYTES:
+        raise HTTPException(status_code=413, detail="File too large.")
+
+    file_type = resume_files.sniff_file_type(stream)
+    if file_type is None:
         raise HTTPException(status_code=400, detail="Unsupported file type. Please upload a .pdf or .docx file.")
 
+    try:
+        text = resume_files.extract_text(stream, file_type)
+    except resume_files.UnsupportedResumeFile as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     if not text.strip():
         raise HTTPException(status_code=400, detail="Could not extract any text from the uploaded file.")
 
-    analysis_results = await ai_analysis.analyze_resume_text(text)
+    # Archive the original file to Cloudinary in the background; the response never waits on it.
+    # The resulting URL is stored on the user record once the upload completes.
+    try:
+        if archive_uploader.save_for_upload(current_user.id, filename, stream, resume_files.MIMETYPES[file_type]):
+            archive_uploader.uploader.notify()
+    except Exception as e:
+        # The core analysis can still proceed; the user doesn't need to know if the backup failed.
+        print(f"--- ARCHIVE ERROR: Could not queue {filename} for upload: {e} ---")
+
+    insights = skills_engine.analyze_resume(text)
+    analysis_results = await ai_analysis.analyze_resume_text(text, insights=insights)
     
     sanitized_text = text.replace('\x00', '')
     sanitized_analysis = analysis_results.replace('\x00', '')
 
-    try:
-        # --- UPDATED LOGIC ---
-        # Call the Cloudinary upload function
-        file_url = cloudinary_service.upload_file_to_cloudinary(
-            filename=filename,
-            file_contents=contents,
-            mimetype=file.content_type
-        )
-        print(f"Successfully uploaded {filename} to Cloudinary.")
-        # You could optionally save the file_url to the user's profile here if needed.
-        # For example: crud.update_user_resume_url(db, user_id=current_user.id, url=file_url)
-        # --- END OF UPDATED LOGIC ---
-    except Exception as e:
-        print(f"A Cloudinary API error occurred: {e}")
-        # We don't raise an exception here because the core analysis succeeded.
-        # The user doesn't need to know if the cloud backup failed.
-
     return crud.update_user_resume_data(db, user_id=current_user.id, text=sanitized_text, analysis=sanitized_analysis)
 
 
@@ -147,7 +242,17 @@ def read_root():
     return {"status": "ok", "message": "Welcome to JRI Career World API"}
 
 @app.post("/auth/magic-link/request", status_code=status.HTTP_202_ACCEPTED, tags=["Authentication"])
-async def request_magic_link(request: schemas.MagicLinkRequest, db: Session = Depends(get_db)):
+async def request_magic_link(request: schemas.MagicLinkRequest, http_request: Request, db: Session = Depends(get_db)):
+    # Rate limits are checked first, so a flood never reaches the database or the email service.
+    client_ip = http_request.client.host if http_request.client else "unknown"
+    retry_after = rate_limits.check("magic-link-ip", client_ip, rate_limits.MAGIC_LINK_PER_IP) \
+        or rate_limits.check("magic-link-email", request.email.lower(), rate_limits.MAGIC_LINK_PER_EMAIL)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many sign-in links requested. Please try again later.",
+            headers={"Retry-After": str(retry_after)},
+        )
     user = crud.get_or_create_user(db, email=request.email)
     user_logger.log_user_email(user.email)
     plain_token, token_hash = auth.create_magic_link_token()
@@ -157,41 +262,264 @@ async def request_magic_link(request: schemas.MagicLinkRequest, db: Session = De
 
 @app.post("/auth/magic-link/login", response_model=schemas.Token, tags=["Authentication"])
 async def login_with_magic_link(request: schemas.MagicLinkLogin, db: Session = Depends(get_db)):
-    valid_tokens = db.query(models.MagicToken).filter(
-        models.MagicToken.is_used == False,
-        models.MagicToken.expires_at > datetime.utcnow()
-    ).all()
-
-    db_token_record = None
-    for token_record in valid_tokens:
-        if auth.verify_magic_link_token(request.token, token_record.token_hash):
-            db_token_record = crud.use_magic_token(db, token_hash=token_record.token_hash)
-            break
-
+    # Tokens are stored as a digest, so the link is found through the unique token_hash index.
+    db_token_record = crud.use_magic_token(db, token_hash=auth.digest_magic_link_token(request.token))
     if not db_token_record:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid, expired, or already used magic link.",
         )
 
+    # The user may have just been created; keep their first reads on the primary.
+    db_routing.mark_write(db_token_record.email)
     access_token = auth.create_access_token(data={"sub": db_token_record.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@app.post("/admin/invitations", response_model=schemas.InviteJob, status_code=status.HTTP_202_ACCEPTED, tags=["Admin"])
+async def invite_users(request: schemas.InviteRequest, operator: schemas.User = Depends(get_batch_operator)):
+    """
+    Creates accounts and invitation links for a list of emails in one transaction.
+    The emails are sent in the background; poll the returned job for progress.
+    """
+    def run():
+        db = SessionLocal()
+        try:
+            job, _ = invitations.issue_invitations(db, request.emails, created_by=operator.email, send_email=request.send_email)
+            db.refresh(job)
+            return schemas.InviteJob.model_validate(job)
+        finally:
+            db.close()
+
+    try:
+        job = await asyncio.to_thread(run)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if job.status == "queued":
+        invitations.sender.notify()
+    return job
+
+@app.get("/admin/invitations/{job_id}", response_model=schemas.InviteJob, tags=["Admin"])
+def read_invite_job(job_id: int, db: Session = Depends(get_db), operator: schemas.User = Depends(get_batch_operator)):
+    job = crud.get_invite_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invite job not found.")
+    return job
+
+@app.post("/admin/resumes/ingest", response_model=schemas.ResumeIngestJob, status_code=status.HTTP_202_ACCEPTED, tags=["Admin"])
+async def ingest_resumes(file: UploadFile = File(...), operator: schemas.User = Depends(get_batch_operator)):
+    """
+    Queues a ZIP archive of resumes for bulk analysis. Files are named after each student's
+    email, or listed in a manifest.csv inside the archive. Poll the returned job for progress.
+    """
+    def run():
+        path = resume_ingest.save_upload(file.file)
+        db = SessionLocal()
+        try:
+            job = crud.create_resume_ingest_job(db, source_path=path, owns_source=True, created_by=operator.email)
+            return schemas.ResumeIngestJob.model_validate(job)
+        finally:
+            db.close()
+
+    try:
+        job = await asyncio.to_thread(run)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    resume_ingest.runner.submit(job.id)
+    return job
+
+@app.get("/admin/resumes/ingest/{job_id}", response_model=schemas.ResumeIngestJob, tags=["Admin"])
+def read_resume_ingest_job(job_id: int, db: Session = Depends(get_db), operator: schemas.User = Depends(get_batch_operator)):
+    job = crud.get_resume_ingest_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ingestion job not found.")
+    result = schemas.ResumeIngestJob.model_validate(job)
+    result.counts = crud.get_resume_ingest_counts(db, job_id)
+    return result
+
+@app.get("/admin/magic-tokens/stats", response_model=schemas.MagicTokenStats, tags=["Admin"])
+async def read_magic_token_stats(operator: schemas.User = Depends(get_batch_operator)):
+    """Size of the magic_tokens table and how fast the reaper is removing used and expired tokens."""
+    return await token_reaper.reaper.stats()
+
+@app.get("/admin/admission/stats", response_model=Dict[str, schemas.AdmissionClassStats], tags=["Admin"])
+async def read_admission_stats(operator: schemas.User = Depends(get_batch_operator)):
+    """Concurrency, queueing and load shedding per cost class, for this worker process."""
+    return admission.controller.stats()
+
+@app.get("/admin/export/{table}", tags=["Admin"])
+def export_table(
+    table: Literal["users", "assessments", "answers"],
+    format: Literal["csv", "ndjson"] = "csv",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    gzip: bool = False,
+    operator: schemas.User = Depends(get_batch_operator)
+):
+    """
+    Streams a table as CSV or NDJSON, optionally limited to rows created in [since, until).
+    Answers include their question's category and text and the selected option's text and points.
+    With gzip=true the download is a .gz file; otherwise the response is compressed as negotiated.
+    """
+    def stream():
+        # The session lives as long as the response body; exports read from a replica when one is available.
+        db = db_routing.read_session()
+        try:
+            yield from data_export.export_chunks(db, table, format, since, until, compress=gzip)
+        finally:
+            db.close()
+
+    media_type = "application/gzip" if gzip else data_export.FORMATS[format][0]
+    name = data_export.filename(table, format, gzip)
+    return StreamingResponse(stream(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
 @app.get("/users/me", response_model=schemas.User, tags=["Users"])
-async def read_users_me(current_user: schemas.User = Depends(get_current_user)):
+async def read_users_me(current_user: schemas.User = Depends(get_current_user_for_read)):
     return current_user
 
+@app.get("/users/me/resume/insights", response_model=schemas.ResumeInsights, tags=["Users"])
+def read_resume_insights(current_user: schemas.User = Depends(get_current_user_for_read)):
+    """Returns locally computed skill and role insights for the stored resume, without calling the AI model."""
+    if not current_user.resume_text:
+        raise HTTPException(status_code=404, detail="No resume has been uploaded yet.")
+    return skills_engine.analyze_resume(current_user.resume_text)
+
+@app.get("/users/me/progress", response_model=schemas.UserProgress, tags=["Users"])
+def read_user_progress(db: Session = Depends(get_read_db), current_user: schemas.User = Depends(get_current_user_for_read)):
+    """Returns the user's running statistics across attempts with a single primary-key read."""
+    progress = crud.get_user_progress(db, user_id=current_user.id)
+    if progress is None:
+        # Attempts made before progress tracking existed are folded in once, on the primary.
+        primary_db = SessionLocal()
+        try:
+            progress = crud.rebuild_user_progress(primary_db, user_id=current_user.id)
+            return _progress_response(progress)
+        finally:
+            primary_db.close()
+    return _progress_response(progress)
+
+def _progress_response(progress: Optional[models.UserProgress]) -> schemas.UserProgress:
+    if progress is None:
+        return schemas.UserProgress()
+    return schemas.UserProgress(
+        attempt_count=progress.attempt_count,
+        best_score=progress.best_score,
+        last_score=progress.last_score,
+        mean_score=progress.mean_score,
+        categories=json.loads(progress.category_stats or "{}")
+    )
+
+@app.get("/users/me/percentiles", response_model=schemas.CohortStanding, tags=["Users"])
+def read_cohort_standing(db: Session = Depends(get_read_db), current_user: schemas.User = Depends(get_current_user_for_read)):
+    """Returns where the user's latest attempt stands in the cohort, per category and overall."""
+    latest = db.query(models.Assessment).filter(
+        models.Assessment.owner_id == current_user.id
+    ).order_by(models.Assessment.id.desc()).first()
+    if latest is None:
+        return schemas.CohortStanding()
+    answer_pairs = crud.get_answer_pairs(db, latest)
+    _, categories_summary, _ = crud.summarize_answers(db, answer_pairs)
+    return schemas.CohortStanding(assessment_id=latest.id, percentiles=cohort_stats.percentiles(categories_summary))
+
 @app.get("/assessment/questions", response_model=List[schemas.Question], tags=["Assessment"])
-def read_questions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_questions(db, skip=skip, limit=limit)
+def read_questions(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
+    return question_bank.get_questions(skip=skip, limit=limit)
+
+@app.post("/assessment/attempts", response_model=schemas.AssessmentAttempt, status_code=status.HTTP_201_CREATED, tags=["Assessment"])
+def start_assessment_attempt(
+    per_category: int = question_bank.QUESTIONS_PER_CATEGORY,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """
+    Draws a new random set of questions, `per_category` from every category, and records it.
+    Submit the answers with the returned attempt_id; answers to other questions are rejected.
+    """
+    if not 1 <= per_category <= question_bank.MAX_QUESTIONS_PER_CATEGORY:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"per_category must be between 1 and {question_bank.MAX_QUESTIONS_PER_CATEGORY}.",
+        )
+    questions = question_bank.sample(per_category)
+    expires_at = datetime.utcnow() + timedelta(hours=question_bank.ATTEMPT_EXPIRE_HOURS)
+    attempt = crud.create_assessment_attempt(
+        db, attempt_id=uuid.uuid4().hex, user_id=current_user.id, question_ids=[q.id for q in questions], expires_at=expires_at
+    )
+    return schemas.AssessmentAttempt(attempt_id=attempt.id, expires_at=expires_at, questions=questions)
 
 @app.post("/assessment/submit", response_model=schemas.Assessment, tags=["Assessment"])
 async def submit_assessment(
     assessment_data: schemas.AssessmentSubmit,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: schemas.User = Depends(get_current_user)
+    current_user: schemas.User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")
 ):
+    """Scores a submission. Retries sent with the same Idempotency-Key return the original response."""
+    body, replayed = await idempotency.run_idempotent(
+        scope=f"user:{current_user.id}:assessment-submit",
+        key=idempotency_key,
+        request_fingerprint=idempotency.fingerprint(assessment_data.model_dump()),
+        operation=lambda: _score_assessment(assessment_data, db, current_user),
+        serialize=lambda result: schemas.Assessment.model_validate(result[0]).model_copy(
+            update={"cohort_percentiles": result[1]}
+        ).model_dump(mode="json")
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    db_routing.mark_write(current_user.email)
+    return body
+
+def _check_attempt(db: Session, assessment_data: schemas.AssessmentSubmit, current_user: schemas.User):
+    """Rejects a submission for an unknown, expired or finished attempt, or with answers to questions it did not serve."""
+    attempt = crud.get_assessment_attempt(db, assessment_data.attempt_id, current_user.id)
+    if attempt is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Assessment attempt not found.")
+    if attempt.assessment_id is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This attempt has already been submitted.")
+    expires_at = attempt.expires_at
+    if expires_at.tzinfo is not None:
+        expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if expires_at <= datetime.utcnow():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="This attempt has expired. Please start a new one.")
+
+    served = set(json.loads(attempt.question_ids))
+    answered = [a.question_id for a in assessment_data.answers]
+    if len(answered) != len(set(answered)):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each question can only be answered once.")
+    unserved = sorted(set(answered) - served)
+    if unserved:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Questions {unserved} were not part of this attempt.",
+        )
+
+async def _score_assessment(assessment_data: schemas.AssessmentSubmit, db: Session, current_user: schemas.User):
+    attempt_id = assessment_data.attempt_id
+    if attempt_id is None:
+        if not question_bank.ALLOW_SUBMIT_WITHOUT_ATTEMPT:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="attempt_id is required. Start an attempt with POST /assessment/attempts first.",
+            )
+        return await _score_answers(assessment_data, db, current_user)
+
+    _check_attempt(db, assessment_data, current_user)
+    # Claim the attempt before the AI call, so a concurrent submit of it is refused up front.
+    claim_id = uuid.uuid4().hex
+    if not crud.claim_assessment_attempt(db, attempt_id, current_user.id, claim_id, question_bank.ATTEMPT_CLAIM_SECONDS):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This attempt is already being submitted.")
+    try:
+        return await _score_answers(assessment_data, db, current_user)
+    except BaseException:
+        try:
+            crud.release_assessment_attempt(db, attempt_id, claim_id)
+        except Exception as e:
+            # The claim expires on its own after ATTEMPT_CLAIM_SECONDS.
+            print(f"--- SUBMIT ERROR: Could not release attempt {attempt_id}: {e} ---")
+        raise
+
+async def _score_answers(assessment_data: schemas.AssessmentSubmit, db: Session, current_user: schemas.User):
     total_score, categories_summary, incorrect_answers = 0, {}, []
 
     for answer_data in assessment_data.answers:
@@ -214,44 +542,88 @@ async def submit_assessment(
         if option.points == 0:
             incorrect_answers.append({"question": question.text, "selected_option": option.text})
 
-    ai_feedback = await ai_analysis.generate_assessment_feedback(categories_summary, incorrect_answers)
-    
-    sanitized_analysis_text = "Analysis not available."
-    sanitized_suggestions = []
-
-    analysis_text = ai_feedback.get("performance_report")
-    if isinstance(analysis_text, str):
-        sanitized_analysis_text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', analysis_text)
-
-    course_suggestions = ai_feedback.get("course_suggestions")
-    if isinstance(course_suggestions, list):
-        for course in course_suggestions:
-            if isinstance(course, dict):
-                sanitized_course = {}
-                for key, value in course.items():
-                    if isinstance(value, str):
-                        sanitized_course[key] = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', value)
-                    else:
-                        sanitized_course[key] = value
-                sanitized_suggestions.append(sanitized_course)
-
-    suggestions_json = json.dumps(sanitized_suggestions)
-
-    email_service.send_assessment_report(
-        email=current_user.email, 
-        report_markdown=sanitized_analysis_text, 
-        score=total_score
+    recommended_courses = course_recommender.recommend_courses(categories_summary)
+    percentiles = cohort_stats.percentiles(categories_summary)
+    ai_feedback = await ai_analysis.generate_assessment_feedback(
+        categories_summary, incorrect_answers, recommended_courses,
+        percentiles if cohort_stats.PERCENTILES_IN_PROMPT else None
     )
     
-    return crud.create_assessment(
+    sanitized_analysis_text = ai_analysis.sanitize_report(ai_feedback.get("performance_report"))
+
+    suggestions_json = json.dumps(recommended_courses)
+
+    db_assessment = crud.create_assessment(
         db=db, 
         user_id=current_user.id, 
         score=total_score, 
         answers=assessment_data.answers, 
         analysis=sanitized_analysis_text, 
-        suggestions=suggestions_json
+        suggestions=suggestions_json,
+        categories_summary=categories_summary,
+        attempt_id=assessment_data.attempt_id
     )
+    if db_assessment is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This attempt has already been submitted.")
+
+    email_service.send_assessment_report(
+        email=current_user.email, 
+        report_markdown=sanitized_analysis_text, 
+        score=total_score
+    )
+    return db_assessment, percentiles
+
+@app.post("/assessment/batch", response_model=schemas.BatchScoreResult, tags=["Assessment"])
+async def submit_assessment_batch(
+    file: UploadFile = File(...),
+    send_email: bool = True,
+    operator: schemas.User = Depends(get_batch_operator)
+):
+    """
+    Scores a class's answer sheets from a CSV or NDJSON file in one pass.
+    AI reports are generated afterwards by the feedback queue and emailed to each student.
+    """
+    file_format = batch_scoring.detect_format(file.filename, file.content_type)
+
+    def run():
+        db = SessionLocal()
+        try:
+            return batch_scoring.score_batch(db, file.file, file_format, send_email=send_email)
+        finally:
+            db.close()
+
+    try:
+        result = await asyncio.to_thread(run)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    print(f"--- BATCH: {operator.email} scored {result['scored']} of {result['sheets']} sheets ---")
+    feedback_queue.queue.notify()
+    return result
+
+@app.get("/assessment/batch/feedback", response_model=schemas.FeedbackQueueStatus, tags=["Assessment"])
+def read_feedback_queue_status(db: Session = Depends(get_db), operator: schemas.User = Depends(get_batch_operator)):
+    """Returns how many deferred AI reports are pending, running, done or failed."""
+    return schemas.FeedbackQueueStatus(counts=crud.get_feedback_job_counts(db))
+
+# Window of /assessment/history when no `since` is given, so a request only visits recent partitions.
+HISTORY_DEFAULT_DAYS = int(os.getenv("ASSESSMENT_HISTORY_DEFAULT_DAYS", "365"))
 
 @app.get("/assessment/history", response_model=List[schemas.Assessment], tags=["Assessment"])
-def get_assessment_history(db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    return db.query(models.Assessment).filter(models.Assessment.owner_id == current_user.id).all()
+def get_assessment_history(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(get_current_user_for_read)
+):
+    """
+    The user's assessments created in [since, until). `since` defaults to HISTORY_DEFAULT_DAYS
+    before `until` (or now).
+    """
+    if since is None:
+        since = (until or datetime.utcnow()) - timedelta(days=HISTORY_DEFAULT_DAYS)
+    query = db.query(models.Assessment).filter(
+        models.Assessment.owner_id == current_user.id, models.Assessment.created_at >= since
+    )
+    if until is not None:
+        query = query.filter(models.Assessment.created_at < until)
+    return query.all()
@@ -0,0 +1,58 @@
+# migrations.py
+# Lightweight, idempotent schema upgrades applied on startup.
+# models.Base.metadata.create_all() creates missing tables but never alters existing ones,
+# so columns and indexes added to existing tables are listed here and added if they are missing.
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+import models
+
+# (table, column, column DDL) for nullable columns added after the table was first created.
+ADDED_COLUMNS = [
+    ("users", "resume_url", "VARCHAR"),
+    ("answers", "created_at", "TIMESTAMP WITH TIME ZONE"),
+    ("idempotency_records", "claimed_by", "VARCHAR"),
+    ("idempotency_records", "lease_expires_at", "TIMESTAMP WITH TIME ZONE"),
+    ("resume_ingest_jobs", "claimed_by", "VARCHAR"),
+    ("resume_ingest_jobs", "lease_expires_at", "TIMESTAMP WITH TIME ZONE"),
+    ("assessment_attempts", "claimed_by", "VARCHAR"),
+    ("assessment_attempts", "claim_expires_at", "TIMESTAMP WITH TIME ZONE"),
+]
+
+# Statements that fill a column from ADDED_COLUMNS for existing rows, run right after it is added.
+BACKFILLS = {
+    ("answers", "created_at"): "UPDATE answers SET created_at = "
+                               "(SELECT created_at FROM assessments WHERE assessments.id = answers.assessment_id)",
+}
+
+# (table, index name) for indexes declared in models.py after the table was first created.
+ADDED_INDEXES = [
+    ("magic_tokens", "ix_magic_tokens_live"),
+    ("magic_tokens", "ix_magic_tokens_expires_at"),
+    ("assessments", "ix_assessments_owner_id"),
+    ("answers", "ix_answers_assessment_id"),
+]
+
+
+def upgrade(engine: Engine):
+    """Adds any columns from ADDED_COLUMNS and indexes from ADDED_INDEXES that the database does not have yet."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in existing_tables:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table)}
+            if column not in columns:
+                print(f"--- MIGRATION: Adding column {table}.{column} ---")
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                if (table, column) in BACKFILLS:
+                    conn.execute(text(BACKFILLS[(table, column)]))
+        for table, index_name in ADDED_INDEXES:
+            if table not in existing_tables:
+                continue
+            if index_name not in {i["name"] for i in inspector.get_indexes(table)}:
+                print(f"--- MIGRATION: Creating index {index_name} ---")
+                index = next(i for i in models.Base.metadata.tables[table].indexes if i.name == index_name)
+                index.create(bind=conn)
@@ -1,7 +1,7 @@
 # models.py
 # Updated for Magic Link authentication.
 
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Float, Text
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Float, Text, UniqueConstraint, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -18,12 +18,20 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     resume_text = Column(Text, nullable=True)
     resume_analysis = Column(Text, nullable=True)
+    resume_url = Column(String, nullable=True)
     assessments = relationship("Assessment", back_populates="owner")
 
 # --- NEW MODEL ---
 # This table will store the magic link tokens.
 class MagicToken(Base):
     __tablename__ = "magic_tokens"
+    __table_args__ = (
+        # Login and link invalidation only look at live tokens, which are a small part of the table.
+        Index("ix_magic_tokens_live", "email", "expires_at",
+              postgresql_where=text("is_used = false"), sqlite_where=text("is_used = 0")),
+        # Lets token_reaper find expired rows without a full scan.
+        Index("ix_magic_tokens_expires_at", "expires_at"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, index=True, nullable=False)
     token_hash = Column(String, unique=True, nullable=False)
@@ -31,6 +39,95 @@ class MagicToken(Base):
     is_used = Column(Boolean, default=False, nullable=False)
 
 
+# Progress of a bulk invitation import (see invitations.py).
+class InviteJob(Base):
+    __tablename__ = "invite_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    created_by = Column(String, nullable=True)
+    status = Column(String, default="queued", nullable=False)  # queued, sending, done, failed
+    total = Column(Integer, default=0, nullable=False)
+    invalid = Column(Integer, default=0, nullable=False)  # Rejected email addresses
+    sent = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+# One invitation email still to be sent. The sender claims these in batches with a lease
+# and issues each recipient's token only when sending (see invitations.py).
+class InviteRecipient(Base):
+    __tablename__ = "invite_recipients"
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("invite_jobs.id"), nullable=False, index=True)
+    email = Column(String, nullable=False)
+    status = Column(String, default="pending", nullable=False, index=True)  # pending, sending, sent, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+
+
+# Durable state for background archival uploads of resume files to Cloudinary.
+class ResumeUpload(Base):
+    __tablename__ = "resume_uploads"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    filename = Column(String, nullable=False)
+    file_path = Column(String, nullable=False)  # Local copy kept until the upload succeeds
+    mimetype = Column(String, nullable=True)
+    status = Column(String, default="pending", nullable=False, index=True)  # pending, uploading, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+    url = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# Bulk resume ingestion (see resume_ingest.py). Each processed archive entry gets an item
+# row, which doubles as the checkpoint a crashed job resumes from.
+class ResumeIngestJob(Base):
+    __tablename__ = "resume_ingest_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    created_by = Column(String, nullable=True)
+    source_path = Column(String, nullable=False)  # ZIP file or directory
+    owns_source = Column(Boolean, default=False, nullable=False)  # Delete the source when done
+    status = Column(String, default="queued", nullable=False, index=True)  # queued, running, done, failed
+    total = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    claimed_by = Column(String, nullable=True)  # Worker currently running the job
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)  # Renewed while it runs
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class ResumeIngestItem(Base):
+    __tablename__ = "resume_ingest_items"
+    __table_args__ = (UniqueConstraint("job_id", "entry_name", name="uq_resume_ingest_entry"),)
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("resume_ingest_jobs.id"), nullable=False, index=True)
+    entry_name = Column(String, nullable=False)
+    email = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)
+    status = Column(String, nullable=False)  # analyzed, duplicate, failed
+    error = Column(Text, nullable=True)
+
+
+# Stored responses for requests sent with an Idempotency-Key header.
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_records"
+    __table_args__ = (UniqueConstraint("scope", "key", name="uq_idempotency_scope_key"),)
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False)  # User and endpoint the key belongs to
+    key = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False)  # Hash of the request payload
+    status = Column(String, default="in_progress", nullable=False)  # in_progress, completed
+    response_body = Column(Text, nullable=True)
+    # Which request is running an in_progress record, and until when; renewed while it runs,
+    # so a record left behind by a crashed worker can be taken over once the lease runs out.
+    claimed_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class Question(Base):
     __tablename__ = "questions"
     id = Column(Integer, primary_key=True, index=True)
@@ -46,6 +143,16 @@ class Option(Base):
     question_id = Column(Integer, ForeignKey("questions.id"))
     question = relationship("Question", back_populates="options")
 
+class Course(Base):
+    __tablename__ = "courses"
+    id = Column(Integer, primary_key=True, index=True)
+    title = Column(String, nullable=False, unique=True)
+    platform = Column(String, nullable=True)
+    category = Column(String, index=True, nullable=False)
+    skill_tags = Column(String, nullable=True)  # Semicolon-separated list of skill tags
+    url = Column(String, nullable=True)
+    description = Column(Text, nullable=True)
+
 class Assessment(Base):
     __tablename__ = "assessments"
     id = Column(Integer, primary_key=True, index=True)
@@ -53,14 +160,115 @@ class Assessment(Base):
     analysis = Column(Text, nullable=True)
     course_suggestions = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     owner = relationship("User", back_populates="assessments")
     answers = relationship("Answer", back_populates="assessment")
 
+# Running per-user statistics, updated in the same transaction as each new assessment.
+class UserProgress(Base):
+    __tablename__ = "user_progress"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    attempt_count = Column(Integer, default=0, nullable=False)
+    best_score = Column(Float, nullable=True)
+    last_score = Column(Float, nullable=True)
+    mean_score = Column(Float, nullable=True)
+    # JSON: {category: {"attempts", "mean_percentage", "rolling_percentage", "last_percentage"}}
+    category_stats = Column(Text, nullable=False, default="{}")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# Cohort score distribution: fixed 1% buckets of the percentage scored, per category
+# and for the total ("__total__"). Submissions append to score_histogram_deltas, and
+# cohort_stats.compact() periodically folds those into score_histograms.
+class ScoreHistogram(Base):
+    __tablename__ = "score_histograms"
+    metric = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+class ScoreHistogramDelta(Base):
+    __tablename__ = "score_histogram_deltas"
+    id = Column(Integer, primary_key=True, index=True)
+    metric = Column(String, nullable=False)
+    bucket = Column(Integer, nullable=False)
+    count = Column(Integer, default=1, nullable=False)
+
+# Deferred AI feedback for assessments scored in bulk (see feedback_queue.py).
+class FeedbackJob(Base):
+    __tablename__ = "feedback_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    assessment_id = Column(Integer, ForeignKey("assessments.id"), nullable=False, unique=True)
+    send_email = Column(Boolean, default=True, nullable=False)
+    status = Column(String, default="pending", nullable=False, index=True)  # pending, running, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Progress of a reanalyze.py run; assessments up to last_assessment_id have been regenerated,
+# except the `failed` ones listed in reanalysis_failures.
+class ReanalysisCheckpoint(Base):
+    __tablename__ = "reanalysis_checkpoints"
+    run_name = Column(String, primary_key=True)
+    last_assessment_id = Column(Integer, default=0, nullable=False)
+    processed = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# Assessments whose report a reanalyze.py run failed to regenerate; retried when the run resumes.
+class ReanalysisFailure(Base):
+    __tablename__ = "reanalysis_failures"
+    run_name = Column(String, primary_key=True)
+    assessment_id = Column(Integer, primary_key=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Per-window request counts for the shared rate limit backend (see rate_limits.py).
+class RateLimitCounter(Base):
+    __tablename__ = "rate_limit_counters"
+    key = Column(String, primary_key=True)
+    window_start = Column(Integer, primary_key=True)  # Unix time at the start of the window
+    count = Column(Integer, default=0, nullable=False)
+
+# Users whose reads stay on the primary until pinned_until, shared by all workers (see db_routing.py).
+class ReadPin(Base):
+    __tablename__ = "read_pins"
+    pin_key = Column(String, primary_key=True)
+    pinned_until = Column(Float, nullable=False)  # Unix time
+
+# Next free send slot of a rate-limited outbound channel, shared by all workers (see leased_jobs.wait_for_rate_slot).
+class RateSlot(Base):
+    __tablename__ = "rate_slots"
+    name = Column(String, primary_key=True)
+    next_at = Column(Float, default=0.0, nullable=False)  # Unix time
+
+# Shared versions of cached datasets, bumped by cache_bus.publish() (PostgreSQL backend).
+class CacheVersion(Base):
+    __tablename__ = "cache_versions"
+    topic = Column(String, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+# The questions served for one randomized attempt (see question_bank.sample); a submission
+# that names the attempt may only answer these, and only once.
+class AssessmentAttempt(Base):
+    __tablename__ = "assessment_attempts"
+    id = Column(String, primary_key=True)  # Random hex, handed to the client
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    question_ids = Column(Text, nullable=False)  # JSON list
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    assessment_id = Column(Integer, ForeignKey("assessments.id"), nullable=True)  # Set once submitted
+    # Held by the submission being scored, so a concurrent submit of the same attempt is refused
+    # before it spends an AI call; expires in case that request dies.
+    claimed_by = Column(String, nullable=True)
+    claim_expires_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class Answer(Base):
     __tablename__ = "answers"
     id = Column(Integer, primary_key=True, index=True)
-    assessment_id = Column(Integer, ForeignKey("assessments.id"))
+    assessment_id = Column(Integer, ForeignKey("assessments.id"), index=True)
     question_id = Column(Integer, ForeignKey("questions.id"))
     selected_option_id = Column(Integer, ForeignKey("options.id"))
+    # Same as the assessment's (both default to the transaction time); the partition key on PostgreSQL.
+    # Also set in the INSERT itself, since a column added by migrations.py has no server default.
+    created_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now())
     assessment = relationship("Assessment", back_populates="answers")
@@ -0,0 +1,295 @@
+# partitioning.py
+# Monthly range partitioning of the assessments and answers tables on created_at
+# (PostgreSQL only), with a retention policy.
+# `convert` turns the existing tables into partitioned ones once; from then on a background
+# task keeps PARTITION_MONTHS_AHEAD months of empty partitions ready, and, when
+# ASSESSMENT_RETENTION_MONTHS is set, moves older partitions out of the live tables into
+# ARCHIVE_SCHEMA, from where they can be dumped (pg_dump --schema) and dropped. Queries
+# bounded by created_at (exports, history, the answers of one assessment) only visit the
+# partitions in range, and vacuum works on one month at a time.
+#
+# Partitioned tables cannot be the target of a foreign key on id alone (their unique key has
+# to include created_at), so convert drops the foreign keys that point at assessments.
+#
+# Run it directly: python partitioning.py convert | maintain | status
+
+import argparse
+import asyncio
+import os
+import re
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+# --- Configuration ---
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# Partitions whose month ended more than this many months ago are archived; 0 keeps everything live.
+ASSESSMENT_RETENTION_MONTHS = int(os.getenv("ASSESSMENT_RETENTION_MONTHS", "0"))
+ARCHIVE_SCHEMA = os.getenv("ASSESSMENT_ARCHIVE_SCHEMA", "archive")
+MAINTENANCE_INTERVAL_SECONDS = 6 * 60 * 60
+# Session advisory lock, so only one worker runs maintenance at a time.
+MAINTENANCE_LOCK_KEY = 460046
+
+PARTITIONED_TABLES = ("assessments", "answers")
+# (table, constraint) foreign keys to assessments.id, as created by models.Base.metadata.create_all().
+ASSESSMENT_FOREIGN_KEYS = [
+    ("answers", "answers_assessment_id_fkey"),
+    ("feedback_jobs", "feedback_jobs_assessment_id_fkey"),
+    ("assessment_attempts", "assessment_attempts_assessment_id_fkey"),
+]
+# (table, column, referenced table) foreign keys from the partitioned tables, recreated after conversion.
+PARTITION_FOREIGN_KEYS = [
+    ("assessments", "owner_id", "users"),
+    ("answers", "question_id", "questions"),
+    ("answers", "selected_option_id", "options"),
+]
+# (index, table, columns) recreated on the partitioned tables; each partition gets its own copy.
+PARTITION_INDEXES = [
+    ("ix_assessments_id", "assessments", "id"),
+    ("ix_assessments_owner_id", "assessments", "owner_id"),
+    ("ix_answers_id", "answers", "id"),
+    ("ix_answers_assessment_id", "answers", "assessment_id"),
+]
+
+_PARTITION_NAME = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+def is_supported(engine: Engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    return bool(conn.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+        {"table": table}
+    ).scalar())
+
+
+def list_partitions(conn: Connection, table: str) -> List[Tuple[str, Optional[date]]]:
+    """Returns (partition name, month) pairs in month order; the default partition has no month."""
+    names = conn.execute(text("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(:table)
+    """), {"table": table}).scalars().all()
+    partitions = []
+    for name in names:
+        match = _PARTITION_NAME.search(name)
+        partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1) if match else None))
+    return sorted(partitions, key=lambda p: p[1] or date.max)
+
+
+def create_partition(conn: Connection, table: str, month: date):
+    start, end = month, add_months(month, 1)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')"
+    ))
+
+
+def _create_partition_from_default(conn: Connection, table: str, month: date, default: Optional[str]):
+    """
+    Creates a month's partition, first moving that month's rows out of the default partition
+    (PostgreSQL refuses to create the partition while the default holds any of them).
+    Inserts into the default partition are blocked until the transaction commits.
+    """
+    if default is None:
+        create_partition(conn, table, month)
+        return
+    start, end = month, add_months(month, 1)
+    bounds = {"start": f"{start.isoformat()} 00:00:00+00", "end": f"{end.isoformat()} 00:00:00+00"}
+    conn.execute(text(f"LOCK TABLE {default} IN SHARE ROW EXCLUSIVE MODE"))
+    conn.execute(text(f"CREATE TEMPORARY TABLE {table}_moved (LIKE {table}) ON COMMIT DROP"))
+    moved = conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE created_at >= :start AND created_at < :end RETURNING *) "
+        f"INSERT INTO {table}_moved SELECT * FROM moved"
+    ), bounds).rowcount
+    create_partition(conn, table, month)
+    if moved:
+        conn.execute(text(f"INSERT INTO {table} SELECT * FROM {table}_moved"))
+        print(f"--- PARTITIONING: Moved {moved} rows from {default} to {partition_name(table, month)} ---")
+
+
+def ensure_partitions(engine: Engine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> int:
+    """
+    Creates any missing partitions from this month to `months_ahead` months ahead, each in its
+    own transaction. Returns how many were created.
+    """
+    this_month = month_start(datetime.utcnow().date())
+    created = 0
+    for table in PARTITIONED_TABLES:
+        with engine.connect() as conn:
+            if not is_partitioned(conn, table):
+                continue
+            partitions = list_partitions(conn, table)
+        existing = {month for _, month in partitions}
+        default = next((name for name, month in partitions if month is None), None)
+        for offset in range(months_ahead + 1):
+            month = add_months(this_month, offset)
+            if month not in existing:
+                with engine.begin() as conn:
+                    _create_partition_from_default(conn, table, month, default)
+                created += 1
+                print(f"--- PARTITIONING: Created partition {partition_name(table, month)} ---")
+    return created
+
+
+def archive_partitions(engine: Engine, retention_months: int = ASSESSMENT_RETENTION_MONTHS) -> List[str]:
+    """
+    Moves partitions whose month ended more than `retention_months` ago into ARCHIVE_SCHEMA.
+    Detaching and moving only change the catalog, so the live table is locked briefly and no
+    rows are rewritten. Returns the archived names.
+    """
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(datetime.utcnow().date()), -retention_months)
+    archived = []
+    for table in PARTITIONED_TABLES:
+        with engine.connect() as conn:
+            if not is_partitioned(conn, table):
+                continue
+            old = [name for name, month in list_partitions(conn, table) if month is not None and add_months(month, 1) <= cutoff]
+        for name in old:
+            with engine.begin() as conn:
+                conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+            archived.append(name)
+            print(f"--- PARTITIONING: Archived {name} to {ARCHIVE_SCHEMA}.{name} ---")
+    return archived
+
+
+def maintain(engine: Engine) -> dict:
+    """Creates upcoming partitions and applies the retention policy, unless another worker is already doing so."""
+    if not is_supported(engine):
+        return {"created": 0, "archived": []}
+    with engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}).scalar():
+            return {"created": 0, "archived": []}
+        try:
+            return {"created": ensure_partitions(engine), "archived": archive_partitions(engine)}
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+            lock_conn.commit()
+
+
+async def run_maintenance_loop(engine: Engine):
+    """Background task: runs maintain() at startup and every MAINTENANCE_INTERVAL_SECONDS."""
+    if not is_supported(engine):
+        return
+    while True:
+        try:
+            await asyncio.to_thread(maintain, engine)
+        except Exception as e:
+            print(f"--- PARTITIONING ERROR: Maintenance failed: {e} ---")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+
+def _convert_table(conn: Connection, table: str, first_month: date, last_month: date):
+    old = f"{table}_unpartitioned"
+    conn.execute(text(f"UPDATE {table} SET created_at = now() WHERE created_at IS NULL"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    conn.execute(text(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"))
+    month = first_month
+    while month <= last_month:
+        create_partition(conn, table, month)
+        month = add_months(month, 1)
+    # Catches rows outside every monthly range, so an insert never fails for want of a partition.
+    conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+
+    # The id sequence belongs to the old table and would be dropped with it.
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": old}).scalar()
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+    conn.execute(text(f"DROP TABLE {old}"))
+    conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)"))
+    for index, index_table, columns in PARTITION_INDEXES:
+        if index_table == table:
+            conn.execute(text(f"CREATE INDEX {index} ON {table} ({columns})"))
+    for fk_table, column, referenced in PARTITION_FOREIGN_KEYS:
+        if fk_table == table:
+            conn.execute(text(f"ALTER TABLE {table} ADD FOREIGN KEY ({column}) REFERENCES {referenced} (id)"))
+
+
+def convert(engine: Engine, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """
+    Rebuilds assessments and answers as monthly partitioned tables in one transaction.
+    Both tables are locked while their rows are copied, so run this in a quiet period.
+    """
+    if not is_supported(engine):
+        raise RuntimeError("Partitioning requires PostgreSQL.")
+    with engine.begin() as conn:
+        if all(is_partitioned(conn, table) for table in PARTITIONED_TABLES):
+            print("--- PARTITIONING: Tables are already partitioned ---")
+            return
+        conn.execute(text("LOCK TABLE assessments, answers IN ACCESS EXCLUSIVE MODE"))
+        for table, constraint in ASSESSMENT_FOREIGN_KEYS:
+            conn.execute(text(f"ALTER TABLE IF EXISTS {table} DROP CONSTRAINT IF EXISTS {constraint}"))
+
+        oldest = conn.execute(text(
+            "SELECT LEAST((SELECT min(created_at) FROM assessments), (SELECT min(created_at) FROM answers))"
+        )).scalar()
+        this_month = month_start(datetime.utcnow().date())
+        first_month = month_start(oldest.date()) if oldest else this_month
+        last_month = add_months(this_month, months_ahead)
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(conn, table):
+                print(f"--- PARTITIONING: Converting {table} ({first_month:%Y-%m} to {last_month:%Y-%m}) ---")
+                _convert_table(conn, table, first_month, last_month)
+
+
+def status(engine: Engine):
+    with engine.connect() as conn:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(conn, table):
+                print(f"{table}: not partitioned")
+                continue
+            print(f"{table}:")
+            for name, _ in list_partitions(conn, table):
+                rows = conn.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name}).scalar()
+                print(f"  {name}: ~{max(rows or 0, 0):,} rows")
+        archived = conn.execute(text(
+            "SELECT tablename FROM pg_tables WHERE schemaname = :schema ORDER BY tablename"
+        ), {"schema": ARCHIVE_SCHEMA}).scalars().all()
+        print(f"Archived in {ARCHIVE_SCHEMA}: {', '.join(archived) or 'none'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monthly partitioning and retention for assessments and answers.")
+    parser.add_argument("command", choices=["convert", "maintain", "status"])
+    args = parser.parse_args()
+
+    from database import engine
+    if not is_supported(engine):
+        print("Partitioning requires PostgreSQL; nothing to do.")
+        return
+    if args.command == "convert":
+        import migrations
+        import models
+        models.Base.metadata.create_all(bind=engine)
+        migrations.upgrade(engine)
+        convert(engine)
+        print(maintain(engine))
+    elif args.command == "maintain":
+        print(maintain(engine))
+    status(engine)
+
+
+if __name__ == "__main__":
+    main()
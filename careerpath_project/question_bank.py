@@ -0,0 +1,83 @@
+# question_bank.py
+# In-process cache of the question bank served by /assessment/questions.
+# Questions change only when load_database adds them, which publishes on the cache bus,
+# so every worker keeps its copy until the published version moves past the one it loaded.
+# The cache is also indexed by category, so an assessment blueprint ("N random questions
+# per category") is sampled in O(N) without ORDER BY random() scans over the bank.
+# It is always loaded from the primary: a lagging replica could otherwise pin a stale
+# bank under the new version until the next publish.
+
+import os
+import random
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import selectinload
+
+import cache_bus
+import models
+import schemas
+from database import SessionLocal
+
+CACHE_TOPIC = "questions"
+
+# --- Assessment blueprint ---
+QUESTIONS_PER_CATEGORY = int(os.getenv("ASSESSMENT_QUESTIONS_PER_CATEGORY", "10"))
+MAX_QUESTIONS_PER_CATEGORY = int(os.getenv("ASSESSMENT_MAX_QUESTIONS_PER_CATEGORY", "50"))
+ATTEMPT_EXPIRE_HOURS = int(os.getenv("ASSESSMENT_ATTEMPT_EXPIRE_HOURS", "12"))
+# How long a submission holds its attempt while it is scored (covers the AI call).
+ATTEMPT_CLAIM_SECONDS = 5 * 60
+# Accept /assessment/submit without an attempt_id, i.e. answers to any questions (old clients only).
+ALLOW_SUBMIT_WITHOUT_ATTEMPT = os.getenv("ALLOW_SUBMIT_WITHOUT_ATTEMPT", "false").lower() == "true"
+
+_lock = threading.Lock()
+_questions: Optional[List[schemas.Question]] = None
+_questions_version = 0
+_by_category: Dict[str, List[schemas.Question]] = {}
+
+
+def _load() -> List[schemas.Question]:
+    global _questions, _questions_version, _by_category
+    loaded_version = cache_bus.version(CACHE_TOPIC)
+    db = SessionLocal()
+    try:
+        rows = db.query(models.Question).options(selectinload(models.Question.options)).order_by(models.Question.id).all()
+        questions = [schemas.Question.model_validate(q) for q in rows]
+    finally:
+        db.close()
+    by_category: Dict[str, List[schemas.Question]] = {}
+    for question in questions:
+        by_category.setdefault(question.category or "", []).append(question)
+    _questions, _questions_version, _by_category = questions, loaded_version, by_category
+    return questions
+
+
+def all_questions() -> List[schemas.Question]:
+    """Every question with its options, in id order."""
+    questions = _questions
+    if questions is not None and _questions_version == cache_bus.version(CACHE_TOPIC):
+        return questions
+    with _lock:
+        if _questions is not None and _questions_version == cache_bus.version(CACHE_TOPIC):
+            return _questions
+        return _load()
+
+
+def get_questions(skip: int = 0, limit: int = 100) -> List[schemas.Question]:
+    """Same result as crud.get_questions, served from the cache."""
+    return all_questions()[skip:skip + limit]
+
+
+def sample(per_category: int, rng: Optional[random.Random] = None) -> List[schemas.Question]:
+    """
+    Picks `per_category` random questions from every category (all of them where a category
+    has fewer), grouped by category in a random order within each group.
+    """
+    all_questions()
+    index = _by_category
+    rng = rng or random.SystemRandom()
+    picked = []
+    for category in sorted(index):
+        questions = index[category]
+        picked.extend(rng.sample(questions, min(per_category, len(questions))))
+    return picked
@@ -0,0 +1,107 @@
+# rate_limits.py
+# Request rate limits for unauthenticated endpoints, checked before any hashing, database
+# write or email send, so a flood is turned away for the price of a dictionary lookup.
+# A limit of N requests per window W is enforced per key (e.g. per client IP and per email):
+#   memory   - a token bucket per key (capacity N, refilled at N/W per second) in this process.
+#   database - a sliding-window counter in rate_limit_counters, shared by every worker:
+#              the previous window's count, weighted by how much of it still overlaps the
+#              sliding window, plus the current window's count.
+
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, Tuple
+
+import crud
+from database import SessionLocal
+
+
+def _parse_limit(value: str) -> Tuple[int, float]:
+    """Parses "N/seconds", e.g. "5/900" for five requests per 15 minutes."""
+    count, _, seconds = value.partition("/")
+    return int(count), float(seconds)
+
+
+# --- Configuration ---
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()  # memory or database
+MAGIC_LINK_PER_EMAIL = _parse_limit(os.getenv("RATE_LIMIT_MAGIC_LINK_PER_EMAIL", "5/900"))
+# Generous, because a whole class can share one school IP address.
+MAGIC_LINK_PER_IP = _parse_limit(os.getenv("RATE_LIMIT_MAGIC_LINK_PER_IP", "120/900"))
+# The memory backend forgets idle keys once it tracks this many.
+MAX_TRACKED_KEYS = 100_000
+# One in this many database checks also deletes counters of finished windows.
+CLEANUP_SAMPLE_RATE = 100
+
+
+class MemoryBackend:
+    """Token buckets in this process."""
+
+    def __init__(self, max_keys: int = MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated_at)
+
+    def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        rate = limit / window
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (float(limit), now))
+            tokens = min(float(limit), tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            if key not in self._buckets and len(self._buckets) >= self.max_keys:
+                self._prune(now, window)
+            self._buckets[key] = (tokens, now)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def _prune(self, now: float, window: float):
+        """Drops buckets that have been idle long enough to be full again."""
+        for key in [k for k, (_, updated_at) in self._buckets.items() if now - updated_at >= window]:
+            del self._buckets[key]
+
+
+class DatabaseBackend:
+    """Sliding-window counters in the database, shared by all workers."""
+
+    def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        window = int(window)
+        now = time.time()
+        window_start = int(now // window * window)
+        elapsed = now - window_start
+        db = SessionLocal()
+        try:
+            if random.randrange(CLEANUP_SAMPLE_RATE) == 0:
+                crud.delete_old_rate_limit_counters(db, before=window_start - window)
+            current = crud.increment_rate_limit_counter(db, key, window_start)
+            previous = crud.get_rate_limit_count(db, key, window_start - window)
+        finally:
+            db.close()
+
+        overlap = (window - elapsed) / window
+        if previous * overlap + current <= limit:
+            return True, 0.0
+        if current > limit or previous == 0:
+            return False, window - elapsed
+        # Wait until enough of the previous window has slid out.
+        return False, max(window - elapsed - (limit - current) * window / previous, 1.0)
+
+
+def _create_backend(name: str):
+    if name == "database":
+        return DatabaseBackend()
+    return MemoryBackend()
+
+
+backend = _create_backend(RATE_LIMIT_BACKEND)
+
+
+def check(scope: str, key: str, limit: Tuple[int, float]) -> int:
+    """
+    Counts a request for `key` against `limit` (count, window seconds). Returns 0 if it is
+    allowed, otherwise the number of seconds to wait before retrying.
+    """
+    allowed, retry_after = backend.hit(f"{scope}:{key}", *limit)
+    return 0 if allowed else max(1, math.ceil(retry_after))
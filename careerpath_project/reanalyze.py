@@ -0,0 +1,313 @@
+# reanalyze.py
+# Regenerates the AI performance report of stored assessments, e.g. after the prompt in
+# ai_analysis.build_assessment_prompt or the model changed. Assessments are streamed in id
+# order with a server-side cursor, their categories_summary is rebuilt from the stored
+# answers, and reports are requested with bounded concurrency and a request rate limit.
+# Each page of results is written back together with a checkpoint and the ids of the
+# assessments that failed, so an interrupted run picks up after the last written page when
+# started again with the same --run-name, and first retries the failures of earlier pages.
+#
+# Run it directly: python reanalyze.py --run-name prompt-v2 [--since 2025-01-01] [--dry-run]
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+import ai_analysis
+import cohort_stats
+import crud
+import models
+from database import SessionLocal
+
+# --- Defaults ---
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_CONCURRENCY = ai_analysis.LLM_MAX_CONCURRENCY
+DEFAULT_REQUESTS_PER_MINUTE = 60
+# Token estimate for dry runs: ~4 characters per token for English prompts, and a
+# typical report length. Prices are USD per million tokens for gemini-1.5-flash.
+CHARS_PER_TOKEN = 4
+DEFAULT_OUTPUT_TOKENS = 700
+DEFAULT_INPUT_PRICE = 0.075
+DEFAULT_OUTPUT_PRICE = 0.30
+
+
+ASSESSMENT_COLUMNS = (models.Assessment.id, models.Assessment.course_suggestions, models.Assessment.created_at)
+
+
+class AssessmentStream:
+    """
+    Streams (id, course_suggestions, created_at) rows after a given id. On PostgreSQL this is one
+    server-side cursor, whose connection is only ever used from one dedicated thread.
+    SQLite has no server-side cursors and an open read would block the batch writes,
+    so there each page is a separate keyset query (id > last id seen).
+    """
+
+    def __init__(self, after_id: int, since: Optional[datetime], limit: Optional[int], page_size: int):
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.last_id, self.since, self.remaining, self.page_size = after_id, since, limit, page_size
+        self._db = None
+        self._pages = None
+
+    def _query(self, after_id: int, limit: Optional[int]):
+        query = select(*ASSESSMENT_COLUMNS).where(models.Assessment.id > after_id).order_by(models.Assessment.id)
+        if self.since is not None:
+            query = query.where(models.Assessment.created_at >= self.since)
+        if limit:
+            query = query.limit(limit)
+        return query
+
+    def _next(self):
+        if self._db is None:
+            self._db = SessionLocal()
+            if self._db.get_bind().dialect.name == "postgresql":
+                query = self._query(self.last_id, self.remaining).execution_options(yield_per=self.page_size)
+                self._pages = self._db.execute(query).partitions()
+        if self._pages is not None:
+            return next(self._pages, None)
+
+        if self.remaining is not None and self.remaining <= 0:
+            return None
+        page_limit = min(self.page_size, self.remaining) if self.remaining is not None else self.page_size
+        rows = self._db.execute(self._query(self.last_id, page_limit)).all()
+        self._db.rollback()  # End the read transaction before the page is written back
+        if rows:
+            self.last_id = rows[-1].id
+            if self.remaining is not None:
+                self.remaining -= len(rows)
+        return rows or None
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+
+    async def next_page(self):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._next)
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown()
+
+
+class RateLimiter:
+    """Spaces out calls so no more than `per_minute` start in any minute."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._lock = asyncio.Lock()
+        self._next_call_at = 0.0
+
+    async def wait(self):
+        async with self._lock:
+            delay = self._next_call_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_call_at = max(self._next_call_at, time.monotonic()) + self.interval
+
+
+def _stored_courses(course_suggestions: Optional[str]) -> List[dict]:
+    """Reads stored course suggestions, tolerating the older AI-generated format."""
+    try:
+        courses = json.loads(course_suggestions or "[]")
+    except ValueError:
+        return []
+    return [
+        {"title": c["title"], "platform": c.get("platform") or ""}
+        for c in courses if isinstance(c, dict) and c.get("title")
+    ] if isinstance(courses, list) else []
+
+
+def _build_contexts(rows: list, lookups: tuple) -> List[dict]:
+    """
+    Rebuilds the prompt inputs for one page of assessments with one answers query. As in
+    crud.get_answer_pairs, the answers are also bounded by the assessments' created_at on
+    PostgreSQL, so a partitioned answers table only scans the months the page covers.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(
+            models.Answer.assessment_id, models.Answer.question_id, models.Answer.selected_option_id
+        ).filter(models.Answer.assessment_id.in_([row.id for row in rows]))
+        created = [row.created_at for row in rows if row.created_at is not None]
+        if created and len(created) == len(rows) and db.get_bind().dialect.name == "postgresql":
+            query = query.filter(models.Answer.created_at.between(min(created), max(created)))
+
+        pairs_by_assessment: Dict[int, list] = {}
+        for assessment_id, question_id, option_id in query:
+            pairs_by_assessment.setdefault(assessment_id, []).append((question_id, option_id))
+
+        contexts = []
+        for row in rows:
+            pairs = pairs_by_assessment.get(row.id)
+            if not pairs:
+                continue
+            _, categories_summary, incorrect_answers = crud.summarize_answers(db, pairs, lookups=lookups)
+            contexts.append({
+                "id": row.id,
+                "categories_summary": categories_summary,
+                "incorrect_answers": incorrect_answers,
+                "recommended_courses": _stored_courses(row.course_suggestions),
+                "percentiles": cohort_stats.percentiles(categories_summary) if cohort_stats.PERCENTILES_IN_PROMPT else None,
+            })
+        return contexts
+    finally:
+        db.close()
+
+
+def _load_lookups() -> tuple:
+    db = SessionLocal()
+    try:
+        return crud.load_answer_lookups(db)
+    finally:
+        db.close()
+
+
+def _load_checkpoint(run_name: str) -> int:
+    db = SessionLocal()
+    try:
+        checkpoint = crud.get_reanalysis_checkpoint(db, run_name)
+        return checkpoint.last_assessment_id if checkpoint else 0
+    finally:
+        db.close()
+
+
+def _load_failures(run_name: str, page_size: int) -> List[list]:
+    """Returns the assessments an earlier attempt of the run failed on, in pages."""
+    db = SessionLocal()
+    try:
+        ids = crud.get_reanalysis_failures(db, run_name)
+        return [
+            db.execute(select(*ASSESSMENT_COLUMNS).where(
+                models.Assessment.id.in_(ids[i:i + page_size])
+            ).order_by(models.Assessment.id)).all()
+            for i in range(0, len(ids), page_size)
+        ]
+    finally:
+        db.close()
+
+
+def _save(run_name: str, analyses: dict, failures: dict, last_assessment_id: Optional[int]):
+    db = SessionLocal()
+    try:
+        crud.save_reanalysis_results(db, run_name, analyses, failures, last_assessment_id)
+    finally:
+        db.close()
+
+
+def _prompt(context: dict) -> str:
+    return ai_analysis.build_assessment_prompt(
+        context["categories_summary"], context["incorrect_answers"], context["recommended_courses"], context["percentiles"]
+    )
+
+
+async def _regenerate(context: dict, slots: asyncio.Semaphore, limiter: RateLimiter) -> Tuple[Optional[str], Optional[str]]:
+    """Returns (report, None), or (None, error) if the report could not be generated."""
+    async with slots:
+        await limiter.wait()
+        try:
+            report = await ai_analysis.request_assessment_report(
+                context["categories_summary"], context["incorrect_answers"], context["recommended_courses"], context["percentiles"]
+            )
+            return ai_analysis.sanitize_report(report), None
+        except Exception as e:
+            print(f"--- REANALYZE ERROR: Assessment {context['id']} failed: {e} ---")
+            return None, str(e)
+
+
+async def reanalyze(run_name: str, since: Optional[datetime] = None, limit: Optional[int] = None,
+                    page_size: int = DEFAULT_PAGE_SIZE, concurrency: int = DEFAULT_CONCURRENCY,
+                    requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE, dry_run: bool = False,
+                    output_tokens: int = DEFAULT_OUTPUT_TOKENS) -> dict:
+    """Regenerates reports page by page. In a dry run nothing is sent or written; prompts are only measured."""
+    after_id = 0 if dry_run else await asyncio.to_thread(_load_checkpoint, run_name)
+    if after_id:
+        print(f"--- REANALYZE: Resuming run '{run_name}' after assessment {after_id} ---")
+    lookups = await asyncio.to_thread(_load_lookups)
+    stream = AssessmentStream(after_id, since, limit, page_size)
+    slots, limiter = asyncio.Semaphore(concurrency), RateLimiter(requests_per_minute)
+
+    totals = {"assessments": 0, "regenerated": 0, "failed": 0, "skipped": 0, "prompt_chars": 0}
+
+    async def run_page(rows: list, last_assessment_id: Optional[int]):
+        contexts = await asyncio.to_thread(_build_contexts, rows, lookups)
+        totals["assessments"] += len(rows)
+        totals["skipped"] += len(rows) - len(contexts)
+
+        if dry_run:
+            totals["prompt_chars"] += sum(len(_prompt(c)) for c in contexts)
+            return
+
+        results = await asyncio.gather(*[_regenerate(c, slots, limiter) for c in contexts])
+        analyses = {c["id"]: report for c, (report, _) in zip(contexts, results) if report is not None}
+        failures = {c["id"]: error for c, (report, error) in zip(contexts, results) if report is None}
+        await asyncio.to_thread(_save, run_name, analyses, failures, last_assessment_id)
+        totals["regenerated"] += len(analyses)
+        totals["failed"] += len(failures)
+        print(f"--- REANALYZE: {totals['regenerated']} regenerated, {totals['failed']} failed, up to assessment {rows[-1].id} ---")
+
+    try:
+        if not dry_run:
+            retries = await asyncio.to_thread(_load_failures, run_name, page_size)
+            if retries:
+                print(f"--- REANALYZE: Retrying {sum(len(rows) for rows in retries)} assessment(s) that failed earlier ---")
+            for rows in retries:
+                await run_page(rows, None)
+        while True:
+            rows = await stream.next_page()
+            if not rows:
+                break
+            await run_page(rows, rows[-1].id)
+    finally:
+        await stream.close()
+
+    if dry_run:
+        prompts = totals["assessments"] - totals["skipped"]
+        totals["input_tokens"] = math.ceil(totals["prompt_chars"] / CHARS_PER_TOKEN)
+        totals["output_tokens"] = prompts * output_tokens
+        totals["minutes_at_rate_limit"] = round(prompts / requests_per_minute, 1) if requests_per_minute > 0 else 0
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate the AI reports of stored assessments.")
+    parser.add_argument("--run-name", default="default", help="Checkpoint name; rerun with the same name to resume")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Only assessments created on or after this date")
+    parser.add_argument("--limit", type=int, help="Process at most this many assessments")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="Assessments fetched and written per batch")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--requests-per-minute", type=float, default=DEFAULT_REQUESTS_PER_MINUTE)
+    parser.add_argument("--dry-run", action="store_true", help="Only estimate tokens and cost")
+    parser.add_argument("--output-tokens", type=int, default=DEFAULT_OUTPUT_TOKENS, help="Assumed tokens per report (dry run)")
+    parser.add_argument("--input-price", type=float, default=DEFAULT_INPUT_PRICE, help="USD per million input tokens (dry run)")
+    parser.add_argument("--output-price", type=float, default=DEFAULT_OUTPUT_PRICE, help="USD per million output tokens (dry run)")
+    args = parser.parse_args()
+
+    import migrations
+    from database import engine
+    models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
+
+    totals = asyncio.run(reanalyze(
+        args.run_name, since=args.since, limit=args.limit, page_size=args.page_size,
+        concurrency=args.concurrency, requests_per_minute=args.requests_per_minute,
+        dry_run=args.dry_run, output_tokens=args.output_tokens
+    ))
+
+    if args.dry_run:
+        cost = totals["input_tokens"] / 1e6 * args.input_price + totals["output_tokens"] / 1e6 * args.output_price
+        print(f"Assessments: {totals['assessments']} ({totals['skipped']} without answers would be skipped)")
+        print(f"Estimated input tokens:  {totals['input_tokens']:,}")
+        print(f"Estimated output tokens: {totals['output_tokens']:,}")
+        print(f"Estimated cost: ${cost:.2f}, about {totals['minutes_at_rate_limit']} minutes at {args.requests_per_minute:g} requests/minute")
+        return
+    print(f"Regenerated {totals['regenerated']} reports, {totals['failed']} failed, {totals['skipped']} skipped without answers.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# resume_files.py
+# Size limits, type sniffing and text extraction for uploaded resume files.
+# Uploads are never read fully into memory: Starlette already streams multipart file
+# parts into a SpooledTemporaryFile in chunks, UploadSizeLimitMiddleware stops the
+# stream once it exceeds the limit, and the parser and uploader read the same file object.
+
+import os
+import zipfile
+from typing import BinaryIO, Iterable, Optional
+
+from starlette.responses import JSONResponse
+
+# --- Configuration ---
+MAX_RESUME_BYTES = int(os.getenv("MAX_RESUME_BYTES", str(5 * 1024 * 1024)))  # 5 MB
+# Allowance for multipart boundaries and headers on top of the file itself.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+PDF_MAGIC = b"%PDF-"
+ZIP_MAGIC = b"PK\x03\x04"
+
+MIMETYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+class UnsupportedResumeFile(ValueError):
+    """Raised when an upload is not a readable PDF or DOCX file."""
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Pure ASGI middleware that rejects request bodies above max_body_size on the given paths.
+    Requests with a large Content-Length are refused before any body is read, and chunked
+    or mislabelled bodies are cut off as soon as the running total crosses the limit.
+    """
+
+    def __init__(self, app, max_body_size: int, paths: Iterable[str]):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        too_large = JSONResponse(
+            status_code=413,
+            content={"detail": f"File too large. The maximum upload size is {self.max_body_size // (1024 * 1024)} MB."},
+        )
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def limited_send(message):
+            nonlocal response_started
+            if exceeded:
+                # The app turned the aborted body into its own error response; send a 413 instead.
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await too_large(scope, receive, send)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except _BodyTooLarge:
+            if not response_started:
+                await too_large(scope, receive, send)
+
+
+def file_size(stream: BinaryIO) -> int:
+    """Returns the size of a seekable stream and rewinds it to the start."""
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def sniff_file_type(stream: BinaryIO) -> Optional[str]:
+    """
+    Detects 'pdf' or 'docx' from the file's magic bytes instead of its name.
+    For ZIP containers, only the central directory is read to confirm it is a Word document.
+    """
+    stream.seek(0)
+    header = stream.read(len(PDF_MAGIC))
+    stream.seek(0)
+    if header.startswith(PDF_MAGIC):
+        return "pdf"
+    if header.startswith(ZIP_MAGIC):
+        try:
+            with zipfile.ZipFile(stream) as archive:
+                is_docx = "word/document.xml" in archive.namelist()
+        except zipfile.BadZipFile:
+            is_docx = False
+        stream.seek(0)
+        return "docx" if is_docx else None
+    return None
+
+
+def extract_text(stream: BinaryIO, file_type: str) -> str:
+    """Extracts plain text from a PDF or DOCX stream. Raises UnsupportedResumeFile on parse errors."""
+    stream.seek(0)
+    text = ""
+    if file_type == "pdf":
+        try:
+            import PyPDF2
+            pdf_reader = PyPDF2.PdfReader(stream)
+            for page in pdf_reader.pages:
+                text += page.extract_text() or ""
+        except Exception as e:
+            raise UnsupportedResumeFile(f"Could not read PDF file: {e}")
+    elif file_type == "docx":
+        try:
+            import docx
+            doc = docx.Document(stream)
+            for para in doc.paragraphs:
+                text += para.text + "\n"
+        except Exception as e:
+            raise UnsupportedResumeFile(f"Could not read DOCX file: {e}")
+    else:
+        raise UnsupportedResumeFile("Unsupported file type. Please upload a .pdf or .docx file.")
+    stream.seek(0)
+    return text
+
+
+def parse_resume_bytes(data: bytes) -> dict:
+    """
+    Sniffs, extracts and analyses one resume held in memory. Runs in a worker process
+    during bulk ingestion, so it only takes and returns plain picklable values:
+    {"file_type", "text", "insights", "error"}.
+    """
+    import io
+    import skills_engine
+
+    stream = io.BytesIO(data)
+    file_type = sniff_file_type(stream)
+    if file_type is None:
+        return {"file_type": None, "text": None, "insights": None, "error": "Unsupported file type."}
+    try:
+        text = extract_text(stream, file_type)
+    except UnsupportedResumeFile as e:
+        return {"file_type": file_type, "text": None, "insights": None, "error": str(e)}
+    if not text.strip():
+        return {"file_type": file_type, "text": None, "insights": None, "error": "Could not extract any text from the file."}
+    return {"file_type": file_type, "text": text, "insights": skills_engine.analyze_resume(text), "error": None}
@@ -0,0 +1,433 @@
+# resume_ingest.py
+# Bulk resume ingestion for placement cells: a ZIP archive (or, from the CLI, a directory)
+# of resumes is processed entry by entry without extracting it to disk. Text extraction
+# and skill matching run in a process pool, files with identical content are only
+# analysed once, and AI analysis goes through the shared LLM concurrency cap in
+# ai_analysis; a duplicate that belongs to another student gets a copy of the results.
+# Every finished entry is checkpointed, so a job interrupted by a crash or restart
+# continues where it stopped. A worker claims a job with a lease that it renews while
+# the job runs, so each job runs in one worker at a time and another worker only picks
+# it up once the lease has expired.
+#
+# Each file must be named after the student's email (e.g. asha@college.edu.pdf), or the
+# archive must contain a manifest.csv with 'filename' and 'email' columns.
+#
+# Run it directly: python resume_ingest.py resumes.zip | resumes_dir/ [--resume JOB_ID]
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+import shutil
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, List, Optional
+
+import ai_analysis
+import archive_uploader
+import crud
+import invitations
+import resume_files
+from database import SessionLocal
+
+# --- Configuration ---
+INGEST_DIR = os.getenv("RESUME_INGEST_DIR", os.path.join("uploaded_resumes", "ingest"))
+MAX_INGEST_BYTES = int(os.getenv("MAX_INGEST_BYTES", str(200 * 1024 * 1024)))
+EXTRACT_WORKERS = int(os.getenv("RESUME_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Entries read but not yet finished; bounds memory to this many resumes.
+MAX_ENTRIES_IN_FLIGHT = EXTRACT_WORKERS * 4
+MANIFEST_NAME = "manifest.csv"
+CLAIM_LEASE_SECONDS = 5 * 60
+LEASE_RENEW_SECONDS = CLAIM_LEASE_SECONDS / 5
+POLL_INTERVAL_SECONDS = 60
+RESUME_EXTENSIONS = (".pdf", ".docx")
+
+
+class ResumeSource:
+    """Lists and reads resume entries from a ZIP archive or a directory, one entry at a time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._zip = None if os.path.isdir(path) else zipfile.ZipFile(path)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+    def _all_names(self) -> List[str]:
+        if self._zip is not None:
+            return [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        names = []
+        for root, _, files in os.walk(self.path):
+            for filename in files:
+                names.append(os.path.relpath(os.path.join(root, filename), self.path).replace(os.sep, "/"))
+        return names
+
+    def entry_names(self) -> List[str]:
+        """Resume entries in a stable order, skipping OS metadata and hidden files."""
+        return sorted(
+            name for name in self._all_names()
+            if not name.startswith("__MACOSX/")
+            and not os.path.basename(name).startswith(".")
+            and name.lower().endswith(RESUME_EXTENSIONS)
+        )
+
+    def _open(self, name: str) -> BinaryIO:
+        if self._zip is not None:
+            return self._zip.open(name)
+        return open(os.path.join(self.path, name), "rb")
+
+    def read(self, name: str, limit: int) -> bytes:
+        """Reads one entry, refusing entries that are (or decompress to) more than `limit` bytes."""
+        if self._zip is not None and self._zip.getinfo(name).file_size > limit:
+            raise ValueError("File too large.")
+        with self._open(name) as stream:
+            data = stream.read(limit + 1)
+        if len(data) > limit:
+            raise ValueError("File too large.")
+        return data
+
+    def read_manifest(self) -> Dict[str, str]:
+        """Returns {filename: email} from manifest.csv at the top level, if there is one."""
+        if MANIFEST_NAME not in self._all_names():
+            return {}
+        with self._open(MANIFEST_NAME) as stream:
+            text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+            return {
+                (row.get("filename") or "").strip(): (row.get("email") or "").strip()
+                for row in csv.DictReader(text)
+            }
+
+
+def email_for_entry(name: str, manifest: Dict[str, str]) -> Optional[str]:
+    """Finds the student's email for an entry from the manifest, or else from the file name."""
+    candidate = manifest.get(name) or manifest.get(os.path.basename(name))
+    if candidate is None:
+        candidate = os.path.splitext(os.path.basename(name))[0]
+    valid, _ = invitations.normalize_emails([candidate])
+    return valid[0] if valid else None
+
+
+# --- Database helpers (run in threads) ---
+
+def _claim_job(job_id: int, claimed_by: str):
+    db = SessionLocal()
+    try:
+        job = crud.claim_resume_ingest_job(db, job_id, claimed_by, CLAIM_LEASE_SECONDS)
+        return (job.source_path, job.owns_source) if job is not None else None
+    finally:
+        db.close()
+
+
+def _renew(job_id: int, claimed_by: str, lease_seconds: float = CLAIM_LEASE_SECONDS) -> bool:
+    db = SessionLocal()
+    try:
+        return crud.renew_resume_ingest_lease(db, job_id, claimed_by, lease_seconds)
+    finally:
+        db.close()
+
+
+def _update_job(job_id: int, claimed_by: str, status: str, total: Optional[int] = None, error: Optional[str] = None):
+    db = SessionLocal()
+    try:
+        crud.update_resume_ingest_job(db, job_id, status=status, total=total, error=error, claimed_by=claimed_by)
+    finally:
+        db.close()
+
+
+def _checkpoint(job_id: int) -> Dict[str, tuple]:
+    db = SessionLocal()
+    try:
+        return crud.get_resume_ingest_checkpoint(db, job_id)
+    finally:
+        db.close()
+
+
+def _ensure_users(emails: List[str]) -> Dict[str, int]:
+    db = SessionLocal()
+    try:
+        user_ids = crud.get_or_create_users(db, emails)
+        db.commit()
+        return user_ids
+    finally:
+        db.close()
+
+
+def _record(job_id: int, entry_name: str, status: str, **fields):
+    db = SessionLocal()
+    try:
+        crud.record_resume_ingest_item(db, job_id=job_id, entry_name=entry_name, status=status, **fields)
+    finally:
+        db.close()
+
+
+# --- Job execution ---
+
+async def _process_entry(job_id: int, name: str, email: Optional[str], user_id: Optional[int],
+                         data: bytes, content_hash: str, pool: ProcessPoolExecutor):
+    try:
+        if email is None:
+            await asyncio.to_thread(
+                _record, job_id, name, "failed", content_hash=content_hash,
+                error="No email for this file. Name it <email>.pdf or list it in manifest.csv."
+            )
+            return
+
+        result = await asyncio.get_running_loop().run_in_executor(pool, resume_files.parse_resume_bytes, data)
+        if result["error"]:
+            await asyncio.to_thread(_record, job_id, name, "failed", email=email, content_hash=content_hash, error=result["error"])
+            return
+
+        try:
+            mimetype = resume_files.MIMETYPES[result["file_type"]]
+            if await asyncio.to_thread(archive_uploader.save_for_upload, user_id, os.path.basename(name), io.BytesIO(data), mimetype):
+                archive_uploader.uploader.notify()
+        except Exception as e:
+            print(f"--- ARCHIVE ERROR: Could not queue {name} for upload: {e} ---")
+
+        analysis = await ai_analysis.analyze_resume_text(result["text"], insights=result["insights"])
+        await asyncio.to_thread(
+            _record, job_id, name, "analyzed", email=email, content_hash=content_hash,
+            resume_text=result["text"].replace('\x00', ''), analysis=analysis.replace('\x00', '')
+        )
+    except Exception as e:
+        print(f"--- INGEST ERROR: Job {job_id} entry {name} failed: {e} ---")
+        await asyncio.to_thread(_record, job_id, name, "failed", email=email, content_hash=content_hash, error=str(e))
+
+
+async def _record_duplicate(job_id: int, name: str, email: Optional[str], content_hash: str,
+                            original_name: str, original_task: Optional[asyncio.Task]):
+    """Skips analysing a file already seen in this job, reusing the original's results once they exist."""
+    if original_task is not None:
+        await asyncio.wait([original_task])
+    await asyncio.to_thread(
+        _record, job_id, name, "duplicate", email=email, content_hash=content_hash,
+        error=f"Same file as {original_name}.", original_entry=original_name
+    )
+
+
+async def _keep_lease(job_id: int, claimed_by: str, work: asyncio.Task, lost: asyncio.Event):
+    """Renews the job's lease until cancelled; stops the work if another worker has taken the job over."""
+    while True:
+        await asyncio.sleep(LEASE_RENEW_SECONDS)
+        try:
+            if not await asyncio.to_thread(_renew, job_id, claimed_by):
+                print(f"--- INGEST ERROR: Lost the lease on job {job_id}; stopping here ---")
+                lost.set()
+                work.cancel()
+                return
+        except Exception as e:
+            print(f"--- INGEST ERROR: Could not renew the lease on job {job_id}: {e} ---")
+
+
+async def run_job(job_id: int):
+    """Claims the job and processes every entry that has no checkpoint yet. Does nothing if another worker holds it."""
+    claimed_by = uuid.uuid4().hex
+    job = await asyncio.to_thread(_claim_job, job_id, claimed_by)
+    if job is None:
+        return
+
+    work = asyncio.create_task(_run_claimed(job_id, claimed_by, *job))
+    lost = asyncio.Event()
+    lease_task = asyncio.create_task(_keep_lease(job_id, claimed_by, work, lost))
+    try:
+        await work
+    except asyncio.CancelledError:
+        if not lost.is_set():
+            # Shutting down: give up the lease so the job is resumed right away on restart.
+            await asyncio.shield(asyncio.to_thread(_renew, job_id, claimed_by, 0))
+            raise
+    finally:
+        lease_task.cancel()
+
+
+async def _run_claimed(job_id: int, claimed_by: str, source_path: str, owns_source: bool):
+    status, error = "done", None
+    try:
+        source = await asyncio.to_thread(ResumeSource, source_path)
+    except (OSError, zipfile.BadZipFile) as e:
+        await asyncio.to_thread(_update_job, job_id, claimed_by, "failed", None, f"Could not open {source_path}: {e}")
+        return
+
+    try:
+        names = await asyncio.to_thread(source.entry_names)
+        manifest = await asyncio.to_thread(source.read_manifest)
+        checkpoint = await asyncio.to_thread(_checkpoint, job_id)
+        await asyncio.to_thread(_update_job, job_id, claimed_by, "running", len(names))
+
+        pending = [name for name in names if name not in checkpoint]
+        if checkpoint:
+            print(f"--- INGEST: Resuming job {job_id}, {len(checkpoint)} of {len(names)} entries already done ---")
+        emails = {name: email_for_entry(name, manifest) for name in pending}
+        user_ids = await asyncio.to_thread(_ensure_users, sorted({e for e in emails.values() if e}))
+        # Content hash -> (first entry with that content, its task if it is still running),
+        # including entries done before a restart.
+        seen = {content_hash: (name, None) for name, (content_hash, _) in checkpoint.items() if content_hash}
+
+        window = asyncio.Semaphore(MAX_ENTRIES_IN_FLIGHT)
+        tasks = set()
+        # Spawned workers only import resume_files and skills_engine, not the web app.
+        pool = ProcessPoolExecutor(EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            for name in pending:
+                await window.acquire()
+                try:
+                    data = await asyncio.to_thread(source.read, name, resume_files.MAX_RESUME_BYTES)
+                except (ValueError, KeyError, OSError, zipfile.BadZipFile) as e:
+                    await asyncio.to_thread(_record, job_id, name, "failed", email=emails[name], error=str(e))
+                    window.release()
+                    continue
+
+                content_hash = hashlib.sha256(data).hexdigest()
+                if content_hash in seen:
+                    original_name, original_task = seen[content_hash]
+                    task = asyncio.create_task(_record_duplicate(job_id, name, emails[name], content_hash, original_name, original_task))
+                else:
+                    task = asyncio.create_task(_process_entry(
+                        job_id, name, emails[name], user_ids.get(emails[name]), data, content_hash, pool
+                    ))
+                    seen[content_hash] = (name, task)
+                task.add_done_callback(lambda _: window.release())
+                tasks.add(task)
+            await asyncio.gather(*tasks)
+        finally:
+            # On a lost lease, shutdown or error, stop the entries still in flight so they do not
+            # keep recording results after another worker has taken the job over.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            pool.shutdown(wait=False, cancel_futures=True)
+    except asyncio.CancelledError:
+        # Shutting down or lost the lease: leave the job "running" so it resumes from its checkpoint.
+        raise
+    except Exception as e:
+        print(f"--- INGEST ERROR: Job {job_id} stopped: {e} ---")
+        status, error = "failed", str(e)
+    finally:
+        source.close()
+
+    await asyncio.to_thread(_update_job, job_id, claimed_by, status, None, error)
+    if owns_source and status == "done":
+        try:
+            os.remove(source_path)
+        except OSError:
+            pass
+    print(f"--- INGEST: Job {job_id} finished with status '{status}' ---")
+
+
+def save_upload(stream: BinaryIO) -> str:
+    """Copies an uploaded ZIP archive into INGEST_DIR so the job can be resumed after a restart."""
+    os.makedirs(INGEST_DIR, exist_ok=True)
+    path = os.path.join(INGEST_DIR, f"{uuid.uuid4().hex}.zip")
+    stream.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(stream, out, 1024 * 1024)
+    if not zipfile.is_zipfile(path):
+        os.remove(path)
+        raise ValueError("The upload is not a ZIP archive.")
+    return path
+
+
+class IngestRunner:
+    """
+    Runs ingestion jobs one at a time in the background. Every POLL_INTERVAL_SECONDS it also
+    looks for unfinished jobs that no worker holds a lease on, e.g. after a crash or restart.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._submitted = set()
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(self, job_id: int):
+        # A job created just after startup can also be found by the unfinished-jobs scan.
+        if job_id not in self._submitted:
+            self._submitted.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _run(self):
+        while True:
+            if self._queue.empty():
+                try:
+                    for job_id in await asyncio.to_thread(_unfinished_jobs):
+                        self.submit(job_id)
+                except Exception as e:
+                    print(f"--- INGEST ERROR: Could not load unfinished jobs: {e} ---")
+            try:
+                job_id = await asyncio.wait_for(self._queue.get(), timeout=POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                continue
+            try:
+                await run_job(job_id)
+            except Exception as e:
+                print(f"--- INGEST ERROR: Job {job_id} stopped: {e} ---")
+            finally:
+                self._submitted.discard(job_id)
+
+
+def _unfinished_jobs() -> List[int]:
+    db = SessionLocal()
+    try:
+        return crud.get_unfinished_resume_ingest_jobs(db)
+    finally:
+        db.close()
+
+
+runner = IngestRunner()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a ZIP archive or directory of resumes.")
+    parser.add_argument("path", nargs="?", help="ZIP archive or directory of .pdf/.docx resumes")
+    parser.add_argument("--resume", type=int, metavar="JOB_ID", help="Continue an interrupted job from its checkpoint")
+    args = parser.parse_args()
+    if not args.path and not args.resume:
+        parser.error("give a path or --resume JOB_ID")
+
+    import models
+    import migrations
+    from database import engine
+    models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
+
+    job_id = args.resume
+    if job_id is None:
+        db = SessionLocal()
+        try:
+            job_id = crud.create_resume_ingest_job(db, source_path=os.path.abspath(args.path), owns_source=False, created_by="cli").id
+        finally:
+            db.close()
+        print(f"Created ingestion job {job_id}. If it is interrupted, continue with --resume {job_id}.")
+
+    asyncio.run(run_job(job_id))
+
+    db = SessionLocal()
+    try:
+        job = crud.get_resume_ingest_job(db, job_id)
+        if job is not None and job.status == "running":
+            print(f"Job {job_id} is being run by another worker; try again after its lease expires.")
+        print(f"Entries by status: {crud.get_resume_ingest_counts(db, job_id)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 # Updated for Magic Link authentication.
 
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 # --- NEW SCHEMAS for Magic Link Flow ---
@@ -13,6 +13,40 @@ class MagicLinkRequest(BaseModel):
 class MagicLinkLogin(BaseModel):
     token: str
 
+# --- Invitation Schemas ---
+
+class InviteRequest(BaseModel):
+    # Addresses are validated individually so one bad entry doesn't reject the whole import
+    emails: List[str]
+    send_email: bool = True
+
+class InviteJob(BaseModel):
+    id: int
+    status: str
+    total: int
+    invalid: int
+    sent: int
+    failed: int
+    last_error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
+# --- Resume Ingestion Schemas ---
+
+class ResumeIngestJob(BaseModel):
+    id: int
+    status: str
+    total: int
+    # Finished entries per status (analyzed, duplicate, failed)
+    counts: Dict[str, int] = {}
+    last_error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
 # --- Token and User Schemas ---
 
 class Token(BaseModel):
@@ -28,6 +62,7 @@ class User(UserBase):
     created_at: datetime
     resume_text: Optional[str] = None
     resume_analysis: Optional[str] = None
+    resume_url: Optional[str] = None
     assessments: List['Assessment'] = []
     class Config:
         from_attributes = True
@@ -53,6 +88,21 @@ class Question(QuestionCreate):
     class Config:
         from_attributes = True
 
+# --- Course Schemas ---
+
+class CourseCreate(BaseModel):
+    title: str
+    platform: Optional[str] = None
+    category: str
+    skill_tags: Optional[str] = None
+    url: Optional[str] = None
+    description: Optional[str] = None
+
+class Course(CourseCreate):
+    id: int
+    class Config:
+        from_attributes = True
+
 # --- Assessment Schemas ---
 
 class AnswerSubmit(BaseModel):
@@ -61,6 +111,14 @@ class AnswerSubmit(BaseModel):
 
 class AssessmentSubmit(BaseModel):
     answers: List[AnswerSubmit]
+    # From POST /assessment/attempts; only the questions served for it are accepted. Required
+    # unless ALLOW_SUBMIT_WITHOUT_ATTEMPT is set for old clients.
+    attempt_id: Optional[str] = None
+
+class AssessmentAttempt(BaseModel):
+    attempt_id: str
+    expires_at: datetime
+    questions: List[Question]
 
 class Assessment(BaseModel):
     id: int
@@ -69,8 +127,82 @@ class Assessment(BaseModel):
     analysis: Optional[str] = None
     course_suggestions: Optional[str] = None
     created_at: datetime
+    # "Top X%" standing per category and overall ("__total__"); only set on submit.
+    cohort_percentiles: Optional[Dict[str, float]] = None
     class Config:
         from_attributes = True
 
+class BatchScoreError(BaseModel):
+    line: Optional[int] = None
+    email: Optional[str] = None
+    error: str
+
+class BatchScoreResult(BaseModel):
+    sheets: int
+    scored: int
+    error_count: int
+    errors: List[BatchScoreError] = []
+    assessment_ids: List[int] = []
+
+class FeedbackQueueStatus(BaseModel):
+    # Number of deferred AI feedback jobs per status (pending, running, done, failed)
+    counts: Dict[str, int] = {}
+
+class MagicTokenStats(BaseModel):
+    live_tokens: int
+    total_tokens: int
+    deleted_total: int  # Since the server started
+    last_run_at: Optional[datetime] = None
+    last_run_deleted: int
+    last_run_seconds: float
+    last_run_rows_per_second: float
+
+class AdmissionClassStats(BaseModel):
+    concurrency: int
+    max_queue: int
+    max_wait_seconds: float
+    active: int
+    queued: int
+    peak_queued: int
+    admitted: int
+    waited: int  # Admitted after queueing
+    avg_wait_ms: float
+    avg_service_ms: float
+    shed_queue_full: int
+    shed_timeout: int
+
+# --- Progress Schemas ---
+
+class CategoryProgress(BaseModel):
+    attempts: int
+    mean_percentage: float
+    rolling_percentage: float
+    last_percentage: float
+
+class UserProgress(BaseModel):
+    attempt_count: int = 0
+    best_score: Optional[float] = None
+    last_score: Optional[float] = None
+    mean_score: Optional[float] = None
+    categories: Dict[str, CategoryProgress] = {}
+
+class CohortStanding(BaseModel):
+    assessment_id: Optional[int] = None
+    # "Top X%" standing per category and overall ("__total__")
+    percentiles: Dict[str, float] = {}
+
+# --- Resume Insight Schemas ---
+
+class RoleMatch(BaseModel):
+    role: str
+    match_score: float
+    coverage: float
+    missing_skills: List[str] = []
+
+class ResumeInsights(BaseModel):
+    detected_skills: List[str] = []
+    role_matches: List[RoleMatch] = []
+    keywords_to_add: List[str] = []
+
 # This is needed for the User schema to correctly handle the relationship
 User.model_rebuild()
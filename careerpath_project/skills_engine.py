@@ -0,0 +1,283 @@
+# skills_engine.py
+# Local, deterministic skill extraction and role matching for resumes.
+# The curated vocabulary below is compiled once into an Aho-Corasick automaton,
+# and every target role is held as a TF-IDF vector in a NumPy matrix, so a
+# resume can be scored against all roles in a single pass without calling the LLM.
+
+import math
+from collections import deque
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# --- Skill Vocabulary ---
+# Canonical skill name -> aliases as they typically appear in resumes.
+# Aliases are matched case-insensitively on word boundaries.
+SKILL_VOCABULARY: Dict[str, List[str]] = {
+    # Accounting & Finance
+    "Tally ERP": ["tally", "tally erp", "tally prime", "tally erp 9"],
+    "SAP FICO": ["sap fico", "sap fi", "sap co", "sap s/4hana"],
+    "ERP Systems": ["erp", "oracle erp", "microsoft dynamics", "netsuite", "zoho books"],
+    "QuickBooks": ["quickbooks", "quick books"],
+    "Accounts Payable": ["accounts payable", "ap process", "vendor payments"],
+    "Accounts Receivable": ["accounts receivable", "ar process", "collections", "invoicing"],
+    "Bookkeeping": ["bookkeeping", "book keeping", "journal entries", "ledger", "general ledger"],
+    "Bank Reconciliation": ["bank reconciliation", "reconciliation", "brs"],
+    "Financial Reporting": ["financial reporting", "financial statements", "balance sheet", "profit and loss", "p&l", "cash flow statement"],
+    "Financial Modelling": ["financial modelling", "financial modeling", "financial model", "dcf", "valuation"],
+    "Budgeting & Forecasting": ["budgeting", "forecasting", "variance analysis"],
+    "GST": ["gst", "goods and services tax", "gst returns", "gstr"],
+    "Direct Taxation": ["income tax", "direct tax", "direct taxation", "tds", "itr filing"],
+    "Auditing": ["audit", "auditing", "internal audit", "statutory audit"],
+    "Costing": ["cost accounting", "costing", "cost analysis"],
+    "Payroll": ["payroll", "payroll processing"],
+    # Data & Analytics
+    "Advanced Excel": ["advanced excel", "ms excel", "excel", "vlookup", "xlookup", "pivot tables", "pivot table", "macros", "vba"],
+    "SQL": ["sql", "mysql", "postgresql", "postgres", "sql server", "pl/sql"],
+    "Power BI": ["power bi", "powerbi", "dax"],
+    "Tableau": ["tableau"],
+    "Data Analysis": ["data analysis", "data analytics", "analytics", "data visualization", "dashboarding", "dashboards"],
+    "Business Analytics": ["business analytics", "business analysis", "requirement gathering"],
+    "Statistics": ["statistics", "statistical analysis", "regression", "hypothesis testing"],
+    "Python": ["python", "pandas", "numpy"],
+    "R": ["r programming", "rstudio"],
+    "Machine Learning": ["machine learning", "scikit-learn", "sklearn", "deep learning"],
+    "AI Tools": ["chatgpt", "generative ai", "gen ai", "prompt engineering", "copilot", "gemini"],
+    # Software
+    "Java": ["java", "spring boot", "spring"],
+    "JavaScript": ["javascript", "typescript", "node.js", "nodejs", "react", "react.js", "angular", "vue"],
+    "Web Development": ["html", "css", "web development", "frontend", "backend", "rest api", "rest apis"],
+    "C/C++": ["c++", "c programming"],
+    "Cloud": ["aws", "azure", "gcp", "google cloud", "cloud computing"],
+    "Git": ["git", "github", "gitlab", "version control"],
+    # Business & Marketing
+    "Digital Marketing": ["digital marketing", "seo", "sem", "social media marketing", "google ads", "content marketing"],
+    "Sales": ["sales", "business development", "lead generation", "cold calling"],
+    "CRM": ["crm", "salesforce", "hubspot", "zoho crm"],
+    "Market Research": ["market research", "competitor analysis", "survey design"],
+    "Supply Chain": ["supply chain", "logistics", "inventory management", "procurement"],
+    "Project Management": ["project management", "agile", "scrum", "jira", "pmp"],
+    "HR Operations": ["recruitment", "talent acquisition", "onboarding", "hr operations", "hrms"],
+    # Soft Skills
+    "Communication": ["communication", "communication skills", "presentation", "presentations", "public speaking"],
+    "Teamwork": ["teamwork", "team player", "collaboration"],
+    "Leadership": ["leadership", "team lead", "led a team", "mentoring"],
+    "Problem Solving": ["problem solving", "problem-solving", "critical thinking"],
+    "Time Management": ["time management", "task management", "prioritization"],
+}
+
+# --- Target Role Profiles ---
+# Each role is described by its skills with relative importance weights.
+# These act as the "documents" for the TF-IDF model.
+ROLE_PROFILES: Dict[str, Dict[str, float]] = {
+    "Accounts Executive": {
+        "Tally ERP": 3, "Bookkeeping": 3, "Accounts Payable": 2, "Accounts Receivable": 2,
+        "Bank Reconciliation": 2, "GST": 2, "Direct Taxation": 1, "Advanced Excel": 2,
+        "ERP Systems": 1, "Payroll": 1, "Communication": 1,
+    },
+    "Financial Analyst": {
+        "Financial Modelling": 3, "Financial Reporting": 3, "Budgeting & Forecasting": 3,
+        "Advanced Excel": 3, "Power BI": 1, "SQL": 1, "Statistics": 1, "Data Analysis": 2,
+        "Communication": 1,
+    },
+    "Tax Associate": {
+        "GST": 3, "Direct Taxation": 3, "Auditing": 1, "Tally ERP": 2, "Bookkeeping": 1,
+        "Advanced Excel": 1, "Financial Reporting": 1,
+    },
+    "Audit Associate": {
+        "Auditing": 3, "Financial Reporting": 2, "Bookkeeping": 1, "Costing": 1,
+        "Advanced Excel": 2, "SAP FICO": 1, "Communication": 1, "Problem Solving": 1,
+    },
+    "ERP / SAP FICO Consultant": {
+        "SAP FICO": 3, "ERP Systems": 3, "Accounts Payable": 1, "Accounts Receivable": 1,
+        "Financial Reporting": 1, "Business Analytics": 1, "Communication": 1,
+    },
+    "Data Analyst": {
+        "SQL": 3, "Advanced Excel": 2, "Power BI": 2, "Tableau": 2, "Python": 2,
+        "Data Analysis": 3, "Statistics": 2, "Communication": 1,
+    },
+    "Business Analyst": {
+        "Business Analytics": 3, "Data Analysis": 2, "SQL": 2, "Advanced Excel": 2,
+        "Power BI": 1, "Project Management": 1, "Communication": 2, "Problem Solving": 1,
+    },
+    "Software Developer": {
+        "Java": 2, "JavaScript": 2, "Python": 2, "Web Development": 2, "SQL": 1,
+        "Git": 2, "Cloud": 1, "C/C++": 1, "Problem Solving": 2,
+    },
+    "Digital Marketing Executive": {
+        "Digital Marketing": 3, "Market Research": 2, "CRM": 1, "Data Analysis": 1,
+        "AI Tools": 1, "Communication": 2,
+    },
+    "Sales & Business Development": {
+        "Sales": 3, "CRM": 2, "Market Research": 1, "Communication": 3, "Leadership": 1,
+        "Teamwork": 1,
+    },
+    "HR Executive": {
+        "HR Operations": 3, "Payroll": 2, "Communication": 2, "Advanced Excel": 1,
+        "Teamwork": 1, "Time Management": 1,
+    },
+    "Operations / Supply Chain Analyst": {
+        "Supply Chain": 3, "ERP Systems": 2, "Advanced Excel": 2, "Data Analysis": 1,
+        "Project Management": 1, "Problem Solving": 1,
+    },
+}
+
+
+# --- Multi-Pattern Matcher ---
+
+class AhoCorasick:
+    """
+    A compact Aho-Corasick automaton over lowercase patterns.
+    Every pattern maps to a payload (here: the canonical skill name), and
+    matches are only reported when they sit on word boundaries.
+    """
+
+    def __init__(self, patterns: Dict[str, str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, str]]] = [[]]
+
+        for pattern, payload in patterns.items():
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append((len(pattern), payload))
+
+        # Breadth-first pass to compute failure links and merge outputs.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(char, 0) if state else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """Returns (start, end, payload) for every word-bounded match in the text."""
+        matches = []
+        state = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        text_len = len(text)
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not out[state]:
+                continue
+            for length, payload in out[state]:
+                start = index - length + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if index + 1 < text_len and _is_word_char(text[index + 1]):
+                    continue
+                matches.append((start, index + 1, payload))
+        return matches
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+# --- TF-IDF Role Model ---
+
+def _build_role_model():
+    """Builds the (roles x skills) TF-IDF matrix, L2-normalised per role."""
+    skills = list(SKILL_VOCABULARY.keys())
+    roles = list(ROLE_PROFILES.keys())
+    skill_index = {skill: i for i, skill in enumerate(skills)}
+
+    weights = np.zeros((len(roles), len(skills)), dtype=np.float64)
+    for row, role in enumerate(roles):
+        for skill, weight in ROLE_PROFILES[role].items():
+            weights[row, skill_index[skill]] = weight
+
+    # Skills required by fewer roles are more discriminative.
+    document_frequency = np.count_nonzero(weights, axis=0)
+    idf = np.log((1 + len(roles)) / (1 + document_frequency)) + 1.0
+
+    matrix = weights * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return skills, skill_index, roles, idf, matrix / norms, weights > 0
+
+
+_AUTOMATON = AhoCorasick({
+    alias.lower(): skill
+    for skill, aliases in SKILL_VOCABULARY.items()
+    for alias in aliases + [skill]
+})
+SKILLS, _SKILL_INDEX, ROLES, _IDF, _ROLE_MATRIX, _ROLE_MASK = _build_role_model()
+
+
+def extract_skills(text: str) -> Dict[str, int]:
+    """Returns the canonical skills found in the text with their mention counts."""
+    counts: Dict[str, int] = {}
+    covered_until = 0
+    # Keep only leftmost-longest matches so "tally erp 9" is not also counted as "erp".
+    for start, end, skill in sorted(_AUTOMATON.find_all(text.lower()), key=lambda m: (m[0], -m[1])):
+        if start < covered_until:
+            continue
+        covered_until = end
+        counts[skill] = counts.get(skill, 0) + 1
+    return counts
+
+
+def score_roles(skill_counts: Dict[str, int], top_n: int = 3) -> List[dict]:
+    """
+    Scores a set of extracted skills against every target role.
+    Returns the best matching roles with cosine similarity, skill coverage,
+    and the most valuable missing skills for each role.
+    """
+    vector = np.zeros(len(SKILLS), dtype=np.float64)
+    for skill, count in skill_counts.items():
+        vector[_SKILL_INDEX[skill]] = 1.0 + math.log(count)
+    vector *= _IDF
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+
+    similarity = _ROLE_MATRIX @ vector
+    present = vector > 0
+    coverage = (_ROLE_MASK & present).sum(axis=1) / _ROLE_MASK.sum(axis=1)
+
+    results = []
+    for row in np.argsort(-similarity, kind="stable")[:top_n]:
+        missing = np.flatnonzero(_ROLE_MASK[row] & ~present)
+        missing = missing[np.argsort(-_ROLE_MATRIX[row, missing], kind="stable")]
+        results.append({
+            "role": ROLES[row],
+            "match_score": round(float(similarity[row]) * 100, 1),
+            "coverage": round(float(coverage[row]) * 100, 1),
+            "missing_skills": [SKILLS[i] for i in missing],
+        })
+    return results
+
+
+def analyze_resume(text: str, top_n: int = 3, keyword_count: int = 5) -> dict:
+    """
+    Computes the local resume insights: detected skills, best matching roles,
+    and the top keywords to add (missing skills of the best matching roles).
+    """
+    skill_counts = extract_skills(text)
+    role_matches = score_roles(skill_counts, top_n=top_n)
+
+    keywords_to_add: List[str] = []
+    for match in role_matches:
+        for skill in match["missing_skills"]:
+            if skill not in keywords_to_add:
+                keywords_to_add.append(skill)
+    return {
+        "detected_skills": sorted(skill_counts, key=lambda s: (-skill_counts[s], s)),
+        "role_matches": role_matches,
+        "keywords_to_add": keywords_to_add[:keyword_count],
+    }
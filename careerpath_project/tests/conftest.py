@@ -0,0 +1,57 @@
+# conftest.py
+# Runs the tests against a throwaway SQLite database. The app modules read DATABASE_URL
+# when they are imported, so it is set here before any of them is.
+#
+# Run from careerpath_project/: python -m pytest tests
+
+import os
+import sys
+import tempfile
+
+_db_dir = tempfile.mkdtemp(prefix="careerpath-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import models
+from database import SessionLocal, engine
+
+
+@pytest.fixture(autouse=True)
+def tables():
+    models.Base.metadata.create_all(bind=engine)
+    yield
+    models.Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+class FakeClock:
+    """Stands in for the `time` module so time-based limits can be tested without sleeping."""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,92 @@
+import asyncio
+
+from admission import AdmissionClass
+
+
+def test_acquire_admits_up_to_concurrency():
+    async def run():
+        limit = AdmissionClass("test", concurrency=2, max_queue=0, max_wait=1)
+        assert await limit.acquire()
+        assert await limit.acquire()
+        assert not await limit.acquire()
+        assert limit.active == 2 and limit.shed_queue_full == 1
+        limit.release()
+        assert limit.active == 1
+        assert await limit.acquire()
+
+    asyncio.run(run())
+
+
+def test_release_hands_slot_to_oldest_waiter():
+    async def run():
+        limit = AdmissionClass("test", concurrency=1, max_queue=2, max_wait=1)
+        assert await limit.acquire()
+        order = []
+
+        async def wait(name):
+            assert await limit.acquire()
+            order.append(name)
+
+        first = asyncio.create_task(wait("first"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(wait("second"))
+        await asyncio.sleep(0)
+        assert limit.queued == 2
+        assert not await limit.acquire()  # Queue full
+
+        limit.release()
+        await first
+        limit.release()
+        await second
+        assert order == ["first", "second"]
+        assert limit.active == 1 and limit.queued == 0 and limit.waited == 2
+
+    asyncio.run(run())
+
+
+def test_waiter_is_shed_after_deadline():
+    async def run():
+        limit = AdmissionClass("test", concurrency=1, max_queue=1, max_wait=0.05)
+        assert await limit.acquire()
+        assert not await limit.acquire()
+        assert limit.shed_timeout == 1 and limit.queued == 0
+        limit.release()
+        assert limit.active == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        limit = AdmissionClass("test", concurrency=1, max_queue=1, max_wait=1)
+        assert await limit.acquire()
+        waiter = asyncio.create_task(limit.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert limit.queued == 0
+        limit.release()
+        assert limit.active == 0
+
+    asyncio.run(run())
+
+
+def test_slot_handed_to_cancelled_waiter_is_not_lost():
+    async def run():
+        limit = AdmissionClass("test", concurrency=1, max_queue=2, max_wait=1)
+        assert await limit.acquire()
+        first = asyncio.create_task(limit.acquire())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(limit.acquire())
+        await asyncio.sleep(0)
+
+        limit.release()  # Hands the slot to `first`, which is cancelled before it runs
+        first.cancel()
+        (admitted,) = await asyncio.gather(first, return_exceptions=True)
+        if admitted is True:
+            # Some Python versions let wait_for() swallow a cancel once the slot has arrived.
+            limit.release()
+        assert await second
+        assert limit.active == 1 and limit.queued == 0
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+import threading
+from datetime import datetime, timedelta
+
+import crud
+import models
+import schemas
+from database import SessionLocal
+
+ANSWERS = [schemas.AnswerSubmit(question_id=1, selected_option_id=1)]
+SUMMARY = {"Projects": {"score": 1, "total": 2}}
+
+
+def _attempt(db, email="student@example.com") -> tuple:
+    user = crud.get_or_create_user(db, email)
+    attempt = crud.create_assessment_attempt(
+        db, "attempt-1", user.id, question_ids=[1], expires_at=datetime.utcnow() + timedelta(hours=1)
+    )
+    return user.id, attempt.id
+
+
+def test_attempt_is_submitted_once(db):
+    user_id, attempt_id = _attempt(db)
+    first = crud.create_assessment(db, user_id, 50.0, ANSWERS, categories_summary=SUMMARY, attempt_id=attempt_id)
+    assert first is not None
+    assert crud.create_assessment(db, user_id, 50.0, ANSWERS, categories_summary=SUMMARY, attempt_id=attempt_id) is None
+
+    assert db.query(models.Assessment).count() == 1
+    assert db.query(models.Answer).count() == len(ANSWERS)
+    assert crud.get_assessment_attempt(db, attempt_id, user_id).assessment_id == first.id
+
+
+def test_concurrent_submissions_of_one_attempt():
+    db = SessionLocal()
+    user_id, attempt_id = _attempt(db)
+    db.close()
+    start = threading.Barrier(2)
+    results = []
+
+    def submit():
+        session = SessionLocal()
+        try:
+            start.wait()
+            assessment = crud.create_assessment(
+                session, user_id, 50.0, ANSWERS, categories_summary=SUMMARY, attempt_id=attempt_id
+            )
+            results.append(assessment.id if assessment is not None else None)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=submit) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 2 and results.count(None) == 1
+    db = SessionLocal()
+    try:
+        assert db.query(models.Assessment).count() == 1
+    finally:
+        db.close()
+
+
+def test_attempt_claim_is_exclusive_until_released(db):
+    user_id, attempt_id = _attempt(db)
+    assert crud.claim_assessment_attempt(db, attempt_id, user_id, "first", lease_seconds=60)
+    assert not crud.claim_assessment_attempt(db, attempt_id, user_id, "second", lease_seconds=60)
+
+    crud.release_assessment_attempt(db, attempt_id, "second")  # Not the holder: no effect
+    assert not crud.claim_assessment_attempt(db, attempt_id, user_id, "second", lease_seconds=60)
+    crud.release_assessment_attempt(db, attempt_id, "first")
+    assert crud.claim_assessment_attempt(db, attempt_id, user_id, "second", lease_seconds=60)
+
+
+def test_expired_attempt_claim_can_be_taken_over(db):
+    user_id, attempt_id = _attempt(db)
+    assert crud.claim_assessment_attempt(db, attempt_id, user_id, "first", lease_seconds=-1)
+    assert crud.claim_assessment_attempt(db, attempt_id, user_id, "second", lease_seconds=60)
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import idempotency
+
+
+class Operation:
+    """Counts its runs; returns a fresh dict each time, or raises if `error` is set."""
+
+    def __init__(self, delay: float = 0, error: Exception = None):
+        self.delay, self.error, self.runs = delay, error, 0
+
+    async def __call__(self):
+        self.runs += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"run": self.runs}
+
+
+def run(operation, key="key-1", request_fingerprint="fp"):
+    return idempotency.run_idempotent("test", key, request_fingerprint, operation, dict)
+
+
+def test_without_key_always_runs():
+    operation = Operation()
+    assert asyncio.run(run(operation, key=None)) == ({"run": 1}, False)
+    assert asyncio.run(run(operation, key=None)) == ({"run": 2}, False)
+
+
+def test_retry_replays_stored_response():
+    operation = Operation()
+    assert asyncio.run(run(operation)) == ({"run": 1}, False)
+    assert asyncio.run(run(operation)) == ({"run": 1}, True)
+    assert operation.runs == 1
+
+
+def test_different_payload_is_rejected():
+    asyncio.run(run(Operation()))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run(Operation(), request_fingerprint="other"))
+    assert error.value.status_code == 422
+
+
+def test_concurrent_duplicate_waits_for_original():
+    operation = Operation(delay=0.1)
+
+    async def both():
+        return await asyncio.gather(run(operation), run(operation))
+
+    results = sorted(asyncio.run(both()), key=lambda result: result[1])
+    assert results == [({"run": 1}, False), ({"run": 1}, True)]
+    assert operation.runs == 1
+
+
+def test_failed_operation_releases_key():
+    with pytest.raises(RuntimeError):
+        asyncio.run(run(Operation(error=RuntimeError("boom"))))
+    operation = Operation()
+    assert asyncio.run(run(operation)) == ({"run": 1}, False)
+
+
+def test_response_is_stored_when_client_disconnects(monkeypatch):
+    complete = idempotency._complete
+
+    def slow_complete(*args):
+        time.sleep(0.1)
+        complete(*args)
+
+    monkeypatch.setattr(idempotency, "_complete", slow_complete)
+    operation = Operation()
+
+    async def disconnect():
+        request = asyncio.create_task(run(operation))
+        while operation.runs == 0:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.02)  # The response is being stored
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+        await asyncio.gather(*idempotency._completing)
+
+    asyncio.run(disconnect())
+    assert asyncio.run(run(operation)) == ({"run": 1}, True)
+    assert operation.runs == 1
+
+
+def test_store_is_retried(monkeypatch):
+    complete = idempotency._complete
+    failures = []
+
+    def flaky_complete(*args):
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("database went away")
+        complete(*args)
+
+    monkeypatch.setattr(idempotency, "_complete", flaky_complete)
+    monkeypatch.setattr(idempotency, "COMPLETE_RETRY_SECONDS", 0)
+    operation = Operation()
+    assert asyncio.run(run(operation)) == ({"run": 1}, False)
+    assert asyncio.run(run(operation)) == ({"run": 1}, True)
+    assert failures == [1] and operation.runs == 1
@@ -0,0 +1,59 @@
+import pytest
+
+import rate_limits
+from rate_limits import DatabaseBackend, MemoryBackend
+
+
+@pytest.fixture(autouse=True)
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(rate_limits, "time", clock)
+
+
+def test_memory_bucket_allows_burst_then_refills(clock):
+    backend = MemoryBackend()
+    assert [backend.hit("k", 3, 60)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = backend.hit("k", 3, 60)
+    assert not allowed and retry_after == pytest.approx(20)
+    assert backend.hit("other", 3, 60)[0]
+
+    clock.advance(20)
+    assert backend.hit("k", 3, 60)[0]
+    assert not backend.hit("k", 3, 60)[0]
+
+
+def test_memory_backend_prunes_idle_keys(clock):
+    backend = MemoryBackend(max_keys=2)
+    backend.hit("a", 1, 10)
+    backend.hit("b", 1, 10)
+    clock.advance(10)
+    backend.hit("c", 1, 10)
+    assert set(backend._buckets) == {"c"}
+
+
+def test_database_window_limits_and_reports_retry_after(clock):
+    backend = DatabaseBackend()
+    clock.now = 600 * 1000 + 30  # 30 seconds into a 60-second window
+    assert [backend.hit("k", 3, 60)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = backend.hit("k", 3, 60)
+    assert not allowed and retry_after == pytest.approx(30)
+    assert backend.hit("other", 3, 60)[0]
+
+
+def test_database_window_slides(clock):
+    backend = DatabaseBackend()
+    clock.now = 600 * 1000 + 30
+    for _ in range(4):
+        backend.hit("k", 3, 60)
+
+    # Halfway into the next window, half of the previous window's 4 hits still count.
+    clock.advance(60)
+    assert backend.hit("k", 3, 60)[0]
+    allowed, retry_after = backend.hit("k", 3, 60)
+    assert not allowed and retry_after == pytest.approx(15)
+
+
+def test_check_returns_whole_seconds(monkeypatch):
+    monkeypatch.setattr(rate_limits, "backend", MemoryBackend())
+    assert rate_limits.check("scope", "key", (1, 60)) == 0
+    assert rate_limits.check("scope", "key", (1, 60)) == 60
+    assert rate_limits.check("other", "key", (1, 60)) == 0
@@ -0,0 +1,105 @@
+# token_reaper.py
+# Background cleanup of the magic_tokens table.
+# Used and expired tokens can never log anyone in again, but were kept forever, so every
+# login scanned a table that grew with the number of past logins. This worker deletes
+# them in small batches, each its own short transaction, and pauses between batches so
+# it never holds locks for long. Its throughput and the table size are reported by stats().
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+import crud
+from database import SessionLocal
+
+# --- Configuration ---
+TOKEN_REAP_INTERVAL_SECONDS = float(os.getenv("TOKEN_REAP_INTERVAL_SECONDS", "300"))
+TOKEN_REAP_BATCH_SIZE = int(os.getenv("TOKEN_REAP_BATCH_SIZE", "500"))
+# Pause between batches, so logins are never queued behind a long run of deletes.
+BATCH_PAUSE_SECONDS = 0.05
+
+
+def _reap_batch(limit: int) -> int:
+    db = SessionLocal()
+    try:
+        return crud.delete_dead_magic_tokens(db, limit=limit)
+    finally:
+        db.close()
+
+
+def _table_counts() -> dict:
+    db = SessionLocal()
+    try:
+        return crud.get_magic_token_counts(db)
+    finally:
+        db.close()
+
+
+class TokenReaper:
+    """Deletes dead magic tokens every `interval` seconds, `batch_size` rows per transaction."""
+
+    def __init__(self, interval: float = TOKEN_REAP_INTERVAL_SECONDS, batch_size: int = TOKEN_REAP_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.deleted_total = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_deleted = 0
+        self.last_run_seconds = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def reap(self) -> int:
+        """Deletes dead tokens batch by batch until none are left. Returns how many were deleted."""
+        started = time.monotonic()
+        deleted = 0
+        while True:
+            batch = await asyncio.to_thread(_reap_batch, self.batch_size)
+            deleted += batch
+            self.deleted_total += batch
+            if batch < self.batch_size:
+                break
+            await asyncio.sleep(BATCH_PAUSE_SECONDS)
+        self.last_run_at = datetime.utcnow()
+        self.last_run_deleted = deleted
+        self.last_run_seconds = time.monotonic() - started
+        if deleted:
+            print(f"--- TOKEN REAPER: Deleted {deleted} used or expired magic tokens in {self.last_run_seconds:.2f}s ---")
+        return deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reap()
+            except Exception as e:
+                print(f"--- TOKEN REAPER ERROR: {e} ---")
+            await asyncio.sleep(self.interval)
+
+    async def stats(self) -> dict:
+        """Table size and reaper throughput."""
+        counts = await asyncio.to_thread(_table_counts)
+        return {
+            "live_tokens": counts["live"],
+            "total_tokens": counts["total"],
+            "deleted_total": self.deleted_total,
+            "last_run_at": self.last_run_at,
+            "last_run_deleted": self.last_run_deleted,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+            "last_run_rows_per_second": round(self.last_run_deleted / self.last_run_seconds, 1) if self.last_run_seconds else 0.0,
+        }
+
+
+reaper = TokenReaper()
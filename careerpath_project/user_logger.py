@@ -38,3 +38,16 @@ def log_user_email(email: str):
     except Exception as e:
         print(f"--- LOGGER: FAILED to log email {email}. Error: {e} ---")
 
+def log_user_emails(emails: list):
+    """Appends many emails to the log file with a single open, e.g. for a bulk invitation."""
+    file_exists = os.path.isfile(LOG_FILE)
+    timestamp = datetime.now().isoformat()
+    try:
+        with open(LOG_FILE, 'a', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=['email', 'timestamp'])
+            if not file_exists:
+                writer.writeheader()
+            writer.writerows({'email': email, 'timestamp': timestamp} for email in emails)
+        print(f"--- LOGGER: Successfully logged {len(emails)} emails ---")
+    except Exception as e:
+        print(f"--- LOGGER: FAILED to log {len(emails)} emails. Error: {e} ---")